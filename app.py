@@ -1,14 +1,12 @@
 import os
-from flask import Flask, request, jsonify, render_template, redirect, url_for
-from werkzeug.utils import secure_filename
+import json
+from flask import Flask, Response, request, jsonify, render_template, redirect, url_for, stream_with_context
 from mayuan_agent import MayuanQuestionAgent
 from mayuan_kg_agent import MayuanKnowledgeGraphAgent
 import uuid
-import tempfile
-import base64
-from io import BytesIO
-from PIL import Image
 from role_agent import SocratesAgent
+from common_utils.image_payload import ImagePayload, InvalidImageError
+from common_utils.session_store import create_session_store
 
 # ---------- Knowledge-Graph Agent 包装 ----------
 # 为了与 QuestionAgent 保持统一的调用接口，
@@ -49,7 +47,7 @@ class MayuanKGAgent(MayuanKnowledgeGraphAgent):
             topic = topic.replace(kw, "")
 
         # 移除多余空格和常见中文标点
-        topic = topic.strip().lstrip("，,。 、")
+        topic = topic.strip().lstrip("，,。 、").rstrip("的，,。 、")
 
         return topic if topic else user_input
 
@@ -62,42 +60,25 @@ app = Flask(__name__)
 
 # 配置文件上传
 app.config['MAX_CONTENT_LENGTH'] = 16 * 1024 * 1024  # 16MB max file size
-app.config['UPLOAD_FOLDER'] = tempfile.gettempdir()
-ALLOWED_EXTENSIONS = {'png', 'jpg', 'jpeg', 'gif', 'bmp', 'webp'}
 
-def allowed_file(filename):
-    """检查文件类型是否允许"""
-    return '.' in filename and \
-           filename.rsplit('.', 1)[1].lower() in ALLOWED_EXTENSIONS
-
-def save_uploaded_image(image_data):
-    """保存base64编码的图片数据并返回文件路径"""
-    try:
-        # 解析base64数据
-        if image_data.startswith('data:image'):
-            header, data = image_data.split(',', 1)
-            image_binary = base64.b64decode(data)
-        else:
-            image_binary = base64.b64decode(image_data)
-        
-        # 创建临时文件
-        temp_file = tempfile.NamedTemporaryFile(delete=False, suffix='.jpg')
-        temp_file.write(image_binary)
-        temp_file.close()
-        
-        return temp_file.name
-        
-    except Exception as e:
-        print(f"保存图片失败: {e}")
-        return None
-
-def cleanup_temp_file(file_path):
-    """清理临时文件"""
-    try:
-        if file_path and os.path.exists(file_path):
-            os.unlink(file_path)
-    except Exception as e:
-        print(f"清理临时文件失败: {e}")
+def read_request():
+    """解析请求字段和图片，返回 (字段字典, ImagePayload 或 None)
+
+    支持两种格式：
+    - JSON：图片在 "image" 字段中，为 base64 或 data URL；
+    - multipart/form-data：文本字段在表单中，图片为 "image" 文件字段，省去 base64 编解码。
+    图片只在内存中解码一次，不写临时文件；无效图片抛出 InvalidImageError。
+    """
+    if request.mimetype == 'multipart/form-data':
+        data = request.form.to_dict()
+        upload = request.files.get("image")
+        image = ImagePayload.from_stream(upload.stream) if upload and upload.filename else None
+    else:
+        # 无论 client Content-Type 如何，安全地解析 JSON，避免 request.json 为 None
+        data = request.get_json(silent=True) or {}
+        image_data = data.get("image")
+        image = ImagePayload.from_base64(image_data) if image_data else None
+    return data, image
 
 # Load Agents
 # It's better to load these once at startup.
@@ -116,7 +97,9 @@ except Exception as e:
     kg_agent = None
 
 # ----- Role Play Agent -----
-dialogue_sessions = {}
+# 会话存储：默认进程内 LRU + 闲置 2 小时过期；多 worker 部署时设置
+# DIALOGUE_SESSION_STORE=sqlite:///dialogue_sessions.sqlite 让各进程共享会话
+dialogue_sessions = create_session_store(os.environ.get("DIALOGUE_SESSION_STORE", "memory://"))
 
 try:
     socrates_agent = SocratesAgent()
@@ -126,6 +109,19 @@ except Exception as e:
     socrates_agent = None
 
 
+def sse_event(event, data):
+    """格式化一条 Server-Sent Events 消息"""
+    return f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n"
+
+def sse_response(events):
+    """把事件生成器包装成流式响应（关闭代理缓冲，保证逐个 token 推送到浏览器）"""
+    return Response(
+        stream_with_context(events),
+        mimetype='text/event-stream',
+        headers={'Cache-Control': 'no-cache', 'X-Accel-Buffering': 'no'},
+    )
+
+
 @app.route('/chat_ui')
 def chat_ui():
     return render_template('index.html')
@@ -136,21 +132,16 @@ def home():
 
 @app.route('/chat', methods=['POST'])
 def chat():
-    # 无论 client Content-Type 如何，安全地解析 JSON，避免 request.json 为 None
-    data = request.get_json(silent=True) or {}
+    try:
+        data, image = read_request()
+    except InvalidImageError as e:
+        print(f"图片处理失败: {e}")
+        return jsonify({"error": "图片处理失败"}), 400
     user_message = data.get("message")
-    image_data = data.get("image")  # 获取base64编码的图片数据
     
     if not user_message:
         return jsonify({"error": "No message provided"}), 400
 
-    # 处理图片数据
-    image_path = None
-    if image_data:
-        image_path = save_uploaded_image(image_data)
-        if not image_path:
-            return jsonify({"error": "图片处理失败"}), 400
-
     response_text = ""
     try:
         # Simple routing logic
@@ -158,7 +149,7 @@ def chat():
             if kg_agent:
                 print("Routing to Knowledge Graph Agent.")
                 # 知识图谱Agent暂时不支持图片，如果有图片就提示用户
-                if image_path:
+                if image:
                     response_text = "知识图谱生成功能暂时不支持图片输入，请使用纯文本描述您需要的知识图谱主题。"
                 else:
                     response_text = kg_agent.process_request(user_message)
@@ -169,9 +160,9 @@ def chat():
                 print("Routing to Question Generation Agent.")
                 # 使用多模态功能
                 if hasattr(question_agent, 'process_multimodal_request'):
-                    response_text = question_agent.process_multimodal_request(user_message, image_path)
+                    response_text = question_agent.process_multimodal_request(user_message, image)
                 else:
-                    if image_path:
+                    if image:
                         response_text = "当前版本暂时不支持图片分析，请使用纯文本提问。"
                     else:
                         response_text = question_agent.process_request(user_message)
@@ -181,13 +172,49 @@ def chat():
     except Exception as e:
         print(f"An error occurred during processing: {e}")
         response_text = f"处理您的请求时发生内部错误: {e}"
-    finally:
-        # 清理临时图片文件
-        if image_path:
-            cleanup_temp_file(image_path)
 
     return jsonify({"response": response_text})
 
+@app.route('/chat_stream', methods=['POST'])
+def chat_stream():
+    """/chat 的流式版本：以 SSE 逐段返回生成内容（event: token / done / error）"""
+    try:
+        data, image = read_request()
+    except InvalidImageError as e:
+        print(f"图片处理失败: {e}")
+        return jsonify({"error": "图片处理失败"}), 400
+    user_message = data.get("message")
+
+    if not user_message:
+        return jsonify({"error": "No message provided"}), 400
+
+    def generate():
+        try:
+            # 只有纯文本出题走逐 token 流式输出；知识图谱与图片分析需要完整结果，一次性返回
+            is_kg_request = any(k in user_message for k in ["知识图谱", "思维导图", "mindmap", "图谱"])
+            if is_kg_request:
+                if not kg_agent:
+                    text = "知识图谱助手未成功加载，无法处理您的请求。"
+                elif image:
+                    text = "知识图谱生成功能暂时不支持图片输入，请使用纯文本描述您需要的知识图谱主题。"
+                else:
+                    text = kg_agent.process_request(user_message)
+                yield sse_event("token", {"delta": text})
+            elif not question_agent:
+                yield sse_event("token", {"delta": "出题助手未成功加载，无法处理您的请求。"})
+            elif image and hasattr(question_agent, 'process_multimodal_request'):
+                text = question_agent.process_multimodal_request(user_message, image)
+                yield sse_event("token", {"delta": text})
+            else:
+                for delta in question_agent.stream_request(user_message):
+                    yield sse_event("token", {"delta": delta})
+            yield sse_event("done", {})
+        except Exception as e:
+            print(f"An error occurred during streaming: {e}")
+            yield sse_event("error", {"error": f"处理您的请求时发生内部错误: {e}"})
+
+    return sse_response(generate())
+
 # ---------------- 角色扮演端点 ----------------
 
 @app.route('/role')
@@ -199,32 +226,28 @@ def role_chat_page():
 def start_dialogue():
     if not socrates_agent:
         return jsonify({"error": "AI助手未正确初始化"}), 500
-    data = request.get_json(silent=True) or {}
+    try:
+        data, image = read_request()
+    except InvalidImageError as e:
+        print(f"图片处理失败: {e}")
+        return jsonify({"error": "图片处理失败"}), 400
     user_message = data.get("message", "").strip()
-    image_data = data.get("image")  # 获取base64编码的图片数据
     
     if not user_message:
         return jsonify({"error": "请输入您想探讨的话题"}), 400
     
-    # 处理图片数据
-    image_path = None
-    if image_data:
-        image_path = save_uploaded_image(image_data)
-        if not image_path:
-            return jsonify({"error": "图片处理失败"}), 400
-    
     try:
         session_id = str(uuid.uuid4())
         
         # 如果有图片，使用多模态对话功能
-        if image_path and hasattr(socrates_agent, 'process_multimodal_dialogue'):
-            response_data = socrates_agent.process_multimodal_dialogue(user_message, None, image_path)
+        if image and hasattr(socrates_agent, 'process_multimodal_dialogue'):
+            response_data = socrates_agent.process_multimodal_dialogue(user_message, None, image)
         else:
             response_data = socrates_agent.process_dialogue(user_message, None)
             
         if response_data["status"] == "error":
             return jsonify({"error": response_data["response"]}), 500
-        dialogue_sessions[session_id] = response_data["state"]
+        dialogue_sessions.set(session_id, response_data["state"])
         return jsonify({
             "session_id": session_id,
             "response": response_data["response"],
@@ -235,44 +258,35 @@ def start_dialogue():
     except Exception as e:
         print(f"Error starting dialogue: {e}")
         return jsonify({"error": "内部错误"}), 500
-    finally:
-        # 清理临时图片文件
-        if image_path:
-            cleanup_temp_file(image_path)
 
 @app.route('/continue_dialogue', methods=['POST'])
 def continue_dialogue():
     if not socrates_agent:
         return jsonify({"error": "AI助手未正确初始化"}), 500
-    data = request.get_json(silent=True) or {}
+    try:
+        data, image = read_request()
+    except InvalidImageError as e:
+        print(f"图片处理失败: {e}")
+        return jsonify({"error": "图片处理失败"}), 400
     session_id = data.get("session_id")
     user_message = data.get("message", "").strip()
-    image_data = data.get("image")  # 获取base64编码的图片数据
     
-    if not session_id or session_id not in dialogue_sessions:
+    current_state = dialogue_sessions.get(session_id) if session_id else None
+    if current_state is None:
         return jsonify({"error": "会话已过期，请重新开始对话"}), 400
     if not user_message:
         return jsonify({"error": "请输入您的回应"}), 400
     
-    # 处理图片数据
-    image_path = None
-    if image_data:
-        image_path = save_uploaded_image(image_data)
-        if not image_path:
-            return jsonify({"error": "图片处理失败"}), 400
-    
     try:
-        current_state = dialogue_sessions[session_id]
-        
         # 如果有图片，使用多模态对话功能
-        if image_path and hasattr(socrates_agent, 'process_multimodal_dialogue'):
-            response_data = socrates_agent.process_multimodal_dialogue(user_message, current_state, image_path)
+        if image and hasattr(socrates_agent, 'process_multimodal_dialogue'):
+            response_data = socrates_agent.process_multimodal_dialogue(user_message, current_state, image)
         else:
             response_data = socrates_agent.process_dialogue(user_message, current_state)
             
         if response_data["status"] == "error":
             return jsonify({"error": response_data["response"]}), 500
-        dialogue_sessions[session_id] = response_data["state"]
+        dialogue_sessions.set(session_id, response_data["state"])
         return jsonify({
             "response": response_data["response"],
             "character": response_data["state"]["simulated_character"],
@@ -282,20 +296,77 @@ def continue_dialogue():
     except Exception as e:
         print(f"Error continuing dialogue: {e}")
         return jsonify({"error": "内部错误"}), 500
-    finally:
-        # 清理临时图片文件
-        if image_path:
-            cleanup_temp_file(image_path)
+
+@app.route('/dialogue_stream', methods=['POST'])
+def dialogue_stream():
+    """开始或继续对话的流式版本：无 session_id 时开始新对话，否则继续已有会话"""
+    if not socrates_agent:
+        return jsonify({"error": "AI助手未正确初始化"}), 500
+    try:
+        data, image = read_request()
+    except InvalidImageError as e:
+        print(f"图片处理失败: {e}")
+        return jsonify({"error": "图片处理失败"}), 400
+    session_id = data.get("session_id")
+    user_message = data.get("message", "").strip()
+
+    current_state = dialogue_sessions.get(session_id) if session_id else None
+    if session_id and current_state is None:
+        return jsonify({"error": "会话已过期，请重新开始对话"}), 400
+    if not user_message:
+        return jsonify({"error": "请输入您的回应" if session_id else "请输入您想探讨的话题"}), 400
+
+    session_id = session_id or str(uuid.uuid4())
+
+    def generate():
+        try:
+            if image and hasattr(socrates_agent, 'process_multimodal_dialogue'):
+                response_data = socrates_agent.process_multimodal_dialogue(user_message, current_state, image)
+                if response_data["status"] != "error":
+                    yield sse_event("token", {"delta": response_data["response"]})
+            else:
+                response_data = None
+                for event in socrates_agent.stream_dialogue(user_message, current_state):
+                    if event["type"] == "token":
+                        yield sse_event("token", {"delta": event["delta"]})
+                    else:
+                        response_data = event
+
+            if response_data is None or response_data["status"] == "error":
+                error = response_data["response"] if response_data else "内部错误"
+                yield sse_event("error", {"error": error})
+                return
+            dialogue_sessions.set(session_id, response_data["state"])
+            yield sse_event("done", {
+                "session_id": session_id,
+                "response": response_data["response"],
+                "character": response_data["state"]["simulated_character"],
+                "topic": response_data["state"]["current_topic"],
+                "turn_count": response_data["state"]["turn_count"]
+            })
+        except Exception as e:
+            print(f"Error streaming dialogue: {e}")
+            yield sse_event("error", {"error": "内部错误"})
+
+    return sse_response(generate())
 
 @app.route('/end_dialogue', methods=['POST'])
 def end_dialogue():
     data = request.get_json(silent=True) or {}
     session_id = data.get("session_id")
-    if session_id and session_id in dialogue_sessions:
-        dialogue_sessions.pop(session_id, None)
+    if session_id and dialogue_sessions.delete(session_id):
         return jsonify({"message": "对话已结束"})
     return jsonify({"message": "会话未找到或已结束"})
 
+@app.route('/metrics', methods=['GET'])
+def metrics():
+    """会话存储的容量、内存占用与淘汰计数，以及图片回答缓存的命中情况"""
+    metrics = {"dialogue_sessions": dialogue_sessions.stats()}
+    multimodal_agent = getattr(question_agent, "multimodal_agent", None)
+    if multimodal_agent is not None and multimodal_agent.answer_cache is not None:
+        metrics["vision_answer_cache"] = multimodal_agent.answer_cache.stats()
+    return jsonify(metrics)
+
 def run_app():
     # Before running, make sure the API key is set if your agents need it.
     if not os.environ.get("DASHSCOPE_API_KEY"):
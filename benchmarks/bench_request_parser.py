@@ -0,0 +1,172 @@
+"""
+Microbenchmark: QuestionRequestParser vs. the former inline parse_input_node.
+
+Checks that both produce the same result on every request of the corpus
+(requests written with Chinese numerals are expected to differ), that the
+counts in ``EXPECTED_COUNTS`` are parsed as given, and reports the time per
+request.  A larger topic vocabulary, as other courses have, can
+be simulated with ``--extra-topics``.
+
+    python benchmarks/bench_request_parser.py
+    python benchmarks/bench_request_parser.py --corpus requests.txt --extra-topics 2000
+
+``--corpus`` is a text file with one request per line, or a JSONL file whose
+objects carry the request in a ``message`` field (as posted to ``/chat``).
+"""
+import argparse
+import json
+import os
+import re
+import sys
+import timeit
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common_utils.request_parser import QuestionRequestParser  # noqa: E402
+from mayuan_agent import MAYUAN_COMMON_TOPICS  # noqa: E402
+
+DEFAULT_CORPUS = [
+    "请给我出5道关于唯物辩证法的选择题",
+    "出3道关于认识论的判断题",
+    "5道关于唯物辩证法的选择题",
+    "给我10道选择题和5道判断题，关于历史唯物主义",
+    "请出2道关于实践观的简答题",
+    "来两道材料分析题，关于社会存在和社会意识",
+    "出1道关于矛盾论的困难简答题",
+    "请给我出一些简单的关于质量互变的题目",
+    "我想练习否定之否定规律，出几道题",
+    "出 4 道 选择题 和 2 道 材料分析题，难度高级",
+    "关于本质与现象的判断题3道",
+    "请出10个关于辩证唯物主义的基础选择题",
+    "出五道关于联系和发展的选择题",
+    "请给我出十二道关于原因与结果的判断题",
+    "马克思主义哲学 选择题",
+    "给我出题",
+    "必然与偶然、可能与现实各出2道判断题",
+    "出3道选择题、3道判断题、2道简答题，主题是内容与形式",
+    "关于两个必然出选择题",
+    "请出选择题，关于两个必然",
+    "举一个例子出判断题",
+]
+
+# Number of questions the parser must find.  Chinese numerals before 个 are
+# part of the topic ("两个必然"), not a count: those requests get the default 5.
+EXPECTED_COUNTS = {
+    "出五道关于联系和发展的选择题": 5,
+    "请给我出十二道关于原因与结果的判断题": 12,
+    "来两道材料分析题，关于社会存在和社会意识": 2,
+    "请出10个关于辩证唯物主义的基础选择题": 10,
+    "关于两个必然出选择题": 5,
+    "请出选择题，关于两个必然": 5,
+    "举一个例子出判断题": 5,
+}
+
+
+def legacy_parse(user_input, common_topics, default_topic):
+    """parse_input_node as it was before QuestionRequestParser (for comparison)."""
+    type_count_pattern = r"(\d+)\s*(?:道|题|个)[^一-龥]*?(选择题|判断题|简答题|材料\s*分析题?)"
+    compact_input = re.sub(r"\s+", "", user_input)
+    mixed_matches = re.findall(type_count_pattern, compact_input)
+
+    question_type_counts = {}
+    for num_str, q_type_raw in mixed_matches:
+        q_type_normalized = q_type_raw.replace("材料分析题", "简答题").replace("材料分析", "简答题")
+        question_type_counts[q_type_normalized] = question_type_counts.get(q_type_normalized, 0) + int(num_str)
+
+    if question_type_counts:
+        num_questions = sum(question_type_counts.values())
+    else:
+        numbers = re.findall(r"(\d+)\s*(?:道|题|个)", user_input)
+        num_questions = sum(int(n) for n in numbers) if numbers else 5
+
+    difficulty = "中等"
+    if any(kw in user_input for kw in ["简单", "容易", "基础"]):
+        difficulty = "简单"
+    elif any(kw in user_input for kw in ["困难", "难", "高级"]):
+        difficulty = "困难"
+
+    detected_types = [qt for qt in ["选择题", "判断题", "简答题"] if qt in user_input or ("简答题" == qt and "材料分析" in user_input)]
+    detected_types = list(dict.fromkeys(detected_types))
+
+    if not question_type_counts and detected_types:
+        avg_count = max(1, num_questions // len(detected_types))
+        for qt in detected_types:
+            question_type_counts[qt] = avg_count
+
+    if len(question_type_counts) > 1:
+        question_type = "混合"
+    elif len(question_type_counts) == 1:
+        question_type = next(iter(question_type_counts))
+    else:
+        question_type = "选择题"
+        question_type_counts = {"选择题": num_questions}
+
+    detected_topics = [t for t in common_topics if t in user_input]
+    for raw in re.findall(r"关于(.*?)的", user_input):
+        cleaned = re.sub(r"(简单|容易|基础|中等|困难|高级|选择题|判断题|简答题|材料\s*分析题?|题目|\s)", "", raw).strip()
+        if cleaned:
+            detected_topics.append(cleaned)
+
+    ordered_topics = list(dict.fromkeys(detected_topics))
+    if not ordered_topics:
+        fallback_topic = re.sub(r'\d+道|\d+题|请|给我|出|关于|的|简单|中等|困难|选择题|判断题|简答题|材料\s*分析题?|题目', '', user_input).strip()
+        ordered_topics = [fallback_topic if fallback_topic else default_topic]
+
+    return {
+        "topic": "; ".join(ordered_topics),
+        "num_questions": num_questions,
+        "difficulty": difficulty,
+        "question_type": question_type,
+        "question_type_counts": question_type_counts,
+    }
+
+
+def load_corpus(path):
+    with open(path, encoding="utf-8") as f:
+        lines = [line.strip() for line in f if line.strip()]
+    if path.endswith(".jsonl"):
+        return [json.loads(line)["message"] for line in lines]
+    return lines
+
+
+def main(argv=None):
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--corpus", help="Request corpus (.txt or .jsonl); defaults to a built-in sample.")
+    parser.add_argument("--extra-topics", type=int, default=0, help="Synthetic topics added to the vocabulary.")
+    parser.add_argument("--repeat", type=int, default=200, help="Passes over the corpus per measurement.")
+    args = parser.parse_args(argv)
+
+    corpus = load_corpus(args.corpus) if args.corpus else DEFAULT_CORPUS
+    topics = list(MAYUAN_COMMON_TOPICS) + [f"专题{i}号" for i in range(args.extra_topics)]
+    default_topic = "马克思主义基本原理"
+    compiled = QuestionRequestParser(topics, default_topic)
+
+    for text, expected in EXPECTED_COUNTS.items():
+        parsed = compiled.parse(text)["num_questions"]
+        assert parsed == expected, f"{text!r}: parsed {parsed} questions, expected {expected}"
+
+    differences = 0
+    for text in corpus:
+        old, new = legacy_parse(text, topics, default_topic), compiled.parse(text)
+        if old != new:
+            differences += 1
+            print(f"differs: {text!r}\n  legacy: {old}\n  parser: {new}")
+
+    def run_legacy():
+        for text in corpus:
+            legacy_parse(text, topics, default_topic)
+
+    def run_compiled():
+        for text in corpus:
+            compiled.parse(text)
+
+    calls = args.repeat * len(corpus)
+    legacy = min(timeit.repeat(run_legacy, number=args.repeat, repeat=3)) / calls * 1e6
+    new = min(timeit.repeat(run_compiled, number=args.repeat, repeat=3)) / calls * 1e6
+    print(f"{len(corpus)} requests, {len(topics)} topics, {differences} differing results")
+    print(f"legacy parse_input_node: {legacy:8.1f} us/request")
+    print(f"QuestionRequestParser:   {new:8.1f} us/request ({legacy / new:.1f}x)")
+
+
+if __name__ == "__main__":
+    main()
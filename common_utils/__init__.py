@@ -1,8 +1,19 @@
+from .embedding_cache import CachedEmbeddings
 from .llm_wrapper import CustomChatDashScope
-from .vector_utils import load_embeddings, load_vectorstore
+from .vector_utils import (
+    get_embeddings,
+    get_vectorstore,
+    load_embeddings,
+    load_vectorstore,
+    preload_vectorstores,
+)
 
 __all__ = [
+    "CachedEmbeddings",
     "CustomChatDashScope",
+    "get_embeddings",
+    "get_vectorstore",
     "load_embeddings",
     "load_vectorstore",
-] 
\ No newline at end of file
+    "preload_vectorstores",
+]
@@ -15,21 +15,30 @@ To create a new agent (e.g., for Mao's Thoughts), you would:
 """
 import os
 import re
-from typing import Dict, List, TypedDict, Optional
+from typing import Dict, Iterator, List, TypedDict, Optional
 
 from langchain_community.vectorstores import FAISS
-from langchain_dashscope.embeddings import DashScopeEmbeddings
+from langgraph.constants import TAG_NOSTREAM
 from langgraph.graph import StateGraph, END
 from langgraph.pregel import Pregel
 from langchain_core.messages import HumanMessage, SystemMessage
 
 from .llm_wrapper import CustomChatDashScope
+from .question_assembly import dedupe_questions, renumber, split_questions, stem_text
+from .question_cache import QuestionResultCache
+from .request_parser import QUESTION_TYPES, QuestionRequestParser
 from .prompts import (
     SINGLE_TYPE_PROMPT_TEMPLATE,
     QUESTION_TYPE_CONFIG,
     MIXED_TYPE_PROMPT_TEMPLATE,
     DIFFICULTY_ADDENDUM_HARD,
 )
+from .vector_utils import (
+    batch_similarity_search,
+    get_embeddings,
+    get_vectorstore,
+    reciprocal_rank_fusion,
+)
 
 class GraphState(TypedDict):
     """Defines the state structure for the LangGraph workflow."""
@@ -42,6 +51,7 @@ class GraphState(TypedDict):
     question_type_counts: Dict[str, int]
     retrieved_docs: List[str]
     generated_questions: str
+    cache_hit: bool
     error_message: Optional[str]
 
 
@@ -56,6 +66,10 @@ class BaseAgent:
         vectorstore_path: str,
         llm_model: str = "qwen-max",
         embedding_model: str = "text-embedding-v2",
+        result_cache: Optional[QuestionResultCache] = None,
+        parallel_mixed: bool = True,
+        max_concurrency: int = 4,
+        chunk_size: int = 10,
     ):
         """
         Initializes the agent with subject-specific configurations.
@@ -67,17 +81,30 @@ class BaseAgent:
             vectorstore_path: Path to the local FAISS vector store.
             llm_model: The LLM model to use for generation.
             embedding_model: The embedding model to use for retrieval.
+            result_cache: Optional cache of generated questions keyed on the parsed
+                request; ``None`` disables caching.
+            parallel_mixed: Generate mixed-type papers as one concurrent request
+                per question type instead of a single combined request.
+            max_concurrency: Upper bound on concurrent LLM requests per paper.
+            chunk_size: Larger requests are generated in concurrent chunks of at
+                most this many questions per type; 0 disables chunking.
         """
         self.subject_name = subject_name
         self.default_topic = default_topic
         self.common_topics = common_topics
         self.vectorstore_path = vectorstore_path
+        self.embedding_model = embedding_model
+        self.result_cache = result_cache
+        self.request_parser = QuestionRequestParser(common_topics, default_topic)
+        self.parallel_mixed = parallel_mixed
+        self.max_concurrency = max_concurrency
+        self.chunk_size = chunk_size
         
         if not os.environ.get("DASHSCOPE_API_KEY"):
             raise ValueError("DASHSCOPE_API_KEY environment variable not set.")
 
         try:
-            self.embeddings = DashScopeEmbeddings(model=embedding_model)
+            self.embeddings = get_embeddings(embedding_model)
             self.llm = CustomChatDashScope(model=llm_model, temperature=0.7)
             print(f"[{self.subject_name}] LLM and Embedding models initialized successfully.")
         except Exception as e:
@@ -87,14 +114,10 @@ class BaseAgent:
         self.graph: Pregel = self._build_graph()
 
     def _load_knowledge_base(self) -> Optional[FAISS]:
-        """Loads the vector knowledge base from the specified path."""
+        """Loads the vector knowledge base from the specified path (shared per process)."""
         try:
             print(f"[{self.subject_name}] Loading knowledge base from '{self.vectorstore_path}'...")
-            return FAISS.load_local(
-                self.vectorstore_path,
-                self.embeddings,
-                allow_dangerous_deserialization=True,
-            )
+            return get_vectorstore(self.vectorstore_path, self.embedding_model)
         except Exception as e:
             print(f"Warning: Failed to load knowledge base: {e}. Agent will run without retrieval.")
             return None
@@ -103,11 +126,17 @@ class BaseAgent:
         """Builds the LangGraph workflow."""
         workflow = StateGraph(GraphState)
         workflow.add_node("parse_input", self.parse_input_node)
+        workflow.add_node("check_cache", self.check_cache_node)
         workflow.add_node("retrieve", self.retrieve_node)
         workflow.add_node("generate", self.generate_node)
 
         workflow.set_entry_point("parse_input")
-        workflow.add_edge("parse_input", "retrieve")
+        workflow.add_edge("parse_input", "check_cache")
+        workflow.add_conditional_edges(
+            "check_cache",
+            lambda state: "hit" if state["cache_hit"] else "miss",
+            {"hit": END, "miss": "retrieve"},
+        )
         workflow.add_edge("retrieve", "generate")
         workflow.add_edge("generate", END)
 
@@ -117,72 +146,22 @@ class BaseAgent:
     def parse_input_node(self, state: GraphState) -> Dict:
         """Parses the user's raw input to extract structured parameters."""
         print(f"[{self.subject_name}] Parsing user input...")
-        user_input = state["user_input"]
-
-        # --- Extract Number and Type of Questions ---
-        type_count_pattern = r"(\d+)\s*(?:道|题|个)[^\u4e00-\u9fa5]*?(选择题|判断题|简答题|材料\s*分析题?)"
-        compact_input = re.sub(r"\s+", "", user_input)
-        mixed_matches = re.findall(type_count_pattern, compact_input)
-        
-        question_type_counts = {}
-        for num_str, q_type_raw in mixed_matches:
-            q_type_normalized = q_type_raw.replace("材料分析题", "简答题").replace("材料分析", "简答题")
-            question_type_counts[q_type_normalized] = question_type_counts.get(q_type_normalized, 0) + int(num_str)
-
-        if question_type_counts:
-            num_questions = sum(question_type_counts.values())
-        else:
-            num_pattern_simple = r"(\d+)\s*(?:道|题|个)"
-            numbers = re.findall(num_pattern_simple, user_input)
-            num_questions = sum(int(n) for n in numbers) if numbers else 5
-
-        # --- Extract Difficulty ---
-        difficulty = "中等"
-        if any(kw in user_input for kw in ["简单", "容易", "基础"]):
-            difficulty = "简单"
-        elif any(kw in user_input for kw in ["困难", "难", "高级"]):
-            difficulty = "困难"
-
-        # --- Determine Question Type(s) ---
-        detected_types = [qt for qt in ["选择题", "判断题", "简答题"] if qt in user_input or ("简答题" == qt and "材料分析" in user_input)]
-        detected_types = list(dict.fromkeys(detected_types))
-
-        if not question_type_counts and detected_types:
-            avg_count = max(1, num_questions // len(detected_types))
-            for qt in detected_types:
-                question_type_counts[qt] = avg_count
-        
-        if len(question_type_counts) > 1:
-            question_type = "混合"
-        elif len(question_type_counts) == 1:
-            question_type = next(iter(question_type_counts))
-        else:
-            question_type = "选择题"
-            question_type_counts = {"选择题": num_questions}
-
-        # --- Extract Topic ---
-        detected_topics = [t for t in self.common_topics if t in user_input]
-        about_matches = re.findall(r"关于(.*?)的", user_input)
-        for raw in about_matches:
-            cleaned = re.sub(r"(简单|容易|基础|中等|困难|高级|选择题|判断题|简答题|材料\s*分析题?|题目|\s)", "", raw).strip()
-            if cleaned:
-                detected_topics.append(cleaned)
-        
-        ordered_topics = list(dict.fromkeys(detected_topics))
-        if not ordered_topics:
-            fallback_topic = re.sub(r'\d+道|\d+题|请|给我|出|关于|的|简单|中等|困难|选择题|判断题|简答题|材料\s*分析题?|题目', '', user_input).strip()
-            ordered_topics = [fallback_topic if fallback_topic else self.default_topic]
-
         return {
-            "topic": "; ".join(ordered_topics),
-            "num_questions": num_questions,
-            "difficulty": difficulty,
-            "question_type": question_type,
-            "question_type_counts": question_type_counts,
+            **self.request_parser.parse(state["user_input"]),
             "subject_name": self.subject_name,
             "error_message": None,
         }
 
+    def check_cache_node(self, state: GraphState) -> Dict:
+        """Serves a cached generation for an equivalent parsed request, if available."""
+        if self.result_cache is None:
+            return {"cache_hit": False}
+        cached = self.result_cache.get(QuestionResultCache.make_key(state))
+        if cached is None:
+            return {"cache_hit": False}
+        print(f"[{self.subject_name}] Serving cached questions for topic: '{state['topic']}'.")
+        return {"generated_questions": cached, "cache_hit": True, "error_message": None}
+
     def retrieve_node(self, state: GraphState) -> Dict:
         """Retrieves relevant documents from the knowledge base."""
         print(f"[{self.subject_name}] Retrieving documents for topic: '{state['topic']}'...")
@@ -190,69 +169,193 @@ class BaseAgent:
             return {"retrieved_docs": [], "error_message": "Knowledge base not loaded."}
 
         try:
-            topic_list = [t.strip() for t in re.split(r"[;；、，]", state["topic"]) if t.strip()]
-            retrieved_docs = []
-            for tp in topic_list:
-                docs = self.vectorstore.similarity_search(f"{tp} {self.subject_name}", k=3)
-                retrieved_docs.extend([doc.page_content for doc in docs])
-            
-            unique_docs = list(dict.fromkeys(retrieved_docs))[:5]
+            topic_list = self._topic_list(state["topic"])
+            # Chunked papers give each chunk its own slice of the context.
+            limit = min(15, 3 * len(self._plan_chunks(state))) if self._is_chunked(state) else 5
+            limit = max(5, limit)
+            # One embedding request + one FAISS search for all sub-topics.
+            queries = [f"{tp} {self.subject_name}" for tp in topic_list]
+            results = batch_similarity_search(self.vectorstore, queries, k=max(3, -(-limit // len(queries))))
+            unique_docs = reciprocal_rank_fusion(
+                [[doc.page_content for doc in docs] for docs in results]
+            )[:limit]
             print(f"[{self.subject_name}] Retrieved {len(unique_docs)} unique document snippets.")
             return {"retrieved_docs": unique_docs, "error_message": None}
         except Exception as e:
             return {"retrieved_docs": [], "error_message": f"Retrieval failed: {e}"}
 
+    def _single_type_prompt(self, state: GraphState, q_type: str, count: int, context: str, user_input: str) -> str:
+        config = QUESTION_TYPE_CONFIG.get(q_type, QUESTION_TYPE_CONFIG["选择题"])
+        return SINGLE_TYPE_PROMPT_TEMPLATE.format(
+            subject_name=self.subject_name,
+            topic=state["topic"],
+            num_questions=count,
+            difficulty=state["difficulty"],
+            question_type_specific_name=config["question_type_specific_name"],
+            format_requirements=config["format_requirements"],
+            output_format_example=config["output_format_example"],
+            context=context,
+            user_input=user_input,
+        )
+
+    def _messages(self, prompt: str, difficulty: str) -> List:
+        if difficulty == "困难":
+            prompt += f"\n\n{DIFFICULTY_ADDENDUM_HARD}"
+        return [
+            SystemMessage(content=f"你是一位专业的{self.subject_name}课程教师，擅长出题和教学。"),
+            HumanMessage(content=prompt)
+        ]
+
+    @staticmethod
+    def _topic_list(topic: str) -> List[str]:
+        return [t.strip() for t in re.split(r"[;；、，]", topic) if t.strip()] or [topic]
+
+    def _is_chunked(self, state: GraphState) -> bool:
+        return bool(self.chunk_size) and max(state["question_type_counts"].values(), default=0) > self.chunk_size
+
+    def _plan_chunks(self, state: GraphState) -> List[Dict]:
+        """Split the paper into requests of at most ``chunk_size`` questions per type.
+
+        Chunks of the same type each focus on one sub-topic (in turn) and get a
+        rotated window of the retrieved snippets, so they cover different ground.
+        """
+        counts = {qt: n for qt, n in state["question_type_counts"].items() if n > 0}
+        types = [qt for qt in QUESTION_TYPES if qt in counts] + [qt for qt in counts if qt not in QUESTION_TYPES]
+        topics = self._topic_list(state["topic"])
+        docs = state["retrieved_docs"]
+        chunks = []
+        for qt in types:
+            size = self.chunk_size or counts[qt]
+            sizes = [size] * (counts[qt] // size) + ([counts[qt] % size] if counts[qt] % size else [])
+            for j, count in enumerate(sizes):
+                if len(sizes) > 1:
+                    topic = topics[j % len(topics)]
+                    offset = (3 * j) % len(docs) if docs else 0
+                    context_docs = (docs[offset:] + docs[:offset])[:3]
+                else:
+                    topic, context_docs = state["topic"], docs[:3]
+                chunks.append({"type": qt, "count": count, "topic": topic, "docs": context_docs})
+        return chunks
+
+    def _generate_in_parts(self, state: GraphState) -> str:
+        """Generate the paper as concurrent requests (one per type and chunk) and assemble it.
+
+        Questions of the same type are merged, near-duplicates dropped and the
+        rest renumbered; mixed papers get one section per type in type order.
+        Types left short by deduplication get one more request that lists the
+        kept stems as exclusions; a remaining shortfall is noted in the paper.
+        """
+        chunks = self._plan_chunks(state)
+        batch = []
+        for chunk in chunks:
+            focus = f"，侧重：{chunk['topic']}" if chunk["topic"] != state["topic"] else ""
+            prompt = self._single_type_prompt(
+                {**state, "topic": chunk["topic"]}, chunk["type"], chunk["count"], "\n\n".join(chunk["docs"]),
+                f"{state['user_input']}\n（本次只需生成其中的{chunk['count']}道{chunk['type']}{focus}）",
+            )
+            batch.append(self._messages(prompt, state["difficulty"]))
+        # Concurrent parts would interleave in a token stream; they are
+        # excluded from it and the assembled paper is sent when complete.
+        responses = self.llm.batch(
+            batch, config={"max_concurrency": self.max_concurrency, "tags": [TAG_NOSTREAM]}
+        )
+
+        parts: Dict[str, List[str]] = {}
+        for chunk, response in zip(chunks, responses):
+            parts.setdefault(chunk["type"], []).append(str(response.content).strip())
+
+        counts = state["question_type_counts"]
+        questions: Dict[str, Optional[List[str]]] = {}  # None: unrecognized format
+        for qt, texts in parts.items():
+            split = [split_questions(text) for text in texts]
+            questions[qt] = dedupe_questions([q for qs in split for q in qs]) if all(split) else None
+        self._top_up(state, questions)
+
+        sections = []
+        for ordinal, (qt, texts) in zip("一二三四五六七八九十", parts.items()):
+            kept = questions[qt]
+            if kept is None:
+                # Unrecognized format: keep the parts as generated.
+                body, total = "\n\n".join(texts), counts[qt]
+            else:
+                body, total = renumber(kept), len(kept)
+                if total < counts[qt]:
+                    print(f"[{self.subject_name}] Only {total} of {counts[qt]} {qt} left after deduplication.")
+                    body += f"\n\n（注：去除重复题目后{qt}共{total}道，少于要求的{counts[qt]}道。）"
+            sections.append(f"{ordinal}、{qt}（共{total}道）\n\n{body}" if len(parts) > 1 else body)
+        return "\n\n".join(sections)
+
+    def _top_up(self, state: GraphState, questions: Dict[str, Optional[List[str]]]) -> None:
+        """Request the questions deduplication removed, excluding the kept stems (in place)."""
+        counts = state["question_type_counts"]
+        short = {
+            qt: counts[qt] - len(kept)
+            for qt, kept in questions.items()
+            if kept is not None and len(kept) < counts[qt]
+        }
+        if not short:
+            return
+        context = "\n\n".join(state["retrieved_docs"][:3])
+        batch = []
+        for qt, missing in short.items():
+            exclusions = "\n".join(f"- {stem_text(q)[:80]}" for q in questions[qt])
+            prompt = self._single_type_prompt(
+                state, qt, missing, context,
+                f"{state['user_input']}\n（本次只需再生成{missing}道{qt}，且不得与以下已有题目重复：\n{exclusions}）",
+            )
+            batch.append(self._messages(prompt, state["difficulty"]))
+        try:
+            responses = self.llm.batch(
+                batch, config={"max_concurrency": self.max_concurrency, "tags": [TAG_NOSTREAM]}
+            )
+        except Exception as e:
+            print(f"[{self.subject_name}] Top-up generation failed: {e}")
+            return
+        for qt, response in zip(short, responses):
+            extra = split_questions(str(response.content))
+            questions[qt] = dedupe_questions(questions[qt] + extra)[:counts[qt]]
+
     def generate_node(self, state: GraphState) -> Dict:
         """Generates questions using the LLM based on the retrieved context."""
         print(f"[{self.subject_name}] Generating questions...")
         context = "\n\n".join(state["retrieved_docs"][:3])
         
         try:
-            if state["question_type"] == "混合":
-                type_details = "\n".join([f"- {qt}：{cnt}道" for qt, cnt in state["question_type_counts"].items()])
-                prompt = MIXED_TYPE_PROMPT_TEMPLATE.format(
-                    subject_name=self.subject_name,
-                    topic=state["topic"],
-                    type_details=type_details,
-                    difficulty=state["difficulty"],
-                    context=context,
-                    user_input=state["user_input"],
-                )
+            if (state["question_type"] == "混合" and self.parallel_mixed) or self._is_chunked(state):
+                generated = self._generate_in_parts(state)
             else:
-                q_type = state["question_type"]
-                config = QUESTION_TYPE_CONFIG.get(q_type, QUESTION_TYPE_CONFIG["选择题"])
-                prompt = SINGLE_TYPE_PROMPT_TEMPLATE.format(
-                    subject_name=self.subject_name,
-                    topic=state["topic"],
-                    num_questions=state["num_questions"],
-                    difficulty=state["difficulty"],
-                    question_type_specific_name=config["question_type_specific_name"],
-                    format_requirements=config["format_requirements"],
-                    output_format_example=config["output_format_example"],
-                    context=context,
-                    user_input=state["user_input"],
-                )
-
-            if state["difficulty"] == "困难":
-                prompt += f"\n\n{DIFFICULTY_ADDENDUM_HARD}"
-            
-            messages = [
-                SystemMessage(content=f"你是一位专业的{self.subject_name}课程教师，擅长出题和教学。"),
-                HumanMessage(content=prompt)
-            ]
-            response = self.llm.invoke(messages)
+                if state["question_type"] == "混合":
+                    type_details = "\n".join([f"- {qt}：{cnt}道" for qt, cnt in state["question_type_counts"].items()])
+                    prompt = MIXED_TYPE_PROMPT_TEMPLATE.format(
+                        subject_name=self.subject_name,
+                        topic=state["topic"],
+                        type_details=type_details,
+                        difficulty=state["difficulty"],
+                        context=context,
+                        user_input=state["user_input"],
+                    )
+                else:
+                    prompt = self._single_type_prompt(
+                        state, state["question_type"], state["num_questions"], context, state["user_input"]
+                    )
+                generated = self.llm.invoke(self._messages(prompt, state["difficulty"])).content
+
+            # A paper generated without course context (failed or empty retrieval) is not cached.
+            if (
+                self.result_cache is not None
+                and generated
+                and state["error_message"] is None
+                and state["retrieved_docs"]
+            ):
+                self.result_cache.put(QuestionResultCache.make_key(state), generated)
             
             print(f"[{self.subject_name}] Question generation complete.")
-            return {"generated_questions": response.content, "error_message": None}
+            return {"generated_questions": generated, "error_message": None}
         except Exception as e:
             return {"generated_questions": "", "error_message": f"Generation failed: {e}"}
 
-    def process_request(self, user_input: str) -> str:
-        """Processes a user's request through the entire workflow."""
-        if not self.graph:
-            return "Error: Agent graph is not compiled."
-        
-        initial_state = GraphState(
+    def _initial_state(self, user_input: str) -> GraphState:
+        return GraphState(
             user_input=user_input,
             subject_name=self.subject_name,
             topic="",
@@ -262,8 +365,16 @@ class BaseAgent:
             question_type_counts={},
             retrieved_docs=[],
             generated_questions="",
+            cache_hit=False,
             error_message=None,
         )
+
+    def process_request(self, user_input: str) -> str:
+        """Processes a user's request through the entire workflow."""
+        if not self.graph:
+            return "Error: Agent graph is not compiled."
+        
+        initial_state = self._initial_state(user_input)
         
         try:
             final_state = self.graph.invoke(initial_state)
@@ -271,4 +382,34 @@ class BaseAgent:
                 return f"An error occurred: {final_state['error_message']}"
             return final_state["generated_questions"]
         except Exception as e:
-            return f"A system error occurred: {e}" 
\ No newline at end of file
+            return f"A system error occurred: {e}"
+
+    def stream_request(self, user_input: str) -> Iterator[str]:
+        """Like :meth:`process_request`, but yields the generated text as it is produced."""
+        if not self.graph:
+            yield "Error: Agent graph is not compiled."
+            return
+
+        streamed = False
+        final_state: Optional[GraphState] = None
+        try:
+            for mode, payload in self.graph.stream(
+                self._initial_state(user_input), stream_mode=["messages", "values"]
+            ):
+                if mode == "values":
+                    final_state = payload
+                    continue
+                chunk, metadata = payload
+                if metadata.get("langgraph_node") == "generate" and chunk.content:
+                    streamed = True
+                    yield chunk.content
+        except Exception as e:
+            yield f"A system error occurred: {e}"
+            return
+
+        if final_state is None:
+            return
+        if final_state["error_message"]:
+            yield ("\n\n" if streamed else "") + f"An error occurred: {final_state['error_message']}"
+        elif not streamed:
+            yield final_state["generated_questions"]
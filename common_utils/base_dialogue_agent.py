@@ -10,17 +10,20 @@ This module extracts the core workflow from *role.py* so that future agents
 with only minimal configuration.
 """
 
-from typing import Any, Dict, List, Optional, TypedDict
+from typing import Any, Dict, Iterator, List, Mapping, Optional, Sequence, Tuple, TypedDict
+import json
 import os
 import re
 
 from langchain_community.vectorstores import FAISS
-from langchain_dashscope.embeddings import DashScopeEmbeddings
 from langchain_core.messages import HumanMessage, SystemMessage, AIMessage
 from langchain_core.prompts import PromptTemplate
-from langgraph.graph import StateGraph, END
+from langgraph.graph import StateGraph, START, END
 
+from .history_manager import HistoryManager, estimate_tokens
 from .llm_wrapper import CustomChatDashScope
+from .text_matcher import KeywordMatcher
+from .vector_utils import get_embeddings, get_vectorstore
 
 # -----------------------------------------------------------------------------
 # Graph state definition
@@ -34,10 +37,43 @@ class DialogueGraphState(TypedDict):
     simulated_character: str
     conversation_history: List[Dict[str, str]]
     retrieved_docs: List[str]
+    retrieval_query: str  # query that produced retrieved_docs
+    drift_docs: List[str]  # extra snippets for the latest user message (this turn only)
+    # Turn 0 only: retrieval started on a locally guessed topic and character
+    # in parallel with intent parsing (see speculative_retrieve_node).
+    speculative_query: str
+    speculative_docs: List[str]
     socratic_response: str
     turn_count: int
     error_message: Optional[str]
     dialogue_status: str  # "continue", "end", "error"
+    # Rolling summary of conversation_history[:summarized_count] and the
+    # background job that will extend it (see HistoryManager).
+    history_summary: str
+    summarized_count: int
+    pending_summary: Optional[Dict[str, Any]]
+
+
+# -----------------------------------------------------------------------------
+# Intent fast path vocabulary
+# -----------------------------------------------------------------------------
+
+# Name variants -> persona name.
+DEFAULT_CHARACTERS: Dict[str, str] = {
+    "马克思": "马克思",
+    "卡尔·马克思": "马克思",
+    "恩格斯": "恩格斯",
+    "列宁": "列宁",
+    "斯大林": "斯大林",
+    "毛泽东": "毛泽东",
+    "毛主席": "毛泽东",
+    "黑格尔": "黑格尔",
+    "费尔巴哈": "费尔巴哈",
+    "苏格拉底": "苏格拉底",
+}
+
+# Terms that contain a character name without referring to the person.
+_NON_CHARACTER_TERMS = ("马克思主义", "列宁主义", "毛泽东思想", "黑格尔哲学")
 
 
 # -----------------------------------------------------------------------------
@@ -60,7 +96,7 @@ class BaseDialogueAgent:
     "character": "马克思"
 }}
 
-用户输入: {{user_input}}
+用户输入: {user_input}
         """
     )
 
@@ -74,19 +110,40 @@ class BaseDialogueAgent:
         llm_model: str = "qwen-max",
         temperature: float = 0.8,
         embedding_model: str = "text-embedding-v2",
+        history_turns: int = 4,
+        history_token_budget: int = 6000,
+        drift_retrieval: bool = False,
+        drift_threshold: float = 0.5,
+        topics: Sequence[str] = (),
+        topic_synonyms: Optional[Mapping[str, str]] = None,
+        characters: Optional[Mapping[str, str]] = None,
+        intent_llm_model: str = "qwen-turbo",
     ) -> None:
         self.subject_name = subject_name
         self.vectorstore_path = vectorstore_path
         self.default_topic = default_topic
         self.default_character = default_character
+        self.embedding_model = embedding_model
+        # Optionally search with the latest user message as well, keeping hits
+        # whose relevance score (0..1) reaches the threshold.
+        self.drift_retrieval = drift_retrieval
+        self.drift_threshold = drift_threshold
+        self.intent_matcher = self._build_intent_matcher(topics, topic_synonyms or {}, characters or DEFAULT_CHARACTERS)
 
         if "DASHSCOPE_API_KEY" not in os.environ:
             raise EnvironmentError("Please set the DASHSCOPE_API_KEY environment variable.")
 
         # Initialise models
         try:
-            self.embeddings = DashScopeEmbeddings(model=embedding_model)
+            self.embeddings = get_embeddings(embedding_model)
             self.llm = CustomChatDashScope(model=llm_model, temperature=temperature)
+            # Intent extraction is a small JSON task; a cheaper model is enough.
+            self.intent_llm = CustomChatDashScope(model=intent_llm_model, temperature=0.1)
+            self.history_manager = HistoryManager(
+                CustomChatDashScope(model=llm_model, temperature=0.3),
+                keep_turns=history_turns,
+                token_budget=history_token_budget,
+            )
             print(f"[{self.subject_name}] LLM & Embedding models initialised.")
         except Exception as exc:
             raise RuntimeError(f"Model initialisation failed: {exc}") from exc
@@ -100,18 +157,70 @@ class BaseDialogueAgent:
     # ------------------------------------------------------------------
 
     def _load_knowledge_base(self) -> Optional[FAISS]:
-        """Attempt to load the FAISS vector store configured for the agent."""
+        """Attempt to load the FAISS vector store configured for the agent (shared per process)."""
         try:
             print(f"[{self.subject_name}] Loading knowledge base ...")
-            return FAISS.load_local(
-                self.vectorstore_path,
-                self.embeddings,
-                allow_dangerous_deserialization=True,
-            )
+            return get_vectorstore(self.vectorstore_path, self.embedding_model)
         except Exception as exc:
             print(f"[{self.subject_name}] ⚠️  Failed to load knowledge base: {exc}. Running without retrieval.")
             return None
 
+    @staticmethod
+    def _build_intent_matcher(
+        topics: Sequence[str],
+        topic_synonyms: Mapping[str, str],
+        characters: Mapping[str, str],
+    ) -> KeywordMatcher:
+        patterns: Dict[str, Tuple[str, Optional[str]]] = {t: ("topic", t) for t in topics}
+        patterns.update({variant: ("topic", topic) for variant, topic in topic_synonyms.items()})
+        patterns.update({term: ("", None) for term in _NON_CHARACTER_TERMS if term not in patterns})
+        patterns.update({name: ("character", person) for name, person in characters.items()})
+        return KeywordMatcher(patterns)
+
+    def _find_intent_terms(self, user_input: str) -> Dict[str, List[str]]:
+        found: Dict[str, List[str]] = {"topic": [], "character": [], "": []}
+        for match in self.intent_matcher.find_longest(user_input):
+            kind, value = match.value
+            if value not in found[kind]:
+                found[kind].append(value)
+        return found
+
+    def match_intent(self, user_input: str) -> Optional[Tuple[str, str]]:
+        """Resolve ``(topic, character)`` locally, or ``None`` if the input is ambiguous.
+
+        Succeeds when exactly one known topic and at most one character occur;
+        without a character the default persona is used.
+        """
+        found = self._find_intent_terms(user_input)
+        if len(found["topic"]) == 1 and len(found["character"]) <= 1:
+            character = found["character"][0] if found["character"] else self.default_character
+            return found["topic"][0], character
+        return None
+
+    def _parse_intent_with_llm(self, user_input: str) -> Tuple[str, str]:
+        intent_prompt = self._INTENT_PROMPT_TMPL.format(
+            user_input=user_input,
+            default_topic=self.default_topic,
+            default_character=self.default_character,
+        )
+        messages = [
+            SystemMessage(content="你是一个意图识别专家。"),
+            HumanMessage(content=intent_prompt),
+        ]
+        llm_response = self.intent_llm.invoke(messages)
+        match = re.search(r"\{.*\}", llm_response.content, re.DOTALL)
+        if not match:
+            raise ValueError("LLM did not return valid JSON.")
+        parsed = json.loads(match.group(0))
+        if not isinstance(parsed, dict):
+            raise ValueError("LLM did not return a JSON object.")
+        topic = parsed.get("topic")
+        character = parsed.get("character")
+        return (
+            topic.strip() if isinstance(topic, str) and topic.strip() else self.default_topic,
+            character.strip() if isinstance(character, str) and character.strip() else self.default_character,
+        )
+
     # ------------------------------------------------------------------
     # LangGraph nodes
     # ------------------------------------------------------------------
@@ -126,29 +235,17 @@ class BaseDialogueAgent:
 
         # Only parse at the first turn
         if state["turn_count"] == 0:
-            intent_prompt = self._INTENT_PROMPT_TMPL.format(
-                user_input=user_input,
-                default_topic=self.default_topic,
-                default_character=self.default_character,
-            )
-            messages = [
-                SystemMessage(content="你是一个意图识别专家。"),
-                HumanMessage(content=intent_prompt),
-            ]
-
-            try:
-                llm_response = self.llm.invoke(messages)
-                match = re.search(r"\{.*\}", llm_response.content, re.DOTALL)
-                if match:
-                    parsed = eval(match.group(0))  # noqa: S307 – controlled LLM output
-                    current_topic = parsed.get("topic", self.default_topic)
-                    simulated_character = parsed.get("character", self.default_character)
-                else:
-                    raise ValueError("LLM did not return valid JSON.")
-            except Exception as exc:
-                print(f"Intent parsing failed: {exc} – falling back to defaults.")
-                current_topic = self.default_topic
-                simulated_character = self.default_character
+            matched = self.match_intent(user_input)
+            if matched is not None:
+                current_topic, simulated_character = matched
+                print(f"Intent matched locally: {current_topic} / {simulated_character}")
+            else:
+                try:
+                    current_topic, simulated_character = self._parse_intent_with_llm(user_input)
+                except Exception as exc:
+                    print(f"Intent parsing failed: {exc} – falling back to defaults.")
+                    current_topic = self.default_topic
+                    simulated_character = self.default_character
 
             conversation_history = [{"role": "user", "content": user_input}]
         else:
@@ -162,21 +259,76 @@ class BaseDialogueAgent:
             "dialogue_status": "continue",
         }
 
+    def _retrieval_query(self, topic: str, character: str) -> str:
+        return f"{topic} {self.subject_name} {character}"
+
+    def _search_docs(self, query: str) -> List[str]:
+        docs = self.vectorstore.similarity_search(query, k=5)
+        return list(dict.fromkeys([doc.page_content for doc in docs]))[:5]
+
+    def speculative_retrieve_node(self, state: DialogueGraphState) -> Dict[str, Any]:
+        """On the first turn, retrieve for a guessed topic while the intent is parsed.
+
+        The guess is the first known topic and character in the input.  The
+        result is only used if the parsed intent yields the same retrieval query.
+        """
+        if state["turn_count"] > 0 or self.vectorstore is None:
+            return {"speculative_query": "", "speculative_docs": []}
+        found = self._find_intent_terms(state["user_input"])
+        if not found["topic"]:
+            return {"speculative_query": "", "speculative_docs": []}
+        topic = found["topic"][0]
+        character = found["character"][0] if found["character"] else self.default_character
+        query = self._retrieval_query(topic, character)
+        try:
+            docs = self._search_docs(query)
+        except Exception as exc:
+            print(f"Speculative retrieval failed: {exc}")
+            return {"speculative_query": "", "speculative_docs": []}
+        return {"speculative_query": query, "speculative_docs": docs}
+
     def retrieve_knowledge_node(self, state: DialogueGraphState) -> Dict[str, Any]:
-        """Retrieve relevant document snippets using the vector store."""
-        print(f"Retrieving docs for topic '{state['current_topic']}' ...")
+        """Retrieve relevant document snippets using the vector store.
 
+        Topic and character do not change after the first turn, so the snippets
+        carried in the state are reused while the query is unchanged.  On the
+        first turn a speculative result for the same query is used as is.
+        """
         if self.vectorstore is None:
             err = "Vector store not loaded."
             print(err)
             return {"retrieved_docs": [], "error_message": err, "dialogue_status": "error"}
 
         try:
-            query = f"{state['current_topic']} {self.subject_name} {state['simulated_character']}"
-            docs = self.vectorstore.similarity_search(query, k=5)
-            retrieved = list(dict.fromkeys([doc.page_content for doc in docs]))[:5]
-            print(f"Retrieved {len(retrieved)} document snippets.")
-            return {"retrieved_docs": retrieved, "error_message": None, "dialogue_status": "continue"}
+            query = self._retrieval_query(state["current_topic"], state["simulated_character"])
+            if query == state["retrieval_query"] and state["retrieved_docs"]:
+                print(f"Reusing {len(state['retrieved_docs'])} document snippets for topic '{state['current_topic']}'.")
+                retrieved = state["retrieved_docs"]
+            elif state["speculative_docs"] and state["speculative_query"] == query:
+                print(f"Using speculative retrieval for topic '{state['current_topic']}'.")
+                retrieved = state["speculative_docs"]
+            else:
+                print(f"Retrieving docs for topic '{state['current_topic']}' ...")
+                retrieved = self._search_docs(query)
+                print(f"Retrieved {len(retrieved)} document snippets.")
+
+            drift_docs: List[str] = []
+            if self.drift_retrieval and state["turn_count"] > 0:
+                hits = self.vectorstore.similarity_search_with_relevance_scores(
+                    state["user_input"], k=3, score_threshold=self.drift_threshold
+                )
+                drift_docs = [doc.page_content for doc, _ in hits if doc.page_content not in retrieved]
+                if drift_docs:
+                    print(f"Added {len(drift_docs)} snippets relevant to the latest message.")
+
+            return {
+                "retrieved_docs": retrieved,
+                "retrieval_query": query,
+                "drift_docs": drift_docs,
+                "speculative_docs": [],
+                "error_message": None,
+                "dialogue_status": "continue",
+            }
         except Exception as exc:
             err = f"Retrieval error: {exc}"
             print(err)
@@ -189,7 +341,11 @@ class BaseDialogueAgent:
         current_topic = state["current_topic"]
         simulated_character = state["simulated_character"]
         conversation_history = state["conversation_history"]
-        retrieved_docs = state["retrieved_docs"]
+        # Snippets for the latest message first; at most five in total.
+        retrieved_docs = list(dict.fromkeys(state["drift_docs"] + state["retrieved_docs"]))[:5]
+        summary, summarized_count, pending = self.history_manager.resolve(
+            state["history_summary"], state["summarized_count"], state["pending_summary"]
+        )
 
         system_content = (
             f"你是一个资深的{self.subject_name}教师，现在你正在扮演 {simulated_character}，与学生进行一场关于 {current_topic} 的苏格拉底式对话。\n"
@@ -202,10 +358,15 @@ class BaseDialogueAgent:
             "6. 不要分点回答，回答不超过300字\n\n"
             "参考资料：\n"
             f"{'   '.join(retrieved_docs)}\n\n"
-            "当前对话历史：\n"
+        )
+        if summary:
+            system_content += f"此前对话摘要：\n{summary}\n\n"
+        system_content += "当前对话历史：\n"
+        recent_history = self.history_manager.select(
+            conversation_history, summarized_count, reserved_tokens=estimate_tokens(system_content)
         )
         messages: List[AIMessage | HumanMessage | SystemMessage] = [SystemMessage(content=system_content)]
-        for msg in conversation_history:
+        for msg in recent_history:
             if msg["role"] == "user":
                 messages.append(HumanMessage(content=msg["content"]))
             else:
@@ -221,6 +382,10 @@ class BaseDialogueAgent:
                 "error_message": None,
                 "turn_count": state["turn_count"] + 1,
                 "dialogue_status": "continue",
+                "history_summary": summary,
+                "summarized_count": summarized_count,
+                # Summarize off the critical path; adopted on a later turn.
+                "pending_summary": self.history_manager.schedule(new_history, summary, summarized_count, pending),
             }
         except Exception as exc:
             err = f"Generation error: {exc}"
@@ -239,11 +404,15 @@ class BaseDialogueAgent:
         print(f"[{self.subject_name}] Building workflow graph ...")
         workflow = StateGraph(DialogueGraphState)
         workflow.add_node("parse_user_intent", self.parse_user_intent_node)
+        workflow.add_node("speculative_retrieve", self.speculative_retrieve_node)
         workflow.add_node("retrieve_knowledge", self.retrieve_knowledge_node)
         workflow.add_node("generate_socratic_response", self.generate_socratic_response_node)
 
-        workflow.set_entry_point("parse_user_intent")
-        workflow.add_edge("parse_user_intent", "retrieve_knowledge")
+        # Intent parsing and speculative retrieval run in parallel (they write
+        # disjoint state keys) and join before retrieve_knowledge.
+        workflow.add_edge(START, "parse_user_intent")
+        workflow.add_edge(START, "speculative_retrieve")
+        workflow.add_edge(["parse_user_intent", "speculative_retrieve"], "retrieve_knowledge")
         workflow.add_edge("retrieve_knowledge", "generate_socratic_response")
         workflow.add_edge("generate_socratic_response", END)
 
@@ -254,57 +423,114 @@ class BaseDialogueAgent:
     # Public API
     # ------------------------------------------------------------------
 
-    def process_dialogue(
+    def _initial_state(
         self,
         user_input: str,
         current_state: Optional[DialogueGraphState] = None,
-    ) -> Dict[str, Any]:
-        """Run one turn of dialogue and return the new state + response."""
-        print(f"\n>> USER: {user_input}")
-        if self.graph is None:
-            return {"response": "Graph not available", "status": "error"}
-
+    ) -> DialogueGraphState:
         if current_state is None:
-            init_state: DialogueGraphState = {
+            return {
                 "user_input": user_input,
                 "current_topic": "",
                 "simulated_character": "",
                 "conversation_history": [],
                 "retrieved_docs": [],
+                "retrieval_query": "",
+                "drift_docs": [],
+                "speculative_query": "",
+                "speculative_docs": [],
                 "socratic_response": "",
                 "turn_count": 0,
                 "error_message": None,
                 "dialogue_status": "continue",
+                "history_summary": "",
+                "summarized_count": 0,
+                "pending_summary": None,
             }
-        else:
-            init_state = {
-                "user_input": user_input,
-                "current_topic": current_state["current_topic"],
-                "simulated_character": current_state["simulated_character"],
-                "conversation_history": current_state["conversation_history"],
-                "retrieved_docs": current_state["retrieved_docs"],
-                "socratic_response": "",
-                "turn_count": current_state["turn_count"],
-                "error_message": None,
-                "dialogue_status": "continue",
-            }
+        return {
+            "user_input": user_input,
+            "current_topic": current_state["current_topic"],
+            "simulated_character": current_state["simulated_character"],
+            "conversation_history": current_state["conversation_history"],
+            "retrieved_docs": current_state["retrieved_docs"],
+            "retrieval_query": current_state.get("retrieval_query", ""),
+            "drift_docs": [],
+            "speculative_query": "",
+            "speculative_docs": [],
+            "socratic_response": "",
+            "turn_count": current_state["turn_count"],
+            "error_message": None,
+            "dialogue_status": "continue",
+            "history_summary": current_state.get("history_summary", ""),
+            "summarized_count": current_state.get("summarized_count", 0),
+            "pending_summary": current_state.get("pending_summary"),
+        }
 
-        try:
-            final_state = self.graph.invoke(init_state)
-            if final_state["error_message"]:
-                return {
-                    "response": f"Error: {final_state['error_message']}",
-                    "status": "error",
-                    "state": final_state,
-                }
+    @staticmethod
+    def _result_from_state(final_state: DialogueGraphState) -> Dict[str, Any]:
+        if final_state["error_message"]:
             return {
-                "response": final_state["socratic_response"],
-                "status": "continue",
+                "response": f"Error: {final_state['error_message']}",
+                "status": "error",
                 "state": final_state,
             }
+        return {
+            "response": final_state["socratic_response"],
+            "status": "continue",
+            "state": final_state,
+        }
+
+    def process_dialogue(
+        self,
+        user_input: str,
+        current_state: Optional[DialogueGraphState] = None,
+    ) -> Dict[str, Any]:
+        """Run one turn of dialogue and return the new state + response."""
+        print(f"\n>> USER: {user_input}")
+        if self.graph is None:
+            return {"response": "Graph not available", "status": "error"}
+
+        init_state = self._initial_state(user_input, current_state)
+
+        try:
+            final_state = self.graph.invoke(init_state)
+            return self._result_from_state(final_state)
         except Exception as exc:
             return {
                 "response": f"System error: {exc}",
                 "status": "error",
                 "state": init_state,
-            } 
\ No newline at end of file
+            }
+
+    def stream_dialogue(
+        self,
+        user_input: str,
+        current_state: Optional[DialogueGraphState] = None,
+    ) -> Iterator[Dict[str, Any]]:
+        """Run one turn of dialogue, yielding the reply as it is generated.
+
+        Yields ``{"type": "token", "delta": str}`` events for the Socratic reply
+        and finally ``{"type": "done", **result}`` where *result* has the same
+        shape as the return value of :meth:`process_dialogue`.
+        """
+        print(f"\n>> USER: {user_input}")
+        if self.graph is None:
+            yield {"type": "done", "response": "Graph not available", "status": "error"}
+            return
+
+        init_state = self._initial_state(user_input, current_state)
+        final_state: Optional[DialogueGraphState] = None
+        try:
+            for mode, payload in self.graph.stream(init_state, stream_mode=["messages", "values"]):
+                if mode == "values":
+                    final_state = payload
+                    continue
+                chunk, metadata = payload
+                # Only the persona reply is user-visible; intent parsing is not.
+                if metadata.get("langgraph_node") == "generate_socratic_response" and chunk.content:
+                    yield {"type": "token", "delta": chunk.content}
+        except Exception as exc:
+            yield {"type": "done", "response": f"System error: {exc}", "status": "error", "state": init_state}
+            return
+
+        yield {"type": "done", **self._result_from_state(final_state or init_state)}
@@ -4,45 +4,52 @@ generating Mermaid-format knowledge graphs for any subject.
 """
 import os
 import re
-from typing import List
+import time
+from typing import Dict, Iterable, List, Optional
 
-from langchain_community.vectorstores import FAISS
-from langchain_dashscope.embeddings import DashScopeEmbeddings
 from langchain_core.prompts import PromptTemplate
 from langchain_core.messages import SystemMessage, HumanMessage
 
+from .kg_cache import KnowledgeGraphCache
 from .llm_wrapper import CustomChatDashScope
+from .vector_utils import get_embeddings, get_vectorstore
 
 
 class BaseKnowledgeGraphAgent:
     """Base class for generating Mermaid-format knowledge graphs."""
 
-    def __init__(self, subject_name: str, vectorstore_path: str):
+    def __init__(
+        self,
+        subject_name: str,
+        vectorstore_path: str,
+        embedding_model: str = "text-embedding-v2",
+        cache: Optional[KnowledgeGraphCache] = None,
+    ):
         """
         Initializes the base knowledge graph agent.
 
         Args:
             subject_name: The name of the subject (e.g., "马克思主义基本原理").
             vectorstore_path: The path to the FAISS vector store.
+            embedding_model: The embedding model to use for retrieval.
+            cache: Optional persistent cache of formatted outputs per normalized topic.
         """
         self.subject_name = subject_name
         self.vectorstore_path = vectorstore_path
+        self.embedding_model = embedding_model
+        self.cache = cache
 
         if "DASHSCOPE_API_KEY" not in os.environ:
             raise EnvironmentError("Please set the DASHSCOPE_API_KEY environment variable.")
 
         try:
-            self.embeddings = DashScopeEmbeddings(model="text-embedding-v2")
+            self.embeddings = get_embeddings(self.embedding_model)
             self.llm = CustomChatDashScope(model="qwen-max", temperature=0.5)
         except Exception as e:
             raise RuntimeError(f"Model initialization failed: {e}")
 
         try:
-            self.vectorstore = FAISS.load_local(
-                self.vectorstore_path,
-                self.embeddings,
-                allow_dangerous_deserialization=True,
-            )
+            self.vectorstore = get_vectorstore(self.vectorstore_path, self.embedding_model)
         except Exception as e:
             raise RuntimeError(f"Failed to load vector store from {self.vectorstore_path}: {e}")
 
@@ -116,8 +123,43 @@ mindmap
     def build_knowledge_graph(self, topic: str) -> str:
         """
         Main workflow: retrieves context -> generates Mermaid code and summary.
+        Served from the cache when an equivalent topic was built before.
         """
+        if self.cache is not None:
+            cached = self.cache.get(self.subject_name, topic)
+            if cached is not None:
+                return cached
+
         docs = self._retrieve_docs(topic, k=5)
         context = "\n\n".join(docs)
         raw_output = self._generate_mermaid(topic, context)
-        return self._format_mermaid_response(raw_output) 
\ No newline at end of file
+        formatted = self._format_mermaid_response(raw_output)
+        if self.cache is not None and formatted:
+            self.cache.set(self.subject_name, topic, formatted)
+        return formatted
+
+    def prewarm(self, topics: Iterable[str], force: bool = False) -> Dict[str, str]:
+        """
+        Builds and caches the graphs for ``topics`` ahead of time.
+
+        Returns a status per topic: ``"cached"`` (already present), ``"built"``
+        or the error message.
+        """
+        if self.cache is None:
+            raise RuntimeError("No knowledge graph cache configured.")
+
+        status: Dict[str, str] = {}
+        for topic in topics:
+            if self.cache.get(self.subject_name, topic) is not None:
+                if not force:
+                    status[topic] = "cached"
+                    continue
+                self.cache.delete(self.subject_name, topic)
+            start = time.time()
+            try:
+                self.build_knowledge_graph(topic)
+                status[topic] = "built"
+            except Exception as e:
+                status[topic] = f"error: {e}"
+            print(f"[{self.subject_name}] Prewarm '{topic}': {status[topic]} ({time.time() - start:.1f}s)")
+        return status 
\ No newline at end of file
@@ -0,0 +1,744 @@
+"""
+Pooled HTTP transport for the DashScope generation APIs.
+
+The ``dashscope`` SDK calls have no timeout, no retry and no control over
+connection reuse, so one slow upstream call can hold a Flask worker forever.
+This module talks to the same REST endpoints with ``httpx`` instead:
+
+- :class:`DashScopeClient` (sync) and :class:`AsyncDashScopeClient` keep one
+  keep-alive connection pool per process (per event loop for async);
+- every call has a deadline covering all of its attempts; each attempt gets
+  at most ``attempt_timeout`` of it;
+- timeouts, connection errors and 429/5xx answers are retried with
+  exponential backoff and full jitter (honouring ``Retry-After``);
+- a per-model :class:`CircuitBreaker` fails fast while a model keeps failing,
+  instead of letting every request wait for its own timeouts.
+
+Settings are per model (:class:`RetryPolicy`, :func:`configure_model`).  The
+endpoint can be pointed at a local server with ``DASHSCOPE_BASE_URL``; for
+tests and offline development :func:`make_stub_transport` returns an
+``httpx.MockTransport`` that answers like DashScope without any network access::
+
+    client = DashScopeClient(transport=make_stub_transport(["你好"]))
+"""
+import asyncio
+import json
+import os
+import random
+import threading
+import time
+import weakref
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterable,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Tuple,
+    Union,
+)
+
+import dashscope
+import httpx
+
+DASHSCOPE_BASE_URL = "https://dashscope.aliyuncs.com/api/v1"
+TEXT_GENERATION_PATH = "/services/aigc/text-generation/generation"
+MULTIMODAL_GENERATION_PATH = "/services/aigc/multimodal-generation/generation"
+
+RETRYABLE_STATUS_CODES = frozenset({429, 500, 502, 503, 504})
+
+
+class DashScopeAPIError(Exception):
+    """A non-success answer from DashScope (same message format as the sync wrapper).
+
+    ``status_code`` is ``None`` for transport failures (timeouts, refused
+    connections); those are retryable like 429 and 5xx answers.
+    """
+
+    def __init__(
+        self,
+        code: Any,
+        message: Any,
+        status_code: Optional[int] = None,
+        request_id: Optional[str] = None,
+        retry_after: Optional[float] = None,
+    ):
+        super().__init__("DashScope API Error: Code {} , Message {}".format(code, message))
+        self.code = code
+        self.message = message
+        self.status_code = status_code
+        self.request_id = request_id
+        self.retry_after = retry_after
+
+    @property
+    def retryable(self) -> bool:
+        return self.status_code is None or self.status_code in RETRYABLE_STATUS_CODES
+
+
+class CircuitOpenError(DashScopeAPIError):
+    """Raised without calling DashScope while the model's circuit breaker is open."""
+
+    def __init__(self, model: str, retry_in: float):
+        super().__init__("CircuitOpen", f"{model} 暂时不可用，{retry_in:.0f} 秒后重试", status_code=503)
+        self.model = model
+
+    @property
+    def retryable(self) -> bool:
+        return False
+
+
+class RetryPolicy(NamedTuple):
+    """Transport settings of one model (all times in seconds)."""
+
+    deadline: float = 120.0
+    """Budget of a whole call, retries and backoff included (time to first token when streaming)."""
+    attempt_timeout: float = 60.0
+    """Limit of a single attempt; for streams, the longest gap between two events."""
+    connect_timeout: float = 5.0
+    max_attempts: int = 3
+    backoff_base: float = 0.5
+    backoff_max: float = 8.0
+    failure_threshold: int = 5
+    """Consecutive retryable failures that open the circuit breaker."""
+    reset_timeout: float = 30.0
+    """How long the breaker stays open before one trial call is let through."""
+
+    def backoff(self, attempt: int) -> float:
+        """Full-jitter exponential delay after the ``attempt``-th failure (1-based)."""
+        return random.uniform(0, min(self.backoff_max, self.backoff_base * 2 ** (attempt - 1)))
+
+
+DEFAULT_POLICY = RetryPolicy()
+
+# Shared by the default clients; change with configure_model().
+MODEL_POLICIES: Dict[str, RetryPolicy] = {
+    # Intent parsing and other short answers: fail fast and fall back.
+    "qwen-turbo": RetryPolicy(deadline=20.0, attempt_timeout=8.0),
+    "qwen-vl-max": RetryPolicy(deadline=90.0, attempt_timeout=45.0, max_attempts=2),
+}
+
+
+def configure_model(model: str, **settings: Any) -> RetryPolicy:
+    """Override :class:`RetryPolicy` fields for ``model`` in the shared clients."""
+    policy = MODEL_POLICIES.get(model, DEFAULT_POLICY)._replace(**settings)
+    MODEL_POLICIES[model] = policy
+    for client in (_default_client, _default_async_client):
+        if client is not None:
+            client.breakers.pop(model, None)
+    return policy
+
+
+class CircuitBreaker:
+    """Consecutive-failure circuit breaker: closed -> open -> half-open -> closed."""
+
+    def __init__(self, failure_threshold: int, reset_timeout: float, clock: Callable[[], float] = time.monotonic):
+        self.failure_threshold = failure_threshold
+        self.reset_timeout = reset_timeout
+        self._clock = clock
+        self._lock = threading.Lock()
+        self.failures = 0
+        self._opened_at: Optional[float] = None
+        self._trial_running = False
+
+    @property
+    def state(self) -> str:
+        with self._lock:
+            if self._opened_at is None:
+                return "closed"
+            return "open" if self._clock() - self._opened_at < self.reset_timeout else "half-open"
+
+    def before_call(self, model: str) -> None:
+        """Raise :class:`CircuitOpenError` unless a call may go through."""
+        with self._lock:
+            if self._opened_at is None:
+                return
+            remaining = self.reset_timeout - (self._clock() - self._opened_at)
+            if remaining > 0 or self._trial_running:
+                raise CircuitOpenError(model, max(remaining, 0.0))
+            self._trial_running = True
+
+    def record_success(self) -> None:
+        with self._lock:
+            self.failures = 0
+            self._opened_at = None
+            self._trial_running = False
+
+    def record_failure(self) -> None:
+        with self._lock:
+            self.failures += 1
+            # A failed half-open trial re-opens the breaker immediately.
+            if self._trial_running or self.failures >= self.failure_threshold:
+                self._opened_at = self._clock()
+            self._trial_running = False
+
+    def release(self) -> None:
+        """End a call that neither succeeded nor failed upstream (e.g. it was cancelled)."""
+        with self._lock:
+            self._trial_running = False
+
+
+def _api_key() -> str:
+    key = dashscope.api_key or os.environ.get("DASHSCOPE_API_KEY")
+    if not key:
+        raise ValueError("DASHSCOPE_API_KEY environment variable not set.")
+    return key
+
+
+def build_generation_payload(
+    model: str,
+    messages: List[Dict[str, Any]],
+    temperature: float,
+    **parameters: Any,
+) -> Dict[str, Any]:
+    """Request body for the text-generation endpoint (``result_format=message``)."""
+    return {
+        "model": model,
+        "input": {"messages": messages},
+        "parameters": {"result_format": "message", "temperature": temperature, **parameters},
+    }
+
+
+def build_multimodal_payload(
+    model: str,
+    messages: List[Dict[str, Any]],
+    temperature: float,
+    **parameters: Any,
+) -> Dict[str, Any]:
+    """Request body for the multimodal-generation endpoint (qwen-vl models)."""
+    return {
+        "model": model,
+        "input": {"messages": messages},
+        "parameters": {"temperature": temperature, **parameters},
+    }
+
+
+def _invalid_response(detail: Any) -> DashScopeAPIError:
+    # Treated like a bad gateway: retryable, and counted by the circuit breaker.
+    return DashScopeAPIError("InvalidResponse", str(detail)[:200], status_code=502)
+
+
+def parse_generation_response(status_code: int, body: Any) -> str:
+    """Return the assistant message content or raise :class:`DashScopeAPIError`.
+
+    Multimodal replies (a list of ``{"text": ...}`` parts) are joined into one string.
+    Malformed bodies raise a retryable ``InvalidResponse`` error.
+    """
+    if not isinstance(body, dict):
+        raise _invalid_response(body)
+    if status_code == 200 and "output" in body:
+        try:
+            content = body["output"]["choices"][0]["message"]["content"]
+        except (KeyError, IndexError, TypeError) as exc:
+            raise _invalid_response(body) from exc
+        if isinstance(content, list):
+            content = "".join(part.get("text", "") for part in content if isinstance(part, dict))
+        if not isinstance(content, str):
+            raise _invalid_response(body)
+        return content
+    raise DashScopeAPIError(
+        body.get("code", status_code),
+        body.get("message", "unknown"),
+        status_code=status_code,
+        request_id=body.get("request_id"),
+    )
+
+
+def _response_body(response: httpx.Response) -> Dict[str, Any]:
+    try:
+        return response.json()
+    except ValueError:  # invalid JSON or encoding
+        return {"code": response.status_code, "message": response.text}
+
+
+def _retry_after(response: httpx.Response) -> Optional[float]:
+    try:
+        return float(response.headers["Retry-After"])
+    except (KeyError, ValueError):
+        return None
+
+
+def _raise_for_response(response: httpx.Response, body: Dict[str, Any]) -> None:
+    """Raise :class:`DashScopeAPIError` for a non-200 answer."""
+    if response.status_code == 200:
+        return
+    try:
+        parse_generation_response(response.status_code, body)
+    except DashScopeAPIError as exc:
+        exc.retry_after = _retry_after(response)
+        raise
+
+
+def _transport_error(exc: httpx.RequestError) -> DashScopeAPIError:
+    return DashScopeAPIError(type(exc).__name__, str(exc) or repr(exc))
+
+
+def _iter_sse_deltas(lines: Iterable[str]) -> Iterator[str]:
+    for line in lines:
+        if not line.startswith("data:"):
+            continue
+        try:
+            body = json.loads(line[len("data:"):])
+        except ValueError as exc:
+            raise _invalid_response(line) from exc
+        # Errors after the stream started arrive as a data event with a code.
+        delta = parse_generation_response(200 if isinstance(body, dict) and "output" in body else 500, body)
+        if delta:
+            yield delta
+
+
+class _Transport:
+    """Settings, policies and circuit breakers shared by the sync and async clients."""
+
+    def __init__(
+        self,
+        base_url: Optional[str] = None,
+        policies: Optional[Dict[str, RetryPolicy]] = None,
+        default_policy: RetryPolicy = DEFAULT_POLICY,
+        max_connections: int = 100,
+        max_keepalive_connections: int = 20,
+        keepalive_expiry: float = 30.0,
+    ):
+        """
+        Args:
+            base_url: API root; defaults to ``DASHSCOPE_BASE_URL`` or the public endpoint.
+            policies: Model -> :class:`RetryPolicy`; defaults to the shared ``MODEL_POLICIES``.
+            default_policy: Policy of models without an entry in ``policies``.
+            max_connections / max_keepalive_connections / keepalive_expiry: Pool limits.
+        """
+        self.base_url = base_url or os.environ.get("DASHSCOPE_BASE_URL", DASHSCOPE_BASE_URL)
+        self.policies = MODEL_POLICIES if policies is None else policies
+        self.default_policy = default_policy
+        self.limits = httpx.Limits(
+            max_connections=max_connections,
+            max_keepalive_connections=max_keepalive_connections,
+            keepalive_expiry=keepalive_expiry,
+        )
+        self.breakers: Dict[str, CircuitBreaker] = {}
+        self._breakers_lock = threading.Lock()
+
+    def policy(self, model: str) -> RetryPolicy:
+        return self.policies.get(model, self.default_policy)
+
+    def breaker(self, model: str) -> CircuitBreaker:
+        breaker = self.breakers.get(model)
+        if breaker is None:
+            with self._breakers_lock:
+                breaker = self.breakers.get(model)
+                if breaker is None:
+                    policy = self.policy(model)
+                    breaker = CircuitBreaker(policy.failure_threshold, policy.reset_timeout)
+                    self.breakers[model] = breaker
+        return breaker
+
+    @staticmethod
+    def _headers(stream: bool = False) -> Dict[str, str]:
+        headers = {"Authorization": f"Bearer {_api_key()}"}
+        if stream:
+            headers["X-DashScope-SSE"] = "enable"
+        return headers
+
+    @staticmethod
+    def _attempt_timeout(policy: RetryPolicy, deadline: float) -> httpx.Timeout:
+        remaining = max(deadline - time.monotonic(), 0.001)
+        return httpx.Timeout(
+            min(policy.attempt_timeout, remaining),
+            connect=min(policy.connect_timeout, remaining),
+        )
+
+    @staticmethod
+    def _retry_delay(
+        policy: RetryPolicy,
+        breaker: CircuitBreaker,
+        attempt: int,
+        error: DashScopeAPIError,
+        deadline: float,
+    ) -> Optional[float]:
+        """Record a failed attempt; return the delay before the next one, or ``None`` to give up."""
+        if not error.retryable:
+            if not isinstance(error, CircuitOpenError):
+                # The upstream answered (e.g. 400): it is healthy.
+                breaker.record_success()
+            return None
+        breaker.record_failure()
+        if attempt >= policy.max_attempts:
+            return None
+        delay = max(policy.backoff(attempt), error.retry_after or 0.0)
+        if time.monotonic() + delay >= deadline:
+            return None
+        return delay
+
+
+class DashScopeClient(_Transport):
+    """Blocking DashScope client over one pooled, thread-safe ``httpx.Client``."""
+
+    def __init__(self, *args: Any, transport: Optional[httpx.BaseTransport] = None, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.transport = transport
+        self._http: Optional[httpx.Client] = None
+        self._http_lock = threading.Lock()
+
+    def _client(self) -> httpx.Client:
+        # Created lazily so that worker processes forked after import get their own pool.
+        if self._http is None or self._http.is_closed:
+            with self._http_lock:
+                if self._http is None or self._http.is_closed:
+                    self._http = httpx.Client(base_url=self.base_url, limits=self.limits, transport=self.transport)
+        return self._http
+
+    def _post_json(
+        self, path: str, payload: Dict[str, Any], headers: Dict[str, str], timeout: httpx.Timeout
+    ) -> Dict[str, Any]:
+        try:
+            response = self._client().post(path, json=payload, headers=headers, timeout=timeout)
+        except httpx.RequestError as exc:
+            raise _transport_error(exc) from exc
+        body = _response_body(response)
+        _raise_for_response(response, body)
+        return body
+
+    def request(self, model: str, path: str, payload: Dict[str, Any]) -> str:
+        """POST with the model's deadline, retries and circuit breaker; return the reply text."""
+        policy, breaker = self.policy(model), self.breaker(model)
+        headers = self._headers()  # a missing API key is not an upstream failure
+        deadline = time.monotonic() + policy.deadline
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                breaker.before_call(model)
+                body = self._post_json(path, payload, headers, self._attempt_timeout(policy, deadline))
+                content = parse_generation_response(200, body)
+            except DashScopeAPIError as exc:
+                delay = self._retry_delay(policy, breaker, attempt, exc, deadline)
+                if delay is None:
+                    raise
+                time.sleep(delay)
+                continue
+            except Exception:
+                breaker.record_failure()
+                raise
+            except BaseException:
+                breaker.release()
+                raise
+            breaker.record_success()
+            return content
+
+    def generate(
+        self,
+        model: str,
+        messages: List[Dict[str, Any]],
+        temperature: float = 0.7,
+        **parameters: Any,
+    ) -> str:
+        """Run one text-generation request and return the reply text."""
+        payload = build_generation_payload(model, messages, temperature, **parameters)
+        return self.request(model, TEXT_GENERATION_PATH, payload)
+
+    def multimodal_generate(
+        self,
+        model: str,
+        messages: List[Dict[str, Any]],
+        temperature: float = 0.7,
+        **parameters: Any,
+    ) -> str:
+        """Run one multimodal (image + text) request and return the reply text."""
+        payload = build_multimodal_payload(model, messages, temperature, **parameters)
+        return self.request(model, MULTIMODAL_GENERATION_PATH, payload)
+
+    def stream_generate(
+        self,
+        model: str,
+        messages: List[Dict[str, Any]],
+        temperature: float = 0.7,
+        **parameters: Any,
+    ) -> Iterator[str]:
+        """Streaming (SSE, incremental output) request yielding text deltas.
+
+        Failures before the first delta are retried; later ones are raised.
+        """
+        payload = build_generation_payload(model, messages, temperature, incremental_output=True, **parameters)
+        policy, breaker = self.policy(model), self.breaker(model)
+        headers = self._headers(stream=True)
+        deadline = time.monotonic() + policy.deadline
+        attempt = 0
+        while True:
+            attempt += 1
+            started = False
+            try:
+                breaker.before_call(model)
+                with self._client().stream(
+                    "POST",
+                    TEXT_GENERATION_PATH,
+                    json=payload,
+                    headers=headers,
+                    timeout=self._attempt_timeout(policy, deadline),
+                ) as response:
+                    if response.status_code != 200:
+                        response.read()
+                        _raise_for_response(response, _response_body(response))
+                    for delta in _iter_sse_deltas(response.iter_lines()):
+                        if not started:
+                            started = True
+                            breaker.record_success()
+                        yield delta
+                if not started:
+                    breaker.record_success()
+                return
+            except httpx.RequestError as exc:
+                error = _transport_error(exc)
+                if started:
+                    raise error from exc
+            except DashScopeAPIError as exc:
+                if started:
+                    raise
+                error = exc
+            except Exception:
+                if not started:
+                    breaker.record_failure()
+                raise
+            except BaseException:
+                # Closed or cancelled by the consumer; ends a half-open trial without a verdict.
+                breaker.release()
+                raise
+            delay = self._retry_delay(policy, breaker, attempt, error, deadline)
+            if delay is None:
+                raise error
+            time.sleep(delay)
+
+    def close(self) -> None:
+        if self._http is not None:
+            self._http.close()
+
+
+class AsyncDashScopeClient(_Transport):
+    """Async DashScope client with one pooled ``httpx.AsyncClient`` per event loop."""
+
+    def __init__(self, *args: Any, transport: Optional[httpx.AsyncBaseTransport] = None, **kwargs: Any):
+        super().__init__(*args, **kwargs)
+        self.transport = transport
+        # httpx.AsyncClient is bound to the loop it was first used on.
+        self._clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, httpx.AsyncClient]" = (
+            weakref.WeakKeyDictionary()
+        )
+
+    def _client(self) -> httpx.AsyncClient:
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None or client.is_closed:
+            client = httpx.AsyncClient(base_url=self.base_url, limits=self.limits, transport=self.transport)
+            self._clients[loop] = client
+        return client
+
+    async def _post_json(
+        self, path: str, payload: Dict[str, Any], headers: Dict[str, str], timeout: httpx.Timeout
+    ) -> Dict[str, Any]:
+        try:
+            response = await self._client().post(path, json=payload, headers=headers, timeout=timeout)
+        except httpx.RequestError as exc:
+            raise _transport_error(exc) from exc
+        body = _response_body(response)
+        _raise_for_response(response, body)
+        return body
+
+    async def request(self, model: str, path: str, payload: Dict[str, Any]) -> str:
+        """POST with the model's deadline, retries and circuit breaker; return the reply text."""
+        policy, breaker = self.policy(model), self.breaker(model)
+        headers = self._headers()  # a missing API key is not an upstream failure
+        deadline = time.monotonic() + policy.deadline
+        attempt = 0
+        while True:
+            attempt += 1
+            try:
+                breaker.before_call(model)
+                body = await self._post_json(path, payload, headers, self._attempt_timeout(policy, deadline))
+                content = parse_generation_response(200, body)
+            except DashScopeAPIError as exc:
+                delay = self._retry_delay(policy, breaker, attempt, exc, deadline)
+                if delay is None:
+                    raise
+                await asyncio.sleep(delay)
+                continue
+            except Exception:
+                breaker.record_failure()
+                raise
+            except BaseException:
+                breaker.release()
+                raise
+            breaker.record_success()
+            return content
+
+    async def generate(
+        self,
+        model: str,
+        messages: List[Dict[str, Any]],
+        temperature: float = 0.7,
+        **parameters: Any,
+    ) -> str:
+        """Run one text-generation request and return the reply text."""
+        payload = build_generation_payload(model, messages, temperature, **parameters)
+        return await self.request(model, TEXT_GENERATION_PATH, payload)
+
+    async def stream_generate(
+        self,
+        model: str,
+        messages: List[Dict[str, Any]],
+        temperature: float = 0.7,
+        **parameters: Any,
+    ) -> AsyncIterator[str]:
+        """Streaming (SSE, incremental output) request yielding text deltas.
+
+        Failures before the first delta are retried; later ones are raised.
+        """
+        payload = build_generation_payload(model, messages, temperature, incremental_output=True, **parameters)
+        policy, breaker = self.policy(model), self.breaker(model)
+        headers = self._headers(stream=True)
+        deadline = time.monotonic() + policy.deadline
+        attempt = 0
+        while True:
+            attempt += 1
+            started = False
+            try:
+                breaker.before_call(model)
+                async with self._client().stream(
+                    "POST",
+                    TEXT_GENERATION_PATH,
+                    json=payload,
+                    headers=headers,
+                    timeout=self._attempt_timeout(policy, deadline),
+                ) as response:
+                    if response.status_code != 200:
+                        await response.aread()
+                        _raise_for_response(response, _response_body(response))
+                    async for line in response.aiter_lines():
+                        for delta in _iter_sse_deltas((line,)):
+                            if not started:
+                                started = True
+                                breaker.record_success()
+                            yield delta
+                if not started:
+                    breaker.record_success()
+                return
+            except httpx.RequestError as exc:
+                error = _transport_error(exc)
+                if started:
+                    raise error from exc
+            except DashScopeAPIError as exc:
+                if started:
+                    raise
+                error = exc
+            except Exception:
+                if not started:
+                    breaker.record_failure()
+                raise
+            except BaseException:
+                # Closed or cancelled by the consumer; ends a half-open trial without a verdict.
+                breaker.release()
+                raise
+            delay = self._retry_delay(policy, breaker, attempt, error, deadline)
+            if delay is None:
+                raise error
+            await asyncio.sleep(delay)
+
+    async def aclose(self) -> None:
+        """Close the connection pool of the current event loop."""
+        loop = asyncio.get_running_loop()
+        client = self._clients.pop(loop, None)
+        if client is not None:
+            await client.aclose()
+
+
+_default_client: Optional[DashScopeClient] = None
+_default_async_client: Optional[AsyncDashScopeClient] = None
+
+
+def get_client() -> DashScopeClient:
+    """Process-wide shared :class:`DashScopeClient`."""
+    global _default_client
+    if _default_client is None:
+        _default_client = DashScopeClient()
+    return _default_client
+
+
+def set_client(client: Optional[DashScopeClient]) -> None:
+    """Replace the shared sync client, e.g. with one using :func:`make_stub_transport`."""
+    global _default_client
+    _default_client = client
+
+
+def get_async_client() -> AsyncDashScopeClient:
+    """Process-wide shared :class:`AsyncDashScopeClient`."""
+    global _default_async_client
+    if _default_async_client is None:
+        _default_async_client = AsyncDashScopeClient()
+    return _default_async_client
+
+
+def set_async_client(client: Optional[AsyncDashScopeClient]) -> None:
+    """Replace the shared client, e.g. with one using :func:`make_stub_transport`."""
+    global _default_async_client
+    _default_async_client = client
+
+
+StubReply = Union[str, Dict[str, Any], Callable[[Dict[str, Any]], Union[str, Dict[str, Any]]]]
+
+
+def make_stub_transport(replies: Iterable[StubReply] = ("stub reply",)) -> httpx.MockTransport:
+    """A fake DashScope endpoint for tests.
+
+    Each request consumes the next item of ``replies`` (the last one repeats);
+    streaming requests (``X-DashScope-SSE: enable``) get it as several events:
+
+    - ``str``: a successful reply with that content;
+    - ``dict``: returned as an error, e.g. ``{"status": 429, "code": "Throttling"}``
+      (``"retry_after"`` becomes a ``Retry-After`` header);
+    - an ``httpx.TransportError`` instance: raised, e.g. ``httpx.ReadTimeout("slow")``;
+    - callable: called with the request payload and returning one of the above.
+
+    Usable with both :class:`DashScopeClient` and :class:`AsyncDashScopeClient`.
+    """
+    queue = list(replies) or ["stub reply"]
+    requests: List[Dict[str, Any]] = []
+
+    def result(content: str, finish_reason: str, multimodal: bool) -> Dict[str, Any]:
+        message_content: Any = [{"text": content}] if multimodal else content
+        return {
+            "request_id": "stub",
+            "output": {
+                "choices": [{"finish_reason": finish_reason, "message": {"role": "assistant", "content": message_content}}]
+            },
+            "usage": {"input_tokens": 0, "output_tokens": len(content)},
+        }
+
+    def handler(request: httpx.Request) -> httpx.Response:
+        payload = json.loads(request.content or b"{}")
+        requests.append(payload)
+        reply = queue.pop(0) if len(queue) > 1 else queue[0]
+        if callable(reply):
+            reply = reply(payload)
+        if isinstance(reply, httpx.TransportError):
+            raise reply
+        if isinstance(reply, dict):
+            status = reply.get("status", 500)
+            headers = {"Retry-After": str(reply["retry_after"])} if "retry_after" in reply else {}
+            body = {k: v for k, v in reply.items() if k not in ("status", "retry_after")}
+            return httpx.Response(status, headers=headers, json={"request_id": "stub", **body})
+        multimodal = request.url.path.endswith(MULTIMODAL_GENERATION_PATH)
+        if request.headers.get("X-DashScope-SSE") == "enable":
+            # Incremental output: one SSE event per 4 characters.
+            pieces = [reply[i:i + 4] for i in range(0, len(reply), 4)] or [""]
+            events = [
+                f"id:{i + 1}\nevent:result\ndata:"
+                + json.dumps(result(piece, "stop" if i == len(pieces) - 1 else "null", multimodal), ensure_ascii=False)
+                + "\n\n"
+                for i, piece in enumerate(pieces)
+            ]
+            return httpx.Response(200, headers={"Content-Type": "text/event-stream"}, content="".join(events).encode())
+        return httpx.Response(200, json=result(reply, "stop", multimodal))
+
+    transport = httpx.MockTransport(handler)
+    transport.requests = requests  # type: ignore[attr-defined]
+    return transport
@@ -0,0 +1,158 @@
+"""
+Caching wrapper for embedding models.
+
+Retrieval queries are built from a small vocabulary (``common_topics`` plus the
+subject name), so the same strings are embedded over and over.
+:class:`CachedEmbeddings` puts an in-memory LRU and an optional SQLite tier in
+front of any LangChain ``Embeddings`` implementation, keyed by model + text
+(+ query/document kind).
+"""
+import hashlib
+import threading
+from array import array
+from typing import Dict, List, Optional
+
+from langchain_core.embeddings import Embeddings
+
+from .cache_utils import LRUCache, SQLiteKVStore
+
+
+def _pack(vector: List[float]) -> bytes:
+    return array("f", vector).tobytes()
+
+
+def _unpack(blob: bytes) -> List[float]:
+    values = array("f")
+    values.frombytes(blob)
+    return values.tolist()
+
+
+class CachedEmbeddings(Embeddings):
+    """Embeddings wrapper with an LRU tier and an optional persistent tier."""
+
+    def __init__(
+        self,
+        embeddings: Embeddings,
+        model: str,
+        maxsize: int = 2048,
+        persist_path: Optional[str] = None,
+    ):
+        """
+        Args:
+            embeddings: The underlying embedding model (e.g. ``DashScopeEmbeddings``).
+            model: Model name, part of every cache key.
+            maxsize: Capacity of the in-memory LRU tier.
+            persist_path: SQLite file for the on-disk tier; ``None`` disables it.
+        """
+        self.embeddings = embeddings
+        self.model = model
+        self.memory = LRUCache(maxsize)
+        self.persist_path = persist_path
+        self.disk = SQLiteKVStore(persist_path, namespace="embeddings") if persist_path else None
+        self._stats_lock = threading.Lock()
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+
+    def _key(self, text: str, kind: str) -> str:
+        # DashScope embeds queries and documents differently (``text_type``),
+        # so the two never share an entry.
+        digest = hashlib.sha256(text.encode("utf-8")).hexdigest()
+        return f"{self.model}:{kind}:{digest}"
+
+    def _lookup(self, key: str) -> Optional[List[float]]:
+        vector = self.memory.get(key)
+        if vector is not None:
+            with self._stats_lock:
+                self.hits += 1
+            return vector
+        if self.disk is not None:
+            blob = self.disk.get(key)
+            if blob is not None:
+                vector = _unpack(blob)
+                self.memory.set(key, vector)
+                with self._stats_lock:
+                    self.disk_hits += 1
+                return vector
+        return None
+
+    def _store(self, key: str, vector: List[float]) -> None:
+        self.memory.set(key, vector)
+        if self.disk is not None:
+            self.disk.set(key, _pack(vector))
+
+    def embed_documents(self, texts: List[str]) -> List[List[float]]:
+        """Embed ``texts``, sending only the uncached ones in a single upstream call."""
+        keys = [self._key(t, "document") for t in texts]
+        results: Dict[str, List[float]] = {}
+        missing: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key in results or key in missing:
+                continue
+            vector = self._lookup(key)
+            if vector is None:
+                missing[key] = text
+            else:
+                results[key] = vector
+
+        if missing:
+            with self._stats_lock:
+                self.misses += len(missing)
+            vectors = self.embeddings.embed_documents(list(missing.values()))
+            for key, vector in zip(missing.keys(), vectors):
+                vector = list(vector)
+                self._store(key, vector)
+                results[key] = vector
+
+        return [results[key] for key in keys]
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        """Embed several queries, sending only the uncached ones in a single upstream call.
+
+        Uses the wrapped model's ``embed_queries`` when it offers one and falls
+        back to one ``embed_query`` per miss otherwise.
+        """
+        keys = [self._key(t, "query") for t in texts]
+        results: Dict[str, List[float]] = {}
+        missing: Dict[str, str] = {}
+        for key, text in zip(keys, texts):
+            if key in results or key in missing:
+                continue
+            vector = self._lookup(key)
+            if vector is None:
+                missing[key] = text
+            else:
+                results[key] = vector
+
+        if missing:
+            with self._stats_lock:
+                self.misses += len(missing)
+            batch = getattr(self.embeddings, "embed_queries", None)
+            pending = list(missing.values())
+            vectors = batch(pending) if batch else [self.embeddings.embed_query(t) for t in pending]
+            for key, vector in zip(missing.keys(), vectors):
+                vector = list(vector)
+                self._store(key, vector)
+                results[key] = vector
+
+        return [results[key] for key in keys]
+
+    def embed_query(self, text: str) -> List[float]:
+        key = self._key(text, "query")
+        vector = self._lookup(key)
+        if vector is None:
+            with self._stats_lock:
+                self.misses += 1
+            vector = list(self.embeddings.embed_query(text))
+            self._store(key, vector)
+        return vector
+
+    def stats(self) -> Dict[str, int]:
+        """Hit/miss counters (``hits`` are memory hits, ``disk_hits`` persistent ones)."""
+        return {
+            "hits": self.hits,
+            "disk_hits": self.disk_hits,
+            "misses": self.misses,
+            "size": len(self.memory),
+            "maxsize": self.memory.maxsize,
+        }
@@ -0,0 +1,148 @@
+"""
+Bounded conversation history for long dialogues.
+
+Sending the whole ``conversation_history`` on every turn makes prompt size and
+latency grow linearly with the number of turns.  :class:`HistoryManager`
+keeps the prompt roughly constant:
+
+- only the last ``keep_turns`` exchanges are sent verbatim;
+- older messages are folded into a rolling summary.  Summaries are produced
+  by a background thread after a reply has been generated, and picked up on a
+  later turn; until one is ready the folded messages are simply left out;
+- the system prompt plus history is kept within ``token_budget`` (estimated)
+  tokens by dropping the oldest verbatim messages first.
+
+The full history stays in the dialogue state; only the prompt is compacted.
+"""
+import hashlib
+import json
+import re
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+from langchain_core.language_models import BaseChatModel
+from langchain_core.messages import HumanMessage, SystemMessage
+
+from .cache_utils import LRUCache
+
+Message = Dict[str, str]
+
+_CJK = re.compile(r"[\u3000-\u303f\u3400-\u9fff\uff00-\uffef]")
+
+_SUMMARY_PROMPT = """请将下面的对话内容与已有摘要合并为一段新的摘要，保留学生的主要观点、困惑和已经讨论过的问题，不超过200字。
+
+已有摘要：
+{summary}
+
+新增对话：
+{dialogue}
+"""
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count: one per CJK character, one per four other characters."""
+    cjk = len(_CJK.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+class HistoryManager:
+    """Selects the prompt history and maintains rolling summaries."""
+
+    def __init__(
+        self,
+        llm: BaseChatModel,
+        keep_turns: int = 4,
+        token_budget: int = 6000,
+        max_workers: int = 2,
+    ):
+        """
+        Args:
+            llm: Model used for the background summaries.
+            keep_turns: Number of most recent user/assistant exchanges sent verbatim.
+            token_budget: Estimated token limit for system prompt + history.
+            max_workers: Threads for background summarization.
+        """
+        self.llm = llm
+        self.keep_messages = keep_turns * 2
+        self.token_budget = token_budget
+        self._executor = ThreadPoolExecutor(max_workers=max_workers, thread_name_prefix="history-summary")
+        self._jobs = LRUCache(1024)
+
+    @staticmethod
+    def _job_key(summary: str, folded: List[Message]) -> str:
+        payload = json.dumps([summary, folded], ensure_ascii=False)
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+    def _summarize(self, summary: str, folded: List[Message]) -> str:
+        dialogue = "\n".join(
+            f"{'学生' if m['role'] == 'user' else '老师'}：{m['content']}" for m in folded
+        )
+        prompt = _SUMMARY_PROMPT.format(summary=summary or "（无）", dialogue=dialogue)
+        response = self.llm.invoke([
+            SystemMessage(content="你是一个擅长总结对话要点的助手。"),
+            HumanMessage(content=prompt),
+        ])
+        return str(response.content).strip()
+
+    def resolve(self, summary: str, summarized_count: int, pending: Optional[Dict]) -> Tuple[str, int, Optional[Dict]]:
+        """Adopt a finished background summary.
+
+        Returns the ``(summary, summarized_count, pending)`` to use for this turn.
+        ``pending`` is ``{"key": ..., "upto": ...}`` as returned by :meth:`schedule`.
+        """
+        if not pending:
+            return summary, summarized_count, None
+        future: Optional[Future] = self._jobs.get(pending["key"])
+        if future is None:
+            # Started by another process or evicted; it is rescheduled after this turn.
+            return summary, summarized_count, None
+        if not future.done():
+            return summary, summarized_count, pending
+        self._jobs.pop(pending["key"])
+        try:
+            return future.result(), pending["upto"], None
+        except Exception as exc:
+            print(f"History summarization failed: {exc}")
+            return summary, summarized_count, None
+
+    def select(self, history: List[Message], summarized_count: int, reserved_tokens: int) -> List[Message]:
+        """Recent, not yet summarized messages that fit next to ``reserved_tokens``.
+
+        The latest message is always kept.
+        """
+        recent = history[summarized_count:][-self.keep_messages:] if self.keep_messages else history[-1:]
+        budget = self.token_budget - reserved_tokens
+        selected: List[Message] = []
+        for message in reversed(recent):
+            cost = estimate_tokens(message["content"])
+            if selected and cost > budget:
+                break
+            selected.append(message)
+            budget -= cost
+        selected.reverse()
+        # Keep the user/assistant alternation starting with a user message.
+        while len(selected) > 1 and selected[0]["role"] != "user":
+            selected.pop(0)
+        return selected
+
+    def schedule(
+        self,
+        history: List[Message],
+        summary: str,
+        summarized_count: int,
+        pending: Optional[Dict],
+    ) -> Optional[Dict]:
+        """Start folding messages that left the verbatim window into the summary.
+
+        Returns the ``pending`` marker to store in the dialogue state.
+        """
+        if pending:
+            return pending
+        upto = len(history) - self.keep_messages
+        if upto - summarized_count < 2:
+            return None
+        folded = history[summarized_count:upto]
+        key = self._job_key(summary, folded)
+        if key not in self._jobs:
+            self._jobs.set(key, self._executor.submit(self._summarize, summary, folded))
+        return {"key": key, "upto": upto}
@@ -0,0 +1,117 @@
+"""
+In-memory image handling for the vision endpoints.
+
+An uploaded image is decoded once (multipart file or base64 / data URL in
+JSON) into an :class:`ImagePayload` holding the raw bytes and the MIME type
+sniffed from their magic number, and is handed to the vision wrapper as a
+ready ``data:`` URL.  Nothing is written to disk.
+"""
+import base64
+import binascii
+import hashlib
+from typing import BinaryIO, Optional, Union
+
+# Magic numbers of the formats accepted by qwen-vl.
+_SIGNATURES = (
+    (b"\x89PNG\r\n\x1a\n", "image/png"),
+    (b"\xff\xd8\xff", "image/jpeg"),
+    (b"GIF87a", "image/gif"),
+    (b"GIF89a", "image/gif"),
+    (b"BM", "image/bmp"),
+)
+
+SUPPORTED_MIME_TYPES = frozenset(mime for _, mime in _SIGNATURES) | {"image/webp"}
+
+
+class InvalidImageError(ValueError):
+    """The upload is not valid base64 or not an image of a supported type."""
+
+
+def sniff_mime(data: bytes) -> Optional[str]:
+    """MIME type from the leading bytes, or ``None`` if not a supported image."""
+    if data[:4] == b"RIFF" and data[8:12] == b"WEBP":
+        return "image/webp"
+    for signature, mime in _SIGNATURES:
+        if data.startswith(signature):
+            return mime
+    return None
+
+
+class ImagePayload:
+    """Raw image bytes with their sniffed MIME type."""
+
+    __slots__ = ("data", "mime", "_data_url", "_digest")
+
+    def __init__(self, data: bytes, mime: Optional[str] = None):
+        """
+        Args:
+            data: Encoded image (PNG, JPEG, GIF, BMP or WebP).
+            mime: MIME type; sniffed from ``data`` when omitted.
+
+        Raises:
+            InvalidImageError: ``data`` is empty or not a supported image.
+        """
+        if not data:
+            raise InvalidImageError("图片数据为空")
+        mime = mime or sniff_mime(data)
+        if mime not in SUPPORTED_MIME_TYPES:
+            raise InvalidImageError("不支持的图片格式")
+        self.data = data
+        self.mime = mime
+        self._data_url: Optional[str] = None
+        self._digest: Optional[str] = None
+
+    @classmethod
+    def from_base64(cls, value: str) -> "ImagePayload":
+        """Decode a ``data:image/...;base64,`` URL or bare base64 string.
+
+        The declared type of a data URL is ignored; the bytes decide.
+        """
+        if value.startswith("data:"):
+            header, _, value = value.partition(",")
+            if ";base64" not in header:
+                raise InvalidImageError("图片 data URL 不是 base64 编码")
+        try:
+            data = base64.b64decode(value, validate=True)
+        except (binascii.Error, ValueError) as exc:
+            raise InvalidImageError(f"图片 base64 解码失败: {exc}") from exc
+        return cls(data)
+
+    @classmethod
+    def from_stream(cls, stream: BinaryIO) -> "ImagePayload":
+        """Read an uploaded file object (e.g. ``werkzeug.FileStorage``)."""
+        return cls(stream.read())
+
+    @classmethod
+    def from_path(cls, path: str) -> "ImagePayload":
+        with open(path, "rb") as f:
+            return cls(f.read())
+
+    @classmethod
+    def coerce(cls, image: Union["ImagePayload", str]) -> "ImagePayload":
+        """Accept a payload, a data URL or a file path (command-line use)."""
+        if isinstance(image, cls):
+            return image
+        if image.startswith("data:"):
+            return cls.from_base64(image)
+        return cls.from_path(image)
+
+    @property
+    def data_url(self) -> str:
+        """``data:<mime>;base64,...`` as expected by the DashScope vision API (encoded once)."""
+        if self._data_url is None:
+            self._data_url = f"data:{self.mime};base64,{base64.b64encode(self.data).decode('ascii')}"
+        return self._data_url
+
+    @property
+    def digest(self) -> str:
+        """SHA-256 of the image bytes (hex), used as a cache key."""
+        if self._digest is None:
+            self._digest = hashlib.sha256(self.data).hexdigest()
+        return self._digest
+
+    def __len__(self) -> int:
+        return len(self.data)
+
+    def __repr__(self) -> str:
+        return f"ImagePayload({self.mime}, {len(self.data)} bytes)"
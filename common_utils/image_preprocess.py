@@ -0,0 +1,98 @@
+"""
+Downscaling and recompression of images before they are sent to a vision model.
+
+Phone photos arrive at full camera resolution (often several MB), while
+qwen-vl resamples every image to roughly a megapixel anyway, so the extra
+pixels only cost upload time and latency.  :func:`preprocess_image`:
+
+- applies the EXIF orientation, then drops all metadata (EXIF, GPS, ICC ...);
+- shrinks the image so its longer edge is at most ``max_edge`` pixels;
+- re-encodes it as JPEG (PNG if it has transparency), lowering the quality
+  step by step until it fits in ``max_bytes``.
+
+Results are cached in memory by the SHA-256 of the original bytes and the
+settings, so re-sending the same screenshot is free.  Images that cannot be
+decoded are passed through unchanged.
+"""
+from io import BytesIO
+from typing import Dict, Tuple
+
+from PIL import Image, ImageOps
+
+from .cache_utils import LRUCache
+from .image_payload import ImagePayload
+
+# Encoded results are at most ``max_bytes`` each, so this bounds the memory use.
+_cache = LRUCache(64)
+
+_MIN_QUALITY = 40
+
+
+def _has_alpha(image: Image.Image) -> bool:
+    return image.mode in ("RGBA", "LA") or (image.mode == "P" and "transparency" in image.info)
+
+
+def _encode(image: Image.Image, quality: int, max_bytes: int) -> Tuple[bytes, str]:
+    if _has_alpha(image):
+        buf = BytesIO()
+        image.convert("RGBA").save(buf, "PNG", optimize=True)
+        if buf.tell() <= max_bytes:
+            return buf.getvalue(), "image/png"
+        # Too large as PNG: flatten onto white and fall through to JPEG.
+        background = Image.new("RGB", image.size, "white")
+        background.paste(image.convert("RGBA"), mask=image.convert("RGBA").getchannel("A"))
+        image = background
+
+    image = image.convert("RGB")
+    while True:
+        buf = BytesIO()
+        image.save(buf, "JPEG", quality=quality, optimize=True, progressive=True)
+        if buf.tell() <= max_bytes or quality <= _MIN_QUALITY:
+            return buf.getvalue(), "image/jpeg"
+        quality = max(_MIN_QUALITY, quality - 10)
+
+
+def preprocess_image(
+    payload: ImagePayload,
+    max_edge: int = 1280,
+    quality: int = 85,
+    max_bytes: int = 1024 * 1024,
+) -> ImagePayload:
+    """Downscaled, metadata-free, recompressed copy of ``payload`` (cached).
+
+    The original is returned when it is already small enough and
+    re-encoding would not make it smaller, and when it cannot be decoded.
+    """
+    key = (payload.digest, max_edge, quality, max_bytes)
+    cached = _cache.get(key)
+    if cached is not None:
+        return cached
+
+    try:
+        with Image.open(BytesIO(payload.data)) as opened:
+            has_metadata = bool(opened.info.get("exif") or opened.getexif())
+            # First frame only for animated GIF/WebP.
+            image = ImageOps.exif_transpose(opened)
+            image.load()
+        needs_resize = max(image.size) > max_edge
+        if needs_resize:
+            image.thumbnail((max_edge, max_edge), Image.Resampling.LANCZOS)
+        data, mime = _encode(image, quality, max_bytes)
+    except Exception as e:
+        print(f"[image_preprocess] 无法处理图片，按原样发送: {e}")
+        return payload
+
+    if not needs_resize and not has_metadata and len(data) >= len(payload.data):
+        result = payload
+    else:
+        result = ImagePayload(data, mime)
+    _cache.set(key, result)
+    return result
+
+
+def cache_stats() -> Dict[str, int]:
+    return _cache.stats()
+
+
+def clear_cache() -> None:
+    _cache.clear()
@@ -0,0 +1,93 @@
+"""
+Text extraction from images (OCR), used as the retrieval query for image questions.
+
+:class:`ImageTextExtractor` uses a local Tesseract when ``pytesseract`` and
+the Chinese language data are installed, and otherwise a short transcription
+call to the vision model.  Results are cached by the image digest, so an image
+is read at most once however often it is asked about.
+"""
+from io import BytesIO
+from typing import Dict, Optional
+
+from PIL import Image
+
+from .cache_utils import LRUCache
+from .image_payload import ImagePayload
+from .llm_wrapper import VISION_FALLBACK_NOTICE
+
+try:  # Optional: local OCR without a model call.
+    import pytesseract
+except ImportError:  # pragma: no cover - depends on the environment
+    pytesseract = None
+
+_OCR_PROMPT = "请逐字提取图片中的全部文字，只输出文字本身，不要解释或补充；图片中没有文字时只输出“无”。"
+
+ENGINES = ("auto", "tesseract", "vision")
+
+
+class ImageTextExtractor:
+    """Extracts (and caches) the text printed in an image."""
+
+    def __init__(
+        self,
+        vision_llm=None,
+        engine: str = "auto",
+        max_chars: int = 500,
+        cache_size: int = 256,
+        tesseract_lang: str = "chi_sim+eng",
+    ):
+        """
+        Args:
+            vision_llm: ``CustomVisionChatDashScope`` used by the ``vision`` engine.
+            engine: ``"tesseract"``, ``"vision"`` or ``"auto"`` (Tesseract if
+                available, falling back to the vision model).
+            max_chars: Extracted text is cut to this length.
+            cache_size: Number of images whose text is kept.
+            tesseract_lang: Tesseract language data to use.
+        """
+        if engine not in ENGINES:
+            raise ValueError(f"engine must be one of {ENGINES}")
+        self.vision_llm = vision_llm
+        self.engine = engine
+        self.max_chars = max_chars
+        self.tesseract_lang = tesseract_lang
+        self._cache = LRUCache(cache_size)
+
+    def _tesseract(self, image: ImagePayload) -> Optional[str]:
+        if pytesseract is None or self.engine == "vision":
+            return None
+        try:
+            with Image.open(BytesIO(image.data)) as opened:
+                return pytesseract.image_to_string(opened, lang=self.tesseract_lang)
+        except Exception as e:  # binary or language data missing, unreadable image
+            print(f"[image_text] Tesseract 识别失败: {e}")
+            return None
+
+    def _vision(self, image: ImagePayload) -> Optional[str]:
+        if self.vision_llm is None or self.engine == "tesseract":
+            return None
+        try:
+            text = self.vision_llm.call_with_image(_OCR_PROMPT, image, max_tokens=self.max_chars)
+        except Exception as e:
+            print(f"[image_text] 视觉模型识别失败: {e}")
+            return None
+        if text.startswith(VISION_FALLBACK_NOTICE):  # the model never saw the image
+            return None
+        return "" if text.strip() in ("无", "“无”") else text
+
+    def extract(self, image: ImagePayload) -> str:
+        """Text in ``image`` (whitespace collapsed, at most ``max_chars``); ``""`` if none."""
+        cached = self._cache.get(image.digest)
+        if cached is not None:
+            return cached
+        text = self._tesseract(image)
+        if text is None:
+            text = self._vision(image)
+        if text is None:
+            return ""  # Failed: not cached, the next request tries again.
+        text = " ".join(text.split())[: self.max_chars]
+        self._cache.set(image.digest, text)
+        return text
+
+    def stats(self) -> Dict[str, int]:
+        return self._cache.stats()
@@ -0,0 +1,434 @@
+"""
+Knowledge-base ingestion pipeline (PDF → chunks → embeddings → FAISS).
+
+Compared with the original one-shot script this pipeline
+
+- embeds batches concurrently, throttled by a token-bucket rate limit so the
+  DashScope quota is respected;
+- checkpoints every embedded chunk to a SQLite file, so a crashed or
+  interrupted build resumes where it stopped instead of starting over;
+- writes the finished knowledge base to a temporary directory and swaps it
+  into place, so agents never load a half-written index;
+- updates incrementally: ``manifest.json`` in the knowledge-base folder records
+  a content hash per chunk, and only new or changed chunks are embedded while
+  vectors of removed chunks are deleted from the ID-mapped FAISS index;
+- streams: pages are read lazily, split one page at a time and grouped into
+  embedding batches, with a bounded number of batches in flight, so peak
+  memory is bounded by a few batches rather than by the corpus.
+
+Usage::
+
+    python -m common_utils.ingestion --source mayuan_raw_data --output database_agent_mayuan
+"""
+import argparse
+import hashlib
+import json
+import os
+import shutil
+import threading
+import time
+from array import array
+from concurrent.futures import ALL_COMPLETED, FIRST_COMPLETED, Future, ThreadPoolExecutor, wait
+from itertools import islice
+from pathlib import Path
+from typing import Any, Callable, Dict, Iterable, Iterator, List, Optional, Sequence, Set, Tuple
+
+from langchain_community.docstore.in_memory import InMemoryDocstore
+from langchain_community.document_loaders import PyPDFLoader
+from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
+from langchain_text_splitters import RecursiveCharacterTextSplitter
+
+from .cache_utils import SQLiteKVStore
+from .sqlite_docstore import write_docstore
+from .vector_utils import load_embeddings, load_vectorstore
+
+MANIFEST_FILENAME = "manifest.json"
+MANIFEST_FORMAT = 1
+
+
+class TokenBucket:
+    """Thread-safe token bucket: ``rate`` tokens per second, bursts up to ``capacity``."""
+
+    def __init__(self, rate: float, capacity: Optional[float] = None):
+        if rate <= 0:
+            raise ValueError("rate must be positive")
+        self.rate = rate
+        self.capacity = capacity if capacity is not None else max(1.0, rate)
+        self._tokens = self.capacity
+        self._updated = time.monotonic()
+        self._lock = threading.Lock()
+
+    def acquire(self, tokens: float = 1.0) -> None:
+        """Block until ``tokens`` are available and take them."""
+        while True:
+            with self._lock:
+                now = time.monotonic()
+                self._tokens = min(self.capacity, self._tokens + (now - self._updated) * self.rate)
+                self._updated = now
+                if self._tokens >= tokens:
+                    self._tokens -= tokens
+                    return
+                wait = (tokens - self._tokens) / self.rate
+            time.sleep(wait)
+
+
+def chunk_id(doc: Document) -> str:
+    """Stable content hash of a chunk: source file + page + chunk text."""
+    source = os.path.basename(str(doc.metadata.get("source", "")))
+    page = str(doc.metadata.get("page", ""))
+    payload = "\x1f".join((source, page, doc.page_content))
+    return hashlib.sha256(payload.encode("utf-8")).hexdigest()
+
+
+def faiss_id(cid: str) -> int:
+    """Positive 60-bit FAISS id derived from a chunk id."""
+    return int(cid[:15], 16)
+
+
+class EmbeddingCheckpoint:
+    """Embedded chunk vectors persisted by chunk id, used to resume a build."""
+
+    def __init__(self, path: str):
+        self.path = path
+        self.store = SQLiteKVStore(path, namespace="chunks")
+
+    def get(self, cid: str) -> Optional[List[float]]:
+        blob = self.store.get(cid)
+        if blob is None:
+            return None
+        values = array("f")
+        values.frombytes(blob)
+        return values.tolist()
+
+    def set(self, cid: str, vector: Sequence[float]) -> None:
+        self.store.set(cid, array("f", vector).tobytes())
+
+    def remove(self) -> None:
+        for suffix in ("", "-wal", "-shm"):
+            if os.path.exists(self.path + suffix):
+                os.unlink(self.path + suffix)
+
+
+class StageStats:
+    """Item counter with throughput, reported every ``report_every`` items."""
+
+    def __init__(self, name: str, unit: str, report_every: int = 100):
+        self.name = name
+        self.unit = unit
+        self.report_every = report_every
+        self.count = 0
+        self.started = time.monotonic()
+
+    def add(self, n: int = 1) -> None:
+        before = self.count
+        self.count += n
+        if self.count // self.report_every > before // self.report_every:
+            self.report()
+
+    def rate(self) -> float:
+        elapsed = time.monotonic() - self.started
+        return self.count / elapsed if elapsed > 0 else 0.0
+
+    def report(self) -> None:
+        print(f"  [{self.name}] {self.count} {self.unit}（{self.rate():.1f} {self.unit}/秒）")
+
+
+def iter_pdf_pages(source_dir: str, stats: Optional[StageStats] = None) -> Iterator[Document]:
+    """Yield the pages of every PDF below ``source_dir`` one at a time."""
+    for path in sorted(Path(source_dir).glob("**/[!.]*.pdf")):
+        print(f"正在读取 '{path.name}' ...")
+        for page in PyPDFLoader(str(path)).lazy_load():
+            if stats is not None:
+                stats.add()
+            yield page
+
+
+def iter_chunks(
+    pages: Iterable[Document],
+    chunk_size: int = 1000,
+    chunk_overlap: int = 100,
+    stats: Optional[StageStats] = None,
+) -> Iterator[Document]:
+    """Split ``pages`` lazily; chunks never span pages, as with ``split_documents``."""
+    text_splitter = RecursiveCharacterTextSplitter(chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    for page in pages:
+        for chunk in text_splitter.split_documents([page]):
+            if stats is not None:
+                stats.add()
+            yield chunk
+
+
+def iter_batches(items: Iterable[Any], batch_size: int) -> Iterator[List[Any]]:
+    iterator = iter(items)
+    while True:
+        batch = list(islice(iterator, batch_size))
+        if not batch:
+            return
+        yield batch
+
+
+def _embed_with_retry(
+    embeddings: Embeddings,
+    texts: List[str],
+    bucket: TokenBucket,
+    max_retries: int = 3,
+) -> List[List[float]]:
+    for attempt in range(max_retries + 1):
+        bucket.acquire()
+        try:
+            return embeddings.embed_documents(texts)
+        except Exception as e:
+            if attempt == max_retries:
+                raise
+            delay = 2 ** attempt
+            print(f"  embedding 请求失败（{e}），{delay} 秒后重试...")
+            time.sleep(delay)
+    raise RuntimeError("unreachable")
+
+
+def embed_batches(
+    batches: Iterable[List[Tuple[str, Document]]],
+    embeddings: Embeddings,
+    checkpoint: EmbeddingCheckpoint,
+    on_batch: Callable[[Dict[str, Document], Dict[str, List[float]]], None],
+    workers: int = 4,
+    rate: float = 5.0,
+    stats: Optional[StageStats] = None,
+) -> None:
+    """Embed ``(chunk id, chunk)`` batches concurrently and hand each result to ``on_batch``.
+
+    Chunks found in ``checkpoint`` are not sent again.  At most ``2 * workers``
+    batches are in flight, so the input generator is consumed only as fast as
+    the embedding requests complete.  ``on_batch`` runs on the calling thread.
+    """
+    bucket = TokenBucket(rate)
+    in_flight: Set[Future] = set()
+
+    def run(docs: Dict[str, Document], vectors: Dict[str, List[float]]):
+        pending = [cid for cid in docs if cid not in vectors]
+        if pending:
+            result = _embed_with_retry(embeddings, [docs[cid].page_content for cid in pending], bucket)
+            for cid, vector in zip(pending, result):
+                checkpoint.set(cid, vector)
+                vectors[cid] = list(vector)
+        return docs, vectors
+
+    def drain(block_until: str) -> None:
+        done, _ = wait(in_flight, return_when=block_until)
+        for future in done:
+            in_flight.remove(future)
+            docs, vectors = future.result()
+            on_batch(docs, vectors)
+            if stats is not None:
+                stats.add(len(docs))
+
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        for batch in batches:
+            docs = dict(batch)
+            vectors: Dict[str, List[float]] = {}
+            for cid in docs:
+                cached = checkpoint.get(cid)
+                if cached is not None:
+                    vectors[cid] = cached
+            in_flight.add(executor.submit(run, docs, vectors))
+            if len(in_flight) >= 2 * workers:
+                drain(FIRST_COMPLETED)
+        if in_flight:
+            drain(ALL_COMPLETED)
+
+
+def write_knowledge_base_atomically(
+    vectorstore: FAISS,
+    output_dir: str,
+    manifest: Optional[Dict[str, Any]] = None,
+) -> None:
+    """Save ``vectorstore`` (pickle + SQLite docstore layouts) and swap it into ``output_dir``."""
+    output_dir = os.path.abspath(output_dir.rstrip("/\\"))
+    tmp_dir = f"{output_dir}.tmp-{os.getpid()}"
+    old_dir = f"{output_dir}.old-{os.getpid()}"
+    shutil.rmtree(tmp_dir, ignore_errors=True)
+
+    vectorstore.save_local(tmp_dir)
+    write_docstore(vectorstore, tmp_dir)
+    if manifest is not None:
+        with open(os.path.join(tmp_dir, MANIFEST_FILENAME), "w", encoding="utf-8") as f:
+            json.dump(manifest, f, ensure_ascii=False, indent=1)
+
+    if os.path.exists(output_dir):
+        os.replace(output_dir, old_dir)
+    os.replace(tmp_dir, output_dir)
+    shutil.rmtree(old_dir, ignore_errors=True)
+
+
+def read_manifest(output_dir: str) -> Optional[Dict[str, Any]]:
+    """Return the manifest of the knowledge base in ``output_dir``, if any."""
+    path = os.path.join(output_dir, MANIFEST_FILENAME)
+    if not os.path.exists(path):
+        return None
+    with open(path, encoding="utf-8") as f:
+        return json.load(f)
+
+
+def _load_existing(
+    output_dir: str,
+    embeddings: Embeddings,
+    settings: Dict[str, Any],
+) -> Tuple[Optional[FAISS], Dict[str, Any]]:
+    """Load the previous build if it can be updated in place with ``settings``."""
+    import faiss
+
+    manifest = read_manifest(output_dir)
+    if manifest is None:
+        return None, {}
+    if manifest.get("format") != MANIFEST_FORMAT or manifest.get("settings") != settings:
+        print("知识库构建参数已变化，将全量重建。")
+        return None, {}
+
+    # Our own build output, written by write_knowledge_base_atomically.
+    vectorstore = load_vectorstore(output_dir, embeddings, mode="pickle")
+    if not isinstance(vectorstore.index, faiss.IndexIDMap):
+        print("现有知识库不支持按 ID 删除，将全量重建。")
+        return None, {}
+    return vectorstore, manifest["chunks"]
+
+
+def _empty_vectorstore(embeddings: Embeddings, dim: int) -> FAISS:
+    import faiss
+
+    return FAISS(
+        embedding_function=embeddings,
+        index=faiss.IndexIDMap(faiss.IndexFlatL2(dim)),
+        docstore=InMemoryDocstore(),
+        index_to_docstore_id={},
+    )
+
+
+def _remove_chunks(vectorstore: FAISS, chunk_ids: List[str]) -> None:
+    import numpy as np
+
+    if not chunk_ids:
+        return
+    vectorstore.index.remove_ids(np.array([faiss_id(cid) for cid in chunk_ids], dtype=np.int64))
+    for cid in chunk_ids:
+        vectorstore.index_to_docstore_id.pop(faiss_id(cid), None)
+    vectorstore.docstore.delete(chunk_ids)
+
+
+def _add_chunks(vectorstore: FAISS, docs: Dict[str, Document], vectors: Dict[str, List[float]]) -> None:
+    import numpy as np
+
+    if not docs:
+        return
+    cids = list(docs)
+    matrix = np.asarray([vectors[cid] for cid in cids], dtype=np.float32)
+    vectorstore.index.add_with_ids(matrix, np.array([faiss_id(cid) for cid in cids], dtype=np.int64))
+    vectorstore.docstore.add(docs)
+    for cid in cids:
+        vectorstore.index_to_docstore_id[faiss_id(cid)] = cid
+
+
+def build_knowledge_base(
+    source_dir: str = "mayuan_raw_data",
+    output_dir: str = "database_agent_mayuan",
+    embedding_model: str = "text-embedding-v2",
+    chunk_size: int = 1000,
+    chunk_overlap: int = 100,
+    batch_size: int = 20,
+    workers: int = 4,
+    rate: float = 5.0,
+    full_rebuild: bool = False,
+) -> FAISS:
+    """Build or incrementally update the knowledge base in ``output_dir``.
+
+    Chunks whose content hash is already listed in the manifest are kept as is;
+    only new chunks are embedded and chunks that disappeared are deleted.
+    ``full_rebuild`` ignores the previous build.
+    """
+    settings = {"embedding_model": embedding_model, "chunk_size": chunk_size, "chunk_overlap": chunk_overlap}
+    embeddings = load_embeddings(embedding_model)
+    vectorstore, previous = (None, {}) if full_rebuild else _load_existing(output_dir, embeddings, settings)
+    checkpoint = EmbeddingCheckpoint(f"{output_dir.rstrip('/')}.checkpoint.sqlite")
+
+    page_stats = StageStats("页面", "页", report_every=50)
+    chunk_stats = StageStats("文档块", "块", report_every=200)
+    embed_stats = StageStats("embedding", "块", report_every=200)
+    current: Dict[str, Dict[str, Any]] = {}
+
+    def new_chunks(chunks: Iterable[Document]) -> Iterator[Tuple[str, Document]]:
+        # Identical chunks (same file, page and text) are stored once.
+        for doc in chunks:
+            cid = chunk_id(doc)
+            if cid in current:
+                continue
+            current[cid] = {
+                "source": os.path.basename(str(doc.metadata.get("source", ""))),
+                "page": doc.metadata.get("page"),
+            }
+            if cid not in previous:
+                yield cid, doc
+
+    def append(docs: Dict[str, Document], vectors: Dict[str, List[float]]) -> None:
+        nonlocal vectorstore
+        if vectorstore is None:
+            vectorstore = _empty_vectorstore(embeddings, len(next(iter(vectors.values()))))
+        _add_chunks(vectorstore, docs, vectors)
+
+    print(f"正在从 '{source_dir}' 流式读取文档并生成 embedding（并发 {workers}，限速 {rate} 次请求/秒）...")
+    stream = new_chunks(iter_chunks(iter_pdf_pages(source_dir, page_stats), chunk_size, chunk_overlap, chunk_stats))
+    embed_batches(iter_batches(stream, batch_size), embeddings, checkpoint, append, workers, rate, embed_stats)
+    for stats in (page_stats, chunk_stats, embed_stats):
+        stats.report()
+
+    if not current:
+        raise ValueError(f"No documents found in '{source_dir}'.")
+
+    removed = [cid for cid in previous if cid not in current]
+    print(f"新增 {embed_stats.count} 个文档块，删除 {len(removed)} 个，共 {len(current)} 个。")
+    if not embed_stats.count and not removed:
+        print("知识库已是最新，无需更新。")
+        return vectorstore
+    _remove_chunks(vectorstore, removed)
+
+    manifest = {
+        "format": MANIFEST_FORMAT,
+        "settings": settings,
+        # Changes whenever the set of chunks changes; caches key on it.
+        "kb_version": hashlib.sha256("\n".join(sorted(current)).encode("utf-8")).hexdigest()[:16],
+        "chunks": current,
+    }
+    write_knowledge_base_atomically(vectorstore, output_dir, manifest)
+    checkpoint.remove()
+    print(f"知识库构建完成，并已保存到本地 '{output_dir}' 文件夹。")
+    return vectorstore
+
+
+def main(argv=None) -> None:
+    parser = argparse.ArgumentParser(description="构建马原课程知识库（FAISS 向量数据库）")
+    parser.add_argument("--source", default="mayuan_raw_data", help="原始 PDF 材料所在文件夹")
+    parser.add_argument("--output", default="database_agent_mayuan", help="知识库输出文件夹")
+    parser.add_argument("--model", default="text-embedding-v2", help="embedding 模型")
+    parser.add_argument("--chunk-size", type=int, default=1000)
+    parser.add_argument("--chunk-overlap", type=int, default=100)
+    parser.add_argument("--batch-size", type=int, default=20, help="每次 embedding 请求的文档块数")
+    parser.add_argument("--workers", type=int, default=4, help="并发 embedding 请求数")
+    parser.add_argument("--rate", type=float, default=5.0, help="每秒最多发起的 embedding 请求数")
+    parser.add_argument("--full-rebuild", action="store_true", help="忽略已有知识库，全量重建")
+    args = parser.parse_args(argv)
+
+    build_knowledge_base(
+        source_dir=args.source,
+        output_dir=args.output,
+        embedding_model=args.model,
+        chunk_size=args.chunk_size,
+        chunk_overlap=args.chunk_overlap,
+        batch_size=args.batch_size,
+        workers=args.workers,
+        rate=args.rate,
+        full_rebuild=args.full_rebuild,
+    )
+
+
+if __name__ == "__main__":
+    main()
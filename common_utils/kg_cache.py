@@ -0,0 +1,132 @@
+"""
+Persistent cache of generated knowledge graphs (Mermaid mindmaps).
+
+The KG topic space is small (矛盾论, 实践观, 历史唯物主义 ...) and a mindmap
+for a given topic is stable, so :class:`KnowledgeGraphCache` stores the
+formatted output per *normalized* topic in SQLite:
+
+- :func:`normalize_topic` folds full-width forms, case, whitespace,
+  punctuation and configured synonyms ("矛盾规律" -> "矛盾论").
+- Entries expire after ``ttl`` seconds.
+- Entries are bound to the knowledge-base version (``kb_version`` from the
+  ingestion manifest); when the knowledge base is rebuilt the cache is
+  emptied on the next start.
+"""
+import hashlib
+import os
+import re
+import time
+import unicodedata
+from typing import Dict, Mapping, Optional
+
+from .cache_utils import LRUCache, SQLiteKVStore
+
+# Punctuation and symbols (ASCII and CJK) that never change the meaning of a topic.
+_PUNCTUATION = re.compile(r"[\s\W_]+", re.UNICODE)
+_VERSION_KEY = "__kb_version__"
+
+
+def normalize_topic(topic: str, synonyms: Optional[Mapping[str, str]] = None) -> str:
+    """Canonical form of ``topic``, used only as the cache key.
+
+    Punctuation and whitespace are stripped, so the result is not meant to be
+    shown or prompted with; graphs are generated from the topic as given.
+    """
+    text = unicodedata.normalize("NFKC", topic).casefold()
+    text = _PUNCTUATION.sub("", text)
+    if synonyms:
+        # Longest variants first so "对立统一规律" wins over "对立统一".
+        for variant in sorted(synonyms, key=len, reverse=True):
+            folded = _PUNCTUATION.sub("", unicodedata.normalize("NFKC", variant).casefold())
+            if folded and folded in text:
+                text = text.replace(folded, synonyms[variant])
+    return text
+
+
+def knowledge_base_version(path: str) -> str:
+    """``kb_version`` of the knowledge base at ``path``.
+
+    Knowledge bases built before manifests existed are identified by the size
+    and modification time of their ``index.faiss``.
+    """
+    from .ingestion import read_manifest
+
+    manifest = read_manifest(path)
+    if manifest and manifest.get("kb_version"):
+        return str(manifest["kb_version"])
+    index_path = os.path.join(path, "index.faiss")
+    if not os.path.exists(index_path):
+        return "none"
+    st = os.stat(index_path)
+    return hashlib.sha256(f"{st.st_size}:{st.st_mtime_ns}".encode()).hexdigest()[:16]
+
+
+class KnowledgeGraphCache:
+    """SQLite-backed cache of formatted Mermaid outputs, fronted by a small LRU."""
+
+    def __init__(
+        self,
+        path: str,
+        kb_version: str,
+        ttl: float = 7 * 24 * 3600,
+        synonyms: Optional[Mapping[str, str]] = None,
+        memory_size: int = 256,
+    ):
+        """
+        Args:
+            path: SQLite file of the persistent tier.
+            kb_version: Version of the knowledge base the graphs are built from.
+            ttl: Seconds an entry stays valid.
+            synonyms: Topic variants folded onto a canonical name.
+            memory_size: Capacity of the in-memory tier.
+        """
+        self.kb_version = kb_version
+        self.ttl = ttl
+        self.synonyms: Dict[str, str] = dict(synonyms or {})
+        self.store = SQLiteKVStore(path, namespace="knowledge_graphs")
+        self.memory = LRUCache(memory_size)
+        # Memory copies are re-read from SQLite after a few minutes so that expiry
+        # and invalidation by other worker processes are picked up.
+        self.memory_ttl = min(ttl, 300.0)
+
+        stored = self.store.get(_VERSION_KEY)
+        if stored is None or stored.decode("utf-8") != kb_version:
+            if stored is not None:
+                print(f"[kg_cache] Knowledge base changed ({stored.decode('utf-8')} -> {kb_version}), clearing cache.")
+            self.store.clear()
+            self.store.set(_VERSION_KEY, kb_version.encode("utf-8"))
+        self.store.purge_expired()
+
+    def normalize(self, topic: str) -> str:
+        return normalize_topic(topic, self.synonyms)
+
+    def _key(self, subject_name: str, normalized: str) -> str:
+        return f"{self.kb_version}:{subject_name}:{normalized}"
+
+    def get(self, subject_name: str, topic: str) -> Optional[str]:
+        key = self._key(subject_name, self.normalize(topic))
+        entry = self.memory.get(key)
+        if entry is not None and entry[0] > time.time():
+            return entry[1]
+        blob = self.store.get(key)
+        if blob is None:
+            self.memory.pop(key)
+            return None
+        value = blob.decode("utf-8")
+        self.memory.set(key, (time.time() + self.memory_ttl, value))
+        return value
+
+    def set(self, subject_name: str, topic: str, output: str) -> None:
+        key = self._key(subject_name, self.normalize(topic))
+        self.store.set(key, output.encode("utf-8"), ttl=self.ttl)
+        self.memory.set(key, (time.time() + self.memory_ttl, output))
+
+    def delete(self, subject_name: str, topic: str) -> None:
+        key = self._key(subject_name, self.normalize(topic))
+        self.memory.pop(key)
+        self.store.delete(key)
+
+    def clear(self) -> None:
+        self.memory.clear()
+        self.store.clear()
+        self.store.set(_VERSION_KEY, self.kb_version.encode("utf-8"))
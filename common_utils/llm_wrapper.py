@@ -1,16 +1,23 @@
 import os
-from typing import Any, List, Optional, Union
-import base64
+from typing import Any, AsyncIterator, Iterator, List, Optional, Union
 
 import dashscope
 from langchain_core.language_models.chat_models import BaseChatModel
 from langchain_core.messages import (
     AIMessage,
+    AIMessageChunk,
     BaseMessage,
     HumanMessage,
     SystemMessage,
 )
-from langchain_core.outputs import ChatGeneration, ChatResult
+from langchain_core.outputs import ChatGeneration, ChatGenerationChunk, ChatResult
+
+from .dashscope_client import get_async_client, get_client
+from .image_payload import ImagePayload
+from .image_preprocess import preprocess_image
+
+# Prefix of vision answers produced by the text-only fallback (not worth caching).
+VISION_FALLBACK_NOTICE = "[注：图片分析功能暂时不可用，以下是基于文本的回复]"
 
 # Set up API key for DashScope SDK
 api_key = os.environ.get("DASHSCOPE_API_KEY")
@@ -32,14 +39,9 @@ class CustomChatDashScope(BaseChatModel):
     # Internal helpers
     # ---------------------------------------------------------------------
 
-    def _call(
-        self,
-        messages: List[BaseMessage],
-        stop: Optional[List[str]] = None,
-        **kwargs: Any,
-    ) -> AIMessage:
-        """Sends messages to DashScope and returns the response as AIMessage."""
-
+    @staticmethod
+    def _to_dashscope_messages(messages: List[BaseMessage]) -> List[dict]:
+        """Converts LangChain messages to DashScope's role/content dicts."""
         prompt_messages = []
         for msg in messages:
             if isinstance(msg, SystemMessage):
@@ -48,38 +50,45 @@ class CustomChatDashScope(BaseChatModel):
                 prompt_messages.append({"role": "user", "content": msg.content})
             elif isinstance(msg, AIMessage):
                 prompt_messages.append({"role": "assistant", "content": msg.content})
+        return prompt_messages
+
+    def _call(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> AIMessage:
+        """Sends messages to DashScope and returns the response as AIMessage.
 
-        response = dashscope.Generation.call(
-            model=self.model,
-            messages=prompt_messages,
-            result_format="message",
+        Goes through the shared pooled client (deadline, retries, circuit
+        breaker); raises DashScopeAPIError on failure.
+        """
+        if stop:
+            kwargs["stop"] = stop
+        content = get_client().generate(
+            self.model,
+            self._to_dashscope_messages(messages),
             temperature=self.temperature,
-            stream=False,
             **kwargs,
         )
+        return AIMessage(content=content)
 
-        # Non-streaming mode -> GenerationResponse with status_code / output
-        if hasattr(response, "status_code"):
-            if response.status_code == 200:  # type: ignore[attr-defined]
-                ai_content = response.output.choices[0]["message"]["content"]  # type: ignore[attr-defined]
-                return AIMessage(content=ai_content)
-        raise Exception(
-                "DashScope API Error: Code {} , Message {}".format(  # type: ignore[attr-defined]
-                    getattr(response, "code", "unknown"), getattr(response, "message", "unknown")
-                )
-            )
-
-        # Streaming mode -> concatenate chunks
-        if hasattr(response, "__iter__"):
-            content_chunks: List[str] = []
-            for chunk in response:
-                try:
-                    content_chunks.append(chunk.choices[0].delta.content)
-                except Exception:
-                    pass  # Some chunks may not have delta.content
-            return AIMessage(content="".join(content_chunks))
-
-        raise Exception("DashScope returned an unknown response type and could not be parsed.")
+    def _stream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> Iterator[ChatGenerationChunk]:
+        """Streams the reply token by token (incremental output)."""
+        if stop:
+            kwargs["stop"] = stop
+        for delta in get_client().stream_generate(
+            self.model,
+            self._to_dashscope_messages(messages),
+            temperature=self.temperature,
+            **kwargs,
+        ):
+            yield ChatGenerationChunk(message=AIMessageChunk(content=delta))
 
     def _generate(
         self,
@@ -90,6 +99,40 @@ class CustomChatDashScope(BaseChatModel):
         ai_msg = self._call(messages, stop=stop, **kwargs)
         return ChatResult(generations=[ChatGeneration(message=ai_msg)])
 
+    async def _agenerate(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> ChatResult:
+        """Native async path over the pooled HTTP client; raises DashScopeAPIError like ``_call``."""
+        if stop:
+            kwargs["stop"] = stop
+        content = await get_async_client().generate(
+            self.model,
+            self._to_dashscope_messages(messages),
+            temperature=self.temperature,
+            **kwargs,
+        )
+        return ChatResult(generations=[ChatGeneration(message=AIMessage(content=content))])
+
+    async def _astream(
+        self,
+        messages: List[BaseMessage],
+        stop: Optional[List[str]] = None,
+        **kwargs: Any,
+    ) -> AsyncIterator[ChatGenerationChunk]:
+        """Async token stream over the pooled HTTP client (server-sent events)."""
+        if stop:
+            kwargs["stop"] = stop
+        async for delta in get_async_client().stream_generate(
+            self.model,
+            self._to_dashscope_messages(messages),
+            temperature=self.temperature,
+            **kwargs,
+        ):
+            yield ChatGenerationChunk(message=AIMessageChunk(content=delta))
+
     # ---------------------------------------------------------------------
     # LangChain required properties
     # ---------------------------------------------------------------------
@@ -108,32 +151,32 @@ class CustomVisionChatDashScope(BaseChatModel):
 
     model: str = "qwen-vl-max"
     temperature: float = 0.7
+    # 发送前的图片预处理（见 image_preprocess）；image_max_edge=None 时按原图发送
+    image_max_edge: Optional[int] = 1280
+    image_quality: int = 85
+    image_max_bytes: int = 1024 * 1024
 
-    def _encode_image_base64(self, image_path: str) -> str:
-        """将图片文件编码为base64字符串"""
-        with open(image_path, "rb") as image_file:
-            return base64.b64encode(image_file.read()).decode('utf-8')
+    def _prepare_multimodal_content(self, text: str, image: Union[ImagePayload, str, None] = None) -> List[dict]:
+        """准备多模态内容，支持文本和图片
 
-    def _prepare_multimodal_content(self, text: str, image_path: Optional[str] = None) -> List[dict]:
-        """准备多模态内容，支持文本和图片"""
+        image 可以是内存中的 ImagePayload（网页上传），也可以是 data URL 或文件路径（命令行）。
+        """
         content = []
         
         if text:
             content.append({"text": text})
         
-        if image_path:
-            # 对于DashScope Vision API，图片需要以特定格式传入
-            if image_path.startswith('data:image'):
-                # 如果已经是base64格式
-                content.append({"image": image_path})
-            else:
-                # 如果是文件路径，编码为base64
-                try:
-                    encoded_image = self._encode_image_base64(image_path)
-                    content.append({"image": f"data:image/jpeg;base64,{encoded_image}"})
-                except Exception as e:
-                    print(f"Error encoding image: {e}")
-                    content.append({"text": f"[图片加载失败: {str(e)}]"})
+        if image:
+            # DashScope Vision API 接受 data URL；MIME 类型按图片实际内容确定
+            try:
+                payload = ImagePayload.coerce(image)
+                if self.image_max_edge:
+                    # 缩放、去除 EXIF 并重新压缩（按内容哈希缓存）
+                    payload = preprocess_image(payload, self.image_max_edge, self.image_quality, self.image_max_bytes)
+                content.append({"image": payload.data_url})
+            except Exception as e:
+                print(f"Error encoding image: {e}")
+                content.append({"text": f"[图片加载失败: {str(e)}]"})
         
         return content
 
@@ -141,45 +184,36 @@ class CustomVisionChatDashScope(BaseChatModel):
         self,
         messages: List[BaseMessage],
         stop: Optional[List[str]] = None,
-        image_path: Optional[str] = None,
+        image: Union[ImagePayload, str, None] = None,
         **kwargs: Any,
     ) -> AIMessage:
         """调用DashScope Vision API处理多模态输入"""
 
         prompt_messages = []
+        image_attached = False
         for msg in messages:
             if isinstance(msg, SystemMessage):
                 prompt_messages.append({"role": "system", "content": msg.content})
             elif isinstance(msg, HumanMessage):
                 # 如果有图片，准备多模态内容
-                if image_path and prompt_messages == []:  # 只在第一条用户消息中添加图片
-                    content = self._prepare_multimodal_content(msg.content, image_path)
+                if image and not image_attached:  # 只在第一条用户消息中添加图片
+                    content = self._prepare_multimodal_content(msg.content, image)
                     prompt_messages.append({"role": "user", "content": content})
+                    image_attached = True
                 else:
                     prompt_messages.append({"role": "user", "content": msg.content})
             elif isinstance(msg, AIMessage):
                 prompt_messages.append({"role": "assistant", "content": msg.content})
 
         try:
-            response = dashscope.MultiModalConversation.call(
-                model=self.model,
-                messages=prompt_messages,
+            # 经共享连接池调用，带超时、重试和熔断
+            ai_content = get_client().multimodal_generate(
+                self.model,
+                prompt_messages,
                 temperature=self.temperature,
                 **kwargs,
             )
-
-            # 处理API响应
-            if hasattr(response, "status_code"):
-                if response.status_code == 200:
-                    ai_content = response.output.choices[0]["message"]["content"]
-                    return AIMessage(content=ai_content)
-                else:
-                    error_msg = f"DashScope Vision API Error: Code {response.status_code}"
-                    if hasattr(response, 'message'):
-                        error_msg += f", Message: {response.message}"
-                    raise Exception(error_msg)
-            else:
-                raise Exception("DashScope Vision API returned unexpected response format")
+            return AIMessage(content=ai_content)
 
         except Exception as e:
             # 如果Vision API失败，回退到普通文本模式
@@ -197,44 +231,44 @@ class CustomVisionChatDashScope(BaseChatModel):
                     text_messages.append(msg_data)
             
             # 使用普通文本API
-            response = dashscope.Generation.call(
-                model="qwen-turbo",
-                messages=text_messages,
-                result_format="message",
-                temperature=self.temperature,
-                stream=False,
-                **kwargs,
-            )
-            
-            if hasattr(response, "status_code") and response.status_code == 200:
-                ai_content = response.output.choices[0]["message"]["content"]
-                return AIMessage(content=f"[注：图片分析功能暂时不可用，以下是基于文本的回复]\n\n{ai_content}")
-            else:
-                raise Exception("文本模式API调用也失败了")
+            try:
+                ai_content = get_client().generate(
+                    "qwen-turbo",
+                    text_messages,
+                    temperature=self.temperature,
+                    **kwargs,
+                )
+            except Exception as text_error:
+                raise Exception("文本模式API调用也失败了") from text_error
+            return AIMessage(content=f"{VISION_FALLBACK_NOTICE}\n\n{ai_content}")
 
     def _generate(
         self,
         messages: List[BaseMessage],
         stop: Optional[List[str]] = None,
-        image_path: Optional[str] = None,
+        image: Union[ImagePayload, str, None] = None,
         **kwargs: Any,
     ) -> ChatResult:
-        ai_msg = self._call(messages, stop=stop, image_path=image_path, **kwargs)
+        ai_msg = self._call(messages, stop=stop, image=image, **kwargs)
         return ChatResult(generations=[ChatGeneration(message=ai_msg)])
 
     def call_with_image(
         self,
         text: str,
-        image_path: Optional[str] = None,
-        system_prompt: Optional[str] = None
+        image: Union[ImagePayload, str, None] = None,
+        system_prompt: Optional[str] = None,
+        **kwargs: Any,
     ) -> str:
-        """便捷方法：直接调用多模态功能"""
+        """便捷方法：直接调用多模态功能（image 为 ImagePayload、data URL 或文件路径）
+
+        其余参数（如 max_tokens）作为 DashScope 请求参数传入。
+        """
         messages = []
         if system_prompt:
             messages.append(SystemMessage(content=system_prompt))
         messages.append(HumanMessage(content=text))
         
-        result = self._call(messages, image_path=image_path)
+        result = self._call(messages, image=image, **kwargs)
         return result.content
 
     @property
@@ -2,8 +2,11 @@
 多模态Agent基类，支持图片和文本输入的AI助手
 """
 import os
-from typing import Optional, Dict, Any
-from .llm_wrapper import CustomVisionChatDashScope
+from typing import Optional, Dict, Any, List, Mapping, NamedTuple, Union
+from .image_payload import ImagePayload
+from .image_text import ImageTextExtractor
+from .llm_wrapper import VISION_FALLBACK_NOTICE, CustomVisionChatDashScope
+from .vision_cache import VisionAnswerCache
 
 class MultimodalAgent:
     """
@@ -11,22 +14,39 @@ class MultimodalAgent:
     可以处理文本和图片的组合输入，并给出相应回复
     """
 
-    def __init__(self, subject_name: str = "AI助手", model: str = "qwen-vl-max"):
+    def __init__(
+        self,
+        subject_name: str = "AI助手",
+        model: str = "qwen-vl-max",
+        answer_cache: Optional[VisionAnswerCache] = None,
+        vectorstore: Optional[Any] = None,
+        retrieval_k: int = 4,
+        ocr_engine: str = "auto",
+    ):
         """
         初始化多模态Agent
         
         Args:
             subject_name: 学科名称或助手名称
             model: 使用的视觉语言模型
+            answer_cache: 可选的回答缓存，相同或几乎相同的图片配同一问题时直接复用之前的分析
+            vectorstore: 可选的知识库（与文本 Agent 共用的 FAISS 实例）；提供时先识别图片中的
+                文字，与问题一起检索知识库，并把检索到的资料加入提示词
+            retrieval_k: 加入提示词的资料条数
+            ocr_engine: 图片文字识别方式，见 ImageTextExtractor（"auto" / "tesseract" / "vision"）
         """
         self.subject_name = subject_name
         self.model = model
+        self.answer_cache = answer_cache
+        self.vectorstore = vectorstore
+        self.retrieval_k = retrieval_k
         
         if not os.environ.get("DASHSCOPE_API_KEY"):
             raise ValueError("DASHSCOPE_API_KEY environment variable not set.")
         
         try:
             self.vision_llm = CustomVisionChatDashScope(model=model, temperature=0.7)
+            self.text_extractor = ImageTextExtractor(self.vision_llm, engine=ocr_engine)
             print(f"[{self.subject_name}] 多模态AI助手初始化成功")
         except Exception as e:
             raise RuntimeError(f"多模态模型初始化失败: {e}")
@@ -34,7 +54,7 @@ class MultimodalAgent:
     def process_multimodal_request(
         self, 
         text_input: str, 
-        image_path: Optional[str] = None,
+        image: Union[ImagePayload, str, None] = None,
         system_prompt: Optional[str] = None
     ) -> str:
         """
@@ -42,7 +62,7 @@ class MultimodalAgent:
         
         Args:
             text_input: 用户的文本输入
-            image_path: 图片文件路径（可选）
+            image: 图片（可选），内存中的 ImagePayload，或 data URL / 文件路径
             system_prompt: 系统提示词（可选）
             
         Returns:
@@ -53,13 +73,28 @@ class MultimodalAgent:
             if not system_prompt:
                 system_prompt = self._get_default_system_prompt()
             
+            if image:
+                image = ImagePayload.coerce(image)
+            use_cache = self.answer_cache is not None and image is not None
+            if use_cache:
+                cached = self.answer_cache.get(image, text_input, system_prompt)
+                if cached is not None:
+                    print(f"[{self.subject_name}] 命中图片回答缓存")
+                    return cached
+            
+            # 用图片中的文字和问题检索知识库，把资料附在问题后面
+            snippets = self._retrieve_context(text_input, image)
+            
             # 调用视觉语言模型
             response = self.vision_llm.call_with_image(
-                text=text_input,
-                image_path=image_path,
+                text=self._with_context(text_input, snippets),
+                image=image,
                 system_prompt=system_prompt
             )
             
+            # 视觉接口失败后的纯文本回复不缓存
+            if use_cache and not response.startswith(VISION_FALLBACK_NOTICE):
+                self.answer_cache.put(image, text_input, system_prompt, response)
             return response
             
         except Exception as e:
@@ -67,6 +102,33 @@ class MultimodalAgent:
             print(f"[{self.subject_name}] {error_msg}")
             return f"抱歉，{error_msg}。请重试或检查您的输入。"
 
+    def _retrieve_context(self, text_input: str, image: Optional[ImagePayload]) -> List[str]:
+        """以“图片文字 + 问题”为查询检索知识库，返回去重后的资料片段"""
+        if self.vectorstore is None:
+            return []
+        image_text = self.text_extractor.extract(image) if image is not None else ""
+        query = f"{image_text} {text_input}".strip()
+        if not query:
+            return []
+        try:
+            docs = self.vectorstore.similarity_search(query, k=self.retrieval_k)
+        except Exception as e:
+            print(f"[{self.subject_name}] 知识库检索失败，不使用参考资料: {e}")
+            return []
+        snippets = list(dict.fromkeys(doc.page_content for doc in docs))
+        print(f"[{self.subject_name}] 图片问题检索到 {len(snippets)} 条资料")
+        return snippets
+
+    @staticmethod
+    def _with_context(text_input: str, snippets: List[str]) -> str:
+        if not snippets:
+            return text_input
+        references = "\n\n".join(f"[{i}] {snippet}" for i, snippet in enumerate(snippets, start=1))
+        return (
+            f"{text_input}\n\n"
+            f"以下是课程知识库中与图片内容相关的资料，回答时请优先以这些资料为依据：\n{references}"
+        )
+
     def _get_default_system_prompt(self) -> str:
         """获取默认的系统提示词"""
         return f"""你是一个专业的{self.subject_name}AI助手。你能够理解和分析用户提供的文本和图片内容。
@@ -83,8 +145,14 @@ class MultimodalAgent:
 class MayuanMultimodalAgent(MultimodalAgent):
     """马克思主义基本原理多模态Agent"""
     
-    def __init__(self):
-        super().__init__(subject_name="马克思主义基本原理", model="qwen-vl-max")
+    def __init__(self, vectorstore: Optional[Any] = None):
+        super().__init__(
+            subject_name="马克思主义基本原理",
+            model="qwen-vl-max",
+            # 同一班级反复上传的同一页教材/课件截图复用之前的分析，24 小时后过期
+            answer_cache=VisionAnswerCache(maxsize=512, ttl=24 * 3600, max_distance=8),
+            vectorstore=vectorstore,
+        )
     
     def _get_default_system_prompt(self) -> str:
         """获取马原专业的系统提示词"""
@@ -107,26 +175,60 @@ class MayuanMultimodalAgent(MultimodalAgent):
 
 请用中文回答用户的问题，确保回答专业、准确、有教育意义。"""
 
+class DialoguePersona(NamedTuple):
+    """苏格拉底式对话中扮演的人物和探讨的主题
+
+    不可变，按会话（每次调用）传入，多个会话可以同时共用同一个 SocratesMultimodalAgent。
+    """
+
+    character: str = "马克思"
+    topic: str = "马克思主义理论"
+
+    @classmethod
+    def from_state(cls, state: Optional[Mapping[str, Any]], default: Optional["DialoguePersona"] = None) -> "DialoguePersona":
+        """从对话状态（simulated_character / current_topic）中取出人物和主题"""
+        default = default or cls()
+        if not state:
+            return default
+        return cls(
+            state.get("simulated_character") or default.character,
+            state.get("current_topic") or default.topic,
+        )
+
+
 class SocratesMultimodalAgent(MultimodalAgent):
-    """苏格拉底式对话多模态Agent"""
+    """苏格拉底式对话多模态Agent
+
+    不保存任何会话状态：人物和主题以 DialoguePersona 随每次调用传入，系统提示词按调用生成，
+    可在多线程或异步服务中被并发调用。
+    """
     
-    def __init__(self, character: str = "马克思", topic: str = "马克思主义理论"):
-        super().__init__(subject_name="历史思想家对话", model="qwen-vl-max")
-        self.character = character
-        self.current_topic = topic
+    def __init__(self, character: str = "马克思", topic: str = "马克思主义理论", vectorstore: Optional[Any] = None):
+        super().__init__(subject_name="历史思想家对话", model="qwen-vl-max", vectorstore=vectorstore)
+        self.default_persona = DialoguePersona(character, topic)
     
-    def update_dialogue_context(self, character: str, topic: str):
-        """更新对话上下文"""
-        self.character = character
-        self.current_topic = topic
+    def process_dialogue_request(
+        self,
+        text_input: str,
+        image: Union[ImagePayload, str, None] = None,
+        persona: Optional[DialoguePersona] = None,
+    ) -> str:
+        """以 persona 的身份回答（文本+图片），persona 为空时使用默认人物和主题"""
+        system_prompt = self.build_system_prompt(persona or self.default_persona)
+        return self.process_multimodal_request(text_input, image, system_prompt=system_prompt)
     
     def _get_default_system_prompt(self) -> str:
+        return self.build_system_prompt(self.default_persona)
+    
+    @staticmethod
+    def build_system_prompt(persona: DialoguePersona) -> str:
         """获取苏格拉底式对话的系统提示词"""
-        return f"""你现在要扮演{self.character}，与用户进行苏格拉底式对话，探讨"{self.current_topic}"这个主题。
+        character, topic = persona
+        return f"""你现在要扮演{character}，与用户进行苏格拉底式对话，探讨"{topic}"这个主题。
 
 如果用户提供了图片，请：
 1. 仔细分析图片内容，包括文字、图表、人物等
-2. 以{self.character}的身份和观点来理解和解读图片
+2. 以{character}的身份和观点来理解和解读图片
 3. 结合图片内容，用苏格拉底式的方法引导用户思考
 4. 如果图片与讨论主题相关，深入分析其理论意义
 
@@ -134,6 +236,6 @@ class SocratesMultimodalAgent(MultimodalAgent):
 - 通过提问引导用户思考，而不是直接给出答案
 - 挖掘用户观点中的假设和逻辑问题
 - 循序渐进地引导用户发现真理
-- 保持{self.character}的语言风格和理论背景
+- 保持{character}的语言风格和理论背景
 
-请用中文进行对话，体现{self.character}的思想特色和对话风格。"""
\ No newline at end of file
+请用中文进行对话，体现{character}的思想特色和对话风格。"""
\ No newline at end of file
@@ -0,0 +1,70 @@
+"""
+Helpers for assembling a paper from several independently generated parts.
+
+Large requests are generated in chunks (see ``BaseAgent.generate_node``);
+the parts are split into single questions, near-duplicates across chunks are
+dropped by comparing normalized stems, and the survivors are renumbered.
+Questions lost to deduplication are requested again with the kept stems
+listed as exclusions.
+"""
+import re
+from difflib import SequenceMatcher
+from typing import List
+
+# "题目1：", "**题目 12:**", "选择题3：" at the start of a line.
+_HEADER = re.compile(r"^[ \t]*(?:\*\*)?\s*(?:题目|选择题|判断题|简答题)\s*\d+\s*[：:]\s*(?:\*\*)?", re.MULTILINE)
+_STEM = re.compile(r"题干\s*[：:]\s*(.+)")
+_NOISE = re.compile(r"[\W_]+", re.UNICODE)
+
+
+def split_questions(text: str) -> List[str]:
+    """Question bodies (without their numbered headers); ``[]`` if none are found."""
+    headers = list(_HEADER.finditer(text))
+    return [
+        text[h.end():headers[i + 1].start() if i + 1 < len(headers) else len(text)].strip()
+        for i, h in enumerate(headers)
+    ]
+
+
+def stem_text(body: str) -> str:
+    """The stem of a question as written ("题干：" line, else the first line)."""
+    match = _STEM.search(body)
+    return (match.group(1) if match else body.strip().split("\n", 1)[0]).strip()
+
+
+def question_stem(body: str) -> str:
+    """Normalized stem of a question, used to detect duplicates."""
+    return _NOISE.sub("", stem_text(body)).lower()
+
+
+def _similar(a: str, b: str, threshold: float) -> bool:
+    if a == b:
+        return True
+    matcher = SequenceMatcher(None, a, b)
+    # The cheap upper bounds rule out most pairs before the full comparison.
+    return (
+        matcher.real_quick_ratio() >= threshold
+        and matcher.quick_ratio() >= threshold
+        and matcher.ratio() >= threshold
+    )
+
+
+def dedupe_questions(bodies: List[str], threshold: float = 0.9) -> List[str]:
+    """Drop questions whose stem is at least ``threshold`` similar to an earlier one.
+
+    Stems such as "矛盾的普遍性" / "矛盾的特殊性" stay below the default.
+    """
+    kept: List[str] = []
+    stems: List[str] = []
+    for body in bodies:
+        stem = question_stem(body)
+        if any(_similar(stem, seen, threshold) for seen in stems):
+            continue
+        kept.append(body)
+        stems.append(stem)
+    return kept
+
+
+def renumber(bodies: List[str]) -> str:
+    """Join question bodies as 题目1, 题目2, ..."""
+    return "\n\n".join(f"题目{i}：\n{body}" for i, body in enumerate(bodies, start=1))
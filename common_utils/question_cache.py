@@ -0,0 +1,104 @@
+"""
+Result cache for generated question sets.
+
+During class-wide exercises many students send what is effectively the same
+request ("5道关于唯物辩证法的选择题"). :class:`QuestionResultCache` keys the
+generated paper on the *parsed* request (topic, counts per type, difficulty,
+question type) rather than the raw text, so wording differences still hit.
+
+Each key holds a pool of up to ``variants`` generations.  Until the pool is
+full a lookup misses and the caller generates (and stores) another variant;
+afterwards lookups rotate through the pool, so repeated requests do not all
+receive the identical paper.
+"""
+import re
+import threading
+import time
+from typing import Any, Dict, List, Mapping, Optional, Tuple
+
+from .cache_utils import LRUCache
+
+CacheKey = Tuple[str, Tuple[str, ...], Tuple[Tuple[str, int], ...], str, str]
+
+
+class _VariantPool:
+    """Cached generations for one key and the rotation cursor."""
+
+    __slots__ = ("entries", "cursor")
+
+    def __init__(self) -> None:
+        self.entries: List[Tuple[float, str]] = []  # (expires_at, text)
+        self.cursor = 0
+
+
+class QuestionResultCache:
+    """Bounded, TTL-limited cache of generated questions with variant rotation."""
+
+    def __init__(self, ttl: float = 3600.0, maxsize: int = 256, variants: int = 3):
+        """
+        Args:
+            ttl: Seconds a generated variant stays valid.
+            maxsize: Maximum number of distinct keys (LRU eviction).
+            variants: Generations kept per key before lookups start rotating.
+        """
+        if variants <= 0:
+            raise ValueError("variants must be positive")
+        self.ttl = ttl
+        self.variants = variants
+        self._pools = LRUCache(maxsize)
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+
+    @staticmethod
+    def make_key(state: Mapping[str, Any]) -> CacheKey:
+        """Normalized key of a parsed request state."""
+        topics = sorted(
+            {re.sub(r"\s+", "", t) for t in re.split(r"[;；、，,]", state.get("topic", "")) if t.strip()}
+        )
+        counts = tuple(sorted((qt, int(n)) for qt, n in state.get("question_type_counts", {}).items()))
+        return (
+            state.get("subject_name", ""),
+            tuple(topics),
+            counts,
+            state.get("difficulty", ""),
+            state.get("question_type", ""),
+        )
+
+    def get(self, key: CacheKey) -> Optional[str]:
+        """Return the next cached variant, or ``None`` if another one should be generated."""
+        now = time.time()
+        with self._lock:
+            pool: Optional[_VariantPool] = self._pools.get(key)
+            if pool is not None:
+                pool.entries = [e for e in pool.entries if e[0] > now]
+            if pool is None or len(pool.entries) < self.variants:
+                self.misses += 1
+                return None
+            text = pool.entries[pool.cursor % len(pool.entries)][1]
+            pool.cursor += 1
+            self.hits += 1
+            return text
+
+    def put(self, key: CacheKey, text: str) -> None:
+        """Add a freshly generated variant (the oldest one is dropped when the pool is full)."""
+        with self._lock:
+            pool = self._pools.get(key)
+            if pool is None:
+                pool = _VariantPool()
+                self._pools.set(key, pool)
+            pool.entries.append((time.time() + self.ttl, text))
+            del pool.entries[:-self.variants]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._pools.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "keys": len(self._pools),
+            "maxsize": self._pools.maxsize,
+            "variants": self.variants,
+        }
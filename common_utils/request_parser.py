@@ -0,0 +1,130 @@
+"""
+Parser for question-generation requests ("请出5道关于唯物辩证法的选择题").
+
+:class:`QuestionRequestParser` is built once per agent: the regular
+expressions are compiled up front and topics, question-type and difficulty
+keywords are found in a single pass with a :class:`KeywordMatcher`, so the
+per-request cost does not grow with the size of the topic vocabulary.
+Counts may be written with digits or Chinese numerals ("五道", "十二道").
+Chinese numerals only count before 道/题: "两个必然", "一个例子" are topic
+words, not counts.
+"""
+import re
+from typing import Any, Dict, List, Sequence
+
+from .text_matcher import KeywordMatcher
+
+QUESTION_TYPES = ("选择题", "判断题", "简答题")
+
+_DIGITS = {"零": 0, "〇": 0, "一": 1, "二": 2, "两": 2, "三": 3, "四": 4, "五": 5, "六": 6, "七": 7, "八": 8, "九": 9}
+_UNITS = {"十": 10, "百": 100}
+_NUMBER = r"\d+|[零〇一二两三四五六七八九十百]+"
+# A count followed by its measure word; one capture group (the number).
+_COUNT = r"(\d+|[零〇一二两三四五六七八九十百]+(?=\s*[道题]))\s*(?:道|题|个)"
+
+_DIFFICULTY_KEYWORDS = {
+    "简单": "简单", "容易": "简单", "基础": "简单",
+    "困难": "困难", "难": "困难", "高级": "困难",
+}
+
+
+def parse_number(text: str) -> int:
+    """Value of a digit string or a Chinese numeral below 1000 ("十五" -> 15)."""
+    if text.isdigit():
+        return int(text)
+    total, digit = 0, None
+    for char in text:
+        if char in _DIGITS:
+            digit = _DIGITS[char]
+        else:
+            total += (1 if digit is None else digit) * _UNITS[char]
+            digit = None
+    return total + (digit or 0)
+
+
+class QuestionRequestParser:
+    """Extracts topic, counts per type, difficulty and question type from a request."""
+
+    def __init__(self, common_topics: Sequence[str], default_topic: str):
+        self.default_topic = default_topic
+        self._topic_order = {topic: i for i, topic in enumerate(dict.fromkeys(common_topics))}
+
+        patterns: Dict[str, Any] = {topic: ("topic", topic) for topic in self._topic_order}
+        patterns.update({qt: ("type", qt) for qt in QUESTION_TYPES})
+        patterns["材料分析"] = ("type", "简答题")
+        patterns.update({kw: ("difficulty", level) for kw, level in _DIFFICULTY_KEYWORDS.items()})
+        self._matcher = KeywordMatcher(patterns)
+
+        self._type_count = re.compile(
+            rf"{_COUNT}[^\u4e00-\u9fa5]*?(选择题|判断题|简答题|材料\s*分析题?)"
+        )
+        self._count = re.compile(_COUNT)
+        self._whitespace = re.compile(r"\s+")
+        self._about = re.compile(r"关于(.*?)的")
+        self._about_noise = re.compile(r"(简单|容易|基础|中等|困难|高级|选择题|判断题|简答题|材料\s*分析题?|题目|\s)")
+        self._fallback_noise = re.compile(
+            rf"(?:{_NUMBER})(?:道|题)|请|给我|出|关于|的|简单|中等|困难|选择题|判断题|简答题|材料\s*分析题?|题目"
+        )
+
+    def parse(self, user_input: str) -> Dict[str, Any]:
+        """Return ``topic``, ``num_questions``, ``difficulty``, ``question_type`` and ``question_type_counts``."""
+        # --- Keywords (topics, question types, difficulty) in one pass ---
+        topics, types, levels = set(), set(), set()
+        for match in self._matcher.iter_matches(user_input):
+            kind, value = match.value
+            if kind == "topic":
+                topics.add(value)
+            elif kind == "type":
+                types.add(value)
+            else:
+                levels.add(value)
+
+        # --- Number and type of questions ---
+        question_type_counts: Dict[str, int] = {}
+        for num_str, q_type_raw in self._type_count.findall(self._whitespace.sub("", user_input)):
+            q_type = "简答题" if q_type_raw.startswith("材料") else q_type_raw
+            question_type_counts[q_type] = question_type_counts.get(q_type, 0) + parse_number(num_str)
+
+        if question_type_counts:
+            num_questions = sum(question_type_counts.values())
+        else:
+            numbers = self._count.findall(user_input)
+            num_questions = sum(parse_number(n) for n in numbers) if numbers else 5
+
+        # --- Difficulty ---
+        difficulty = "简单" if "简单" in levels else "困难" if "困难" in levels else "中等"
+
+        # --- Question type(s) ---
+        detected_types = [qt for qt in QUESTION_TYPES if qt in types]
+        if not question_type_counts and detected_types:
+            avg_count = max(1, num_questions // len(detected_types))
+            for qt in detected_types:
+                question_type_counts[qt] = avg_count
+
+        if len(question_type_counts) > 1:
+            question_type = "混合"
+        elif len(question_type_counts) == 1:
+            question_type = next(iter(question_type_counts))
+        else:
+            question_type = "选择题"
+            question_type_counts = {"选择题": num_questions}
+
+        # --- Topic ---
+        detected_topics: List[str] = sorted(topics, key=self._topic_order.__getitem__)
+        for raw in self._about.findall(user_input):
+            cleaned = self._about_noise.sub("", raw).strip()
+            if cleaned:
+                detected_topics.append(cleaned)
+
+        ordered_topics = list(dict.fromkeys(detected_topics))
+        if not ordered_topics:
+            fallback_topic = self._fallback_noise.sub("", user_input).strip()
+            ordered_topics = [fallback_topic if fallback_topic else self.default_topic]
+
+        return {
+            "topic": "; ".join(ordered_topics),
+            "num_questions": num_questions,
+            "difficulty": difficulty,
+            "question_type": question_type,
+            "question_type_counts": question_type_counts,
+        }
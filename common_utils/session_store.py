@@ -0,0 +1,214 @@
+"""
+Storage for dialogue session state.
+
+Sessions used to live in an unbounded module-level dict that only shrank when
+the browser called ``/end_dialogue``.  A :class:`SessionStore` bounds them:
+
+- :class:`InMemorySessionStore`: per-process LRU with an idle TTL, a session
+  count limit and a total byte budget.
+- :class:`SQLiteSessionStore`: one SQLite file shared by all worker processes,
+  so sessions survive restarts and work behind a multi-worker server.
+
+States are stored JSON-encoded, which isolates them from later in-place
+mutation and gives an exact per-session size for memory accounting.
+:func:`create_session_store` picks a backend from a URL such as ``memory://``
+or ``sqlite:///dialogue_sessions.sqlite`` (relative path; use four slashes
+for an absolute one, as in SQLAlchemy).
+"""
+import json
+import threading
+from abc import ABC, abstractmethod
+import time
+from collections import OrderedDict
+from typing import Any, Dict, Optional, Tuple
+
+from .cache_utils import SQLiteKVStore
+
+State = Dict[str, Any]
+
+
+def _encode(state: State) -> bytes:
+    return json.dumps(state, ensure_ascii=False, separators=(",", ":")).encode("utf-8")
+
+
+class SessionStore(ABC):
+    """Interface of a dialogue session store."""
+
+    @abstractmethod
+    def get(self, session_id: str) -> Optional[State]:
+        """Return the session state, or ``None`` if unknown or expired."""
+
+    @abstractmethod
+    def set(self, session_id: str, state: State) -> None:
+        """Store (replace) the session state."""
+
+    @abstractmethod
+    def delete(self, session_id: str) -> bool:
+        """Remove a session; return whether it existed."""
+
+    @abstractmethod
+    def stats(self) -> Dict[str, Any]:
+        """Size and eviction counters for monitoring."""
+
+    def __contains__(self, session_id: str) -> bool:
+        return self.get(session_id) is not None
+
+
+class InMemorySessionStore(SessionStore):
+    """Process-local store with LRU eviction, idle TTL and a byte budget."""
+
+    def __init__(
+        self,
+        max_sessions: int = 1000,
+        ttl: float = 2 * 3600,
+        max_bytes: int = 64 * 1024 * 1024,
+    ):
+        """
+        Args:
+            max_sessions: Maximum number of live sessions.
+            ttl: Seconds of inactivity after which a session expires.
+            max_bytes: Budget for the encoded states of all sessions together.
+        """
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.max_bytes = max_bytes
+        # session_id -> (encoded state, last access)
+        self._data: "OrderedDict[str, Tuple[bytes, float]]" = OrderedDict()
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self.evictions = {"ttl": 0, "lru": 0, "memory": 0}
+
+    def _drop(self, session_id: str, reason: Optional[str] = None) -> None:
+        blob, _ = self._data.pop(session_id)
+        self._bytes -= len(blob)
+        if reason:
+            self.evictions[reason] += 1
+
+    def _expire(self, now: float) -> None:
+        # Entries are ordered by last access, so expired ones are at the front.
+        while self._data:
+            session_id, (_, last_access) = next(iter(self._data.items()))
+            if now - last_access <= self.ttl:
+                break
+            self._drop(session_id, "ttl")
+
+    def get(self, session_id: str) -> Optional[State]:
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            entry = self._data.get(session_id)
+            if entry is None:
+                return None
+            self._data[session_id] = (entry[0], now)
+            self._data.move_to_end(session_id)
+        return json.loads(entry[0])
+
+    def set(self, session_id: str, state: State) -> None:
+        blob = _encode(state)
+        now = time.time()
+        with self._lock:
+            self._expire(now)
+            if session_id in self._data:
+                self._drop(session_id)
+            self._data[session_id] = (blob, now)
+            self._bytes += len(blob)
+            while len(self._data) > self.max_sessions:
+                self._drop(next(iter(self._data)), "lru")
+            # Never evict the session that is being written.
+            while self._bytes > self.max_bytes and len(self._data) > 1:
+                self._drop(next(iter(self._data)), "memory")
+
+    def delete(self, session_id: str) -> bool:
+        with self._lock:
+            if session_id not in self._data:
+                return False
+            self._drop(session_id)
+            return True
+
+    def session_size(self, session_id: str) -> int:
+        """Encoded size of one session in bytes (0 if unknown)."""
+        with self._lock:
+            entry = self._data.get(session_id)
+        return len(entry[0]) if entry else 0
+
+    def stats(self) -> Dict[str, Any]:
+        with self._lock:
+            self._expire(time.time())
+            sizes = [len(blob) for blob, _ in self._data.values()]
+            return {
+                "backend": "memory",
+                "sessions": len(sizes),
+                "max_sessions": self.max_sessions,
+                "bytes": self._bytes,
+                "max_bytes": self.max_bytes,
+                "largest_session_bytes": max(sizes, default=0),
+                "evictions": dict(self.evictions),
+            }
+
+
+class SQLiteSessionStore(SessionStore):
+    """Store shared by all worker processes through one SQLite file.
+
+    The TTL is renewed whenever a session is written, i.e. once per dialogue
+    turn.  Expired and surplus sessions are swept every ``sweep_every`` writes.
+    """
+
+    def __init__(
+        self,
+        path: str,
+        max_sessions: int = 10000,
+        ttl: float = 2 * 3600,
+        sweep_every: int = 100,
+    ):
+        self.store = SQLiteKVStore(path, namespace="dialogue_sessions")
+        self.max_sessions = max_sessions
+        self.ttl = ttl
+        self.sweep_every = sweep_every
+        self._writes = 0
+        self._lock = threading.Lock()
+        self.evictions = {"ttl": 0, "lru": 0}
+
+    def get(self, session_id: str) -> Optional[State]:
+        blob = self.store.get(session_id)
+        return json.loads(blob) if blob is not None else None
+
+    def set(self, session_id: str, state: State) -> None:
+        self.store.set(session_id, _encode(state), ttl=self.ttl)
+        with self._lock:
+            self._writes += 1
+            sweep = self._writes % self.sweep_every == 0
+        if sweep:
+            self.sweep()
+
+    def delete(self, session_id: str) -> bool:
+        existed = self.store.get(session_id) is not None
+        self.store.delete(session_id)
+        return existed
+
+    def sweep(self) -> None:
+        """Remove expired sessions and trim to ``max_sessions``."""
+        expired = self.store.purge_expired()
+        trimmed = self.store.trim(self.max_sessions)
+        with self._lock:
+            self.evictions["ttl"] += expired
+            self.evictions["lru"] += trimmed
+
+    def stats(self) -> Dict[str, Any]:
+        sessions, size = self.store.usage()
+        return {
+            "backend": "sqlite",
+            "sessions": sessions,
+            "max_sessions": self.max_sessions,
+            "bytes": size,
+            # Counters are per process; other workers sweep the same file.
+            "evictions": dict(self.evictions),
+        }
+
+
+def create_session_store(url: str = "memory://", **kwargs: Any) -> SessionStore:
+    """Build a store from ``memory://`` or ``sqlite:///<path>`` (extra options as kwargs)."""
+    if url == "memory://" or url == "memory":
+        return InMemorySessionStore(**kwargs)
+    if url.startswith("sqlite:///"):
+        return SQLiteSessionStore(url[len("sqlite:///"):], **kwargs)
+    raise ValueError(f"Unknown session store URL: {url!r}")
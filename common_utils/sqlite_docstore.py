@@ -0,0 +1,137 @@
+"""
+SQLite-backed docstore for FAISS knowledge bases.
+
+``FAISS.save_local`` stores chunk texts and the position → id mapping in
+``index.pkl``, which has to be unpickled (and fully materialised) on every
+load.  This module keeps the same information in ``docstore.sqlite`` next to
+``index.faiss`` and reads a row only when a search actually hits it, so a
+knowledge base can be opened without deserialising any pickle.
+
+Convert an existing knowledge base once with::
+
+    python -m common_utils.sqlite_docstore database_agent_mayuan
+"""
+import json
+import os
+import sqlite3
+import sys
+import threading
+from collections.abc import Mapping
+from typing import Iterator, Union
+
+from langchain_community.docstore.base import Docstore
+from langchain_core.documents import Document
+
+DOCSTORE_FILENAME = "docstore.sqlite"
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS chunks (
+    idx          INTEGER PRIMARY KEY,
+    doc_id       TEXT NOT NULL UNIQUE,
+    page_content TEXT NOT NULL,
+    metadata     TEXT NOT NULL
+)
+"""
+
+
+class _ReadOnlyConnection:
+    """Per-thread, per-process read-only SQLite connection."""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._local = threading.local()
+
+    def get(self) -> sqlite3.Connection:
+        conn = getattr(self._local, "conn", None)
+        # Connections must not cross a fork, so reopen in a new process.
+        if conn is None or getattr(self._local, "pid", None) != os.getpid():
+            uri = f"file:{os.path.abspath(self.db_path)}?mode=ro"
+            conn = sqlite3.connect(uri, uri=True, check_same_thread=False)
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+
+class SQLiteDocstore(Docstore):
+    """Docstore that looks up chunks lazily by docstore id."""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._conn = _ReadOnlyConnection(db_path)
+
+    def search(self, search: str) -> Union[str, Document]:
+        row = self._conn.get().execute(
+            "SELECT page_content, metadata FROM chunks WHERE doc_id = ?", (search,)
+        ).fetchone()
+        if row is None:
+            return f"ID {search} not found."
+        return Document(page_content=row[0], metadata=json.loads(row[1]))
+
+
+class SQLiteIndexMapping(Mapping):
+    """Lazy ``index_to_docstore_id`` mapping (FAISS position or id → docstore id)."""
+
+    def __init__(self, db_path: str):
+        self.db_path = db_path
+        self._conn = _ReadOnlyConnection(db_path)
+
+    def __getitem__(self, key: int) -> str:
+        row = self._conn.get().execute(
+            "SELECT doc_id FROM chunks WHERE idx = ?", (int(key),)
+        ).fetchone()
+        if row is None:
+            raise KeyError(key)
+        return row[0]
+
+    def __iter__(self) -> Iterator[int]:
+        for (idx,) in self._conn.get().execute("SELECT idx FROM chunks ORDER BY idx"):
+            yield idx
+
+    def __len__(self) -> int:
+        return self._conn.get().execute("SELECT COUNT(*) FROM chunks").fetchone()[0]
+
+
+def write_docstore(vectorstore, path: str) -> str:
+    """Write the docstore of a loaded FAISS ``vectorstore`` to ``path``.
+
+    The file is built under a temporary name and moved into place, so readers
+    never see a half-written database.  Returns the database path.
+    """
+    db_path = os.path.join(path, DOCSTORE_FILENAME)
+    tmp_path = db_path + ".tmp"
+    if os.path.exists(tmp_path):
+        os.unlink(tmp_path)
+
+    conn = sqlite3.connect(tmp_path)
+    try:
+        conn.execute(_SCHEMA)
+        rows = []
+        for idx, doc_id in vectorstore.index_to_docstore_id.items():
+            doc = vectorstore.docstore.search(doc_id)
+            if not isinstance(doc, Document):
+                raise ValueError(f"Docstore has no entry for id {doc_id!r}")
+            rows.append((int(idx), doc_id, doc.page_content, json.dumps(doc.metadata, ensure_ascii=False)))
+        conn.executemany("INSERT INTO chunks VALUES (?, ?, ?, ?)", rows)
+        conn.commit()
+    finally:
+        conn.close()
+
+    os.replace(tmp_path, db_path)
+    return db_path
+
+
+def main(argv=None) -> None:
+    """Convert a pickle-based knowledge base to the SQLite docstore layout."""
+    from .vector_utils import load_embeddings, load_vectorstore
+
+    args = sys.argv[1:] if argv is None else argv
+    path = args[0] if args else "database_agent_mayuan"
+    print(f"正在转换知识库 '{path}' ...")
+    # The pickle is our own build output; this is the one place it is trusted.
+    vectorstore = load_vectorstore(path, load_embeddings(), mode="pickle")
+    db_path = write_docstore(vectorstore, path)
+    print(f"已写入 {db_path}（{len(vectorstore.index_to_docstore_id)} 个文档块）。")
+
+
+if __name__ == "__main__":
+    main()
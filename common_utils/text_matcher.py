@@ -0,0 +1,92 @@
+"""
+Multi-pattern keyword matching (Aho–Corasick).
+
+Request parsing keeps asking "which of these N keywords occur in the input?"
+(topics, characters, question types ...).  :class:`KeywordMatcher` answers it
+in one pass over the text, independent of the number of keywords::
+
+    matcher = KeywordMatcher({"马克思": "character", "马克思主义哲学": "topic"})
+    matcher.find_longest("我想和马克思聊聊马克思主义哲学")
+    # [Match(3, 6, '马克思', 'character'), Match(8, 15, '马克思主义哲学', 'topic')]
+"""
+from collections import deque
+from typing import Any, Dict, Iterator, List, Mapping, NamedTuple, Tuple
+
+
+class Match(NamedTuple):
+    start: int
+    end: int
+    pattern: str
+    value: Any
+
+
+class KeywordMatcher:
+    """Aho–Corasick automaton over a fixed set of keywords, each with a payload."""
+
+    def __init__(self, patterns: Mapping[str, Any]):
+        """
+        Args:
+            patterns: Keyword -> payload returned with each match (e.g. a
+                canonical name).  Empty keywords are ignored.
+        """
+        self.patterns: Dict[str, Any] = {p: v for p, v in patterns.items() if p}
+        self._goto: List[Dict[str, int]] = [{}]
+        self._fail: List[int] = [0]
+        self._out: List[Tuple[str, ...]] = [()]
+
+        for pattern in self.patterns:
+            state = 0
+            for char in pattern:
+                nxt = self._goto[state].get(char)
+                if nxt is None:
+                    nxt = len(self._goto)
+                    self._goto[state][char] = nxt
+                    self._goto.append({})
+                    self._fail.append(0)
+                    self._out.append(())
+                state = nxt
+            self._out[state] += (pattern,)
+
+        # Breadth-first construction of the failure links; depth-1 states fail to the root.
+        queue = deque(self._goto[0].values())
+        while queue:
+            state = queue.popleft()
+            for char, nxt in self._goto[state].items():
+                queue.append(nxt)
+                fail = self._fail[state]
+                while fail and char not in self._goto[fail]:
+                    fail = self._fail[fail]
+                self._fail[nxt] = self._goto[fail].get(char, 0)
+                self._out[nxt] += self._out[self._fail[nxt]]
+
+    def iter_matches(self, text: str) -> Iterator[Match]:
+        """All (possibly overlapping) occurrences, ordered by end position."""
+        goto, fail, out, patterns = self._goto, self._fail, self._out, self.patterns
+        state = 0
+        for i, char in enumerate(text):
+            nxt = goto[state].get(char)
+            while nxt is None and state:
+                state = fail[state]
+                nxt = goto[state].get(char)
+            state = nxt or 0
+            if out[state]:
+                for pattern in out[state]:
+                    yield Match(i + 1 - len(pattern), i + 1, pattern, patterns[pattern])
+
+    def find_longest(self, text: str) -> List[Match]:
+        """Leftmost-longest, non-overlapping occurrences in text order.
+
+        A longer keyword shadows the shorter ones it contains, so
+        "马克思主义" is not also reported as "马克思".
+        """
+        matches = sorted(self.iter_matches(text), key=lambda m: (m.start, -m.end))
+        result: List[Match] = []
+        end = 0
+        for match in matches:
+            if match.start >= end:
+                result.append(match)
+                end = match.end
+        return result
+
+    def __contains__(self, text: str) -> bool:
+        return next(self.iter_matches(text), None) is not None
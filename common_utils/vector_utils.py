@@ -1,29 +1,269 @@
-from typing import Optional
+import gc
+import os
+import threading
+from collections import defaultdict
+from typing import Dict, Hashable, Iterable, List, Optional, Sequence, Tuple
 
 from langchain_community.vectorstores import FAISS
+from langchain_core.documents import Document
+from langchain_core.embeddings import Embeddings
 from langchain_dashscope.embeddings import DashScopeEmbeddings
 
+from .embedding_cache import CachedEmbeddings
+
+
+# -----------------------------------------------------------------------------
+# Process-wide registry
+# -----------------------------------------------------------------------------
+# Every agent in ``app.py`` points at the same knowledge base, so the index and
+# docstore are loaded once per process and shared.  When the registry is filled
+# before the web server forks (``gunicorn --preload``), workers inherit the
+# loaded index copy-on-write instead of each loading their own.
+
+_registry_lock = threading.Lock()
+_embeddings_registry: Dict[str, CachedEmbeddings] = {}
+_vectorstore_registry: Dict[Tuple[str, str, str], FAISS] = {}
+
+
+def _reset_lock_after_fork() -> None:
+    """Give the child a fresh lock in case the parent forked while holding it."""
+    global _registry_lock
+    _registry_lock = threading.Lock()
+
+
+if hasattr(os, "register_at_fork"):
+    os.register_at_fork(after_in_child=_reset_lock_after_fork)
+
+
+# DashScope accepts at most this many texts per TextEmbedding request.
+_DASHSCOPE_EMBEDDING_BATCH = 25
+
+
+class BatchDashScopeEmbeddings(DashScopeEmbeddings):
+    """DashScopeEmbeddings that can embed several *queries* in one request."""
+
+    def embed_queries(self, texts: List[str]) -> List[List[float]]:
+        vectors: List[List[float]] = []
+        for start in range(0, len(texts), _DASHSCOPE_EMBEDDING_BATCH):
+            batch = texts[start:start + _DASHSCOPE_EMBEDDING_BATCH]
+            response = self.client.call(model=self.model, input=batch, text_type="query")
+            if response.status_code != 200:
+                raise Exception(
+                    "DashScope Embedding Error: Code {} , Message {}".format(
+                        getattr(response, "code", "unknown"), getattr(response, "message", "unknown")
+                    )
+                )
+            items = sorted(response.output["embeddings"], key=lambda item: item["text_index"])
+            vectors.extend(item["embedding"] for item in items)
+        return vectors
+
 
 def load_embeddings(model: str = "text-embedding-v2") -> DashScopeEmbeddings:
     """Initialize and return a DashScopeEmbeddings instance."""
-    return DashScopeEmbeddings(model=model)
+    return BatchDashScopeEmbeddings(model=model)
+
+
+def _load_mmap_vectorstore(path: str, embeddings: Embeddings) -> FAISS:
+    """Open ``index.faiss`` memory-mapped and attach the SQLite docstore."""
+    import faiss
+
+    from .sqlite_docstore import DOCSTORE_FILENAME, SQLiteDocstore, SQLiteIndexMapping
+
+    # IO_FLAG_MMAP_IFC (faiss >= 1.10) maps flat codes zero-copy; older releases
+    # only support mapping the inverted lists of IVF indexes.
+    flags = getattr(faiss, "IO_FLAG_MMAP_IFC", faiss.IO_FLAG_MMAP)
+    flags |= getattr(faiss, "IO_FLAG_READ_ONLY", 0)
+    index = faiss.read_index(os.path.join(path, "index.faiss"), flags)
+
+    db_path = os.path.join(path, DOCSTORE_FILENAME)
+    return FAISS(
+        embedding_function=embeddings,
+        index=index,
+        docstore=SQLiteDocstore(db_path),
+        index_to_docstore_id=SQLiteIndexMapping(db_path),
+    )
 
 
 def load_vectorstore(
     path: str = "database_agent_mayuan",
-    embeddings: Optional[DashScopeEmbeddings] = None,
+    embeddings: Optional[Embeddings] = None,
     allow_dangerous_deserialization: bool = True,
+    mode: str = "auto",
 ):
     """Load a FAISS vectorstore from ``path`` with provided ``embeddings``.
 
     If *embeddings* is ``None`` a new embedding model will be created with the
     default parameters.
+
+    ``mode`` selects the on-disk layout:
+
+    - ``"pickle"``: ``FAISS.load_local`` (index read into RAM, ``index.pkl`` unpickled).
+    - ``"mmap"``: index memory-mapped read-only and chunks read lazily from
+      ``docstore.sqlite`` (see :mod:`common_utils.sqlite_docstore`); no pickle is loaded.
+    - ``"auto"``: ``"mmap"`` when ``docstore.sqlite`` exists, otherwise ``"pickle"``.
     """
+    from .sqlite_docstore import DOCSTORE_FILENAME
+
     if embeddings is None:
         embeddings = load_embeddings()
 
+    if mode == "auto":
+        mode = "mmap" if os.path.exists(os.path.join(path, DOCSTORE_FILENAME)) else "pickle"
+
+    if mode == "mmap":
+        return _load_mmap_vectorstore(path, embeddings)
+    if mode != "pickle":
+        raise ValueError(f"Unknown vectorstore load mode: {mode!r}")
+
     return FAISS.load_local(
         path,
         embeddings,
         allow_dangerous_deserialization=allow_dangerous_deserialization,
-    ) 
\ No newline at end of file
+    )
+
+
+def get_embeddings(
+    model: str = "text-embedding-v2",
+    cache_size: Optional[int] = None,
+    cache_path: Optional[str] = None,
+) -> CachedEmbeddings:
+    """Return the shared, caching embeddings instance for ``model``.
+
+    Query embeddings are served from an LRU of ``cache_size`` entries and, when
+    ``cache_path`` is set, a persistent SQLite tier.  Omitted settings come from
+    the ``EMBEDDING_CACHE_SIZE`` (default 2048) and ``EMBEDDING_CACHE_PATH``
+    (default: no SQLite tier) environment variables.
+
+    Raises:
+        ValueError: The instance for ``model`` already exists with other cache settings.
+    """
+    if cache_size is None:
+        cache_size = int(os.environ.get("EMBEDDING_CACHE_SIZE", "2048"))
+    if cache_path is None:
+        cache_path = os.environ.get("EMBEDDING_CACHE_PATH") or None
+
+    with _registry_lock:
+        embeddings = _embeddings_registry.get(model)
+        if embeddings is None:
+            embeddings = CachedEmbeddings(
+                load_embeddings(model),
+                model=model,
+                maxsize=cache_size,
+                persist_path=cache_path,
+            )
+            _embeddings_registry[model] = embeddings
+    if (embeddings.memory.maxsize, embeddings.persist_path) != (cache_size, cache_path):
+        raise ValueError(
+            f"Embeddings for {model!r} already use cache_size={embeddings.memory.maxsize}, "
+            f"cache_path={embeddings.persist_path!r}; requested cache_size={cache_size}, "
+            f"cache_path={cache_path!r}"
+        )
+    return embeddings
+
+
+def get_vectorstore(
+    path: str = "database_agent_mayuan",
+    embedding_model: str = "text-embedding-v2",
+    mode: str = "auto",
+) -> FAISS:
+    """Return the shared vectorstore for ``path`` + ``embedding_model``.
+
+    The store is loaded on first request and reused by every later caller in the
+    same process.  Load failures are not cached, so a later call retries.
+    ``mode`` is passed to :func:`load_vectorstore`.
+    """
+    key = (os.path.abspath(path), embedding_model, mode)
+    store = _vectorstore_registry.get(key)
+    if store is not None:
+        return store
+
+    embeddings = get_embeddings(embedding_model)
+    with _registry_lock:
+        store = _vectorstore_registry.get(key)
+        if store is None:
+            print(f"[vector_utils] Loading vectorstore '{path}' ({embedding_model}) ...")
+            store = load_vectorstore(path, embeddings, mode=mode)
+            _vectorstore_registry[key] = store
+    return store
+
+
+def batch_similarity_search(
+    vectorstore: FAISS,
+    queries: Sequence[str],
+    k: int = 3,
+) -> List[List[Document]]:
+    """Run ``similarity_search`` for several queries with one embedding request.
+
+    All queries are embedded together and searched as a single stacked query
+    matrix.  Returns one ranked document list per query, in query order.
+    """
+    import faiss
+    import numpy as np
+
+    if not queries:
+        return []
+
+    embeddings = vectorstore.embeddings
+    if hasattr(embeddings, "embed_queries"):
+        vectors = embeddings.embed_queries(list(queries))
+    else:
+        vectors = [vectorstore._embed_query(q) for q in queries]
+
+    matrix = np.asarray(vectors, dtype=np.float32)
+    if vectorstore._normalize_L2:
+        faiss.normalize_L2(matrix)
+    _, indices = vectorstore.index.search(matrix, k)
+
+    results: List[List[Document]] = []
+    for row in indices:
+        docs = []
+        for i in row:
+            if i == -1:
+                continue
+            doc = vectorstore.docstore.search(vectorstore.index_to_docstore_id[int(i)])
+            if isinstance(doc, Document):
+                docs.append(doc)
+        results.append(docs)
+    return results
+
+
+def reciprocal_rank_fusion(ranked_lists: Sequence[Sequence[Hashable]], k: int = 60) -> List[Hashable]:
+    """Merge ranked lists with reciprocal-rank fusion (score = sum of ``1 / (k + rank)``).
+
+    Duplicates across lists are merged.  Ties are broken by best rank and then
+    by list order, so the result is deterministic.
+    """
+    scores: Dict[Hashable, float] = defaultdict(float)
+    first_seen: Dict[Hashable, Tuple[int, int]] = {}
+    for list_idx, ranked in enumerate(ranked_lists):
+        for rank, item in enumerate(ranked, start=1):
+            scores[item] += 1.0 / (k + rank)
+            best = first_seen.get(item)
+            if best is None or (rank, list_idx) < best:
+                first_seen[item] = (rank, list_idx)
+    return sorted(scores, key=lambda item: (-scores[item], first_seen[item]))
+
+
+def preload_vectorstores(
+    paths: Iterable[str] = ("database_agent_mayuan",),
+    embedding_model: str = "text-embedding-v2",
+    freeze: bool = True,
+) -> None:
+    """Load ``paths`` into the registry before worker processes are forked.
+
+    Call this from the master process (e.g. a gunicorn ``--preload`` import or
+    ``on_starting`` hook).  With ``freeze`` the loaded objects are moved to the
+    permanent GC generation so collections in the workers do not touch, and
+    thereby copy, the shared pages.
+    """
+    for path in paths:
+        get_vectorstore(path, embedding_model)
+    if freeze and hasattr(gc, "freeze"):
+        gc.freeze()
+
+
+def clear_vectorstore_registry() -> None:
+    """Drop all shared instances, e.g. after the knowledge base was rebuilt."""
+    with _registry_lock:
+        _vectorstore_registry.clear()
+        _embeddings_registry.clear()
@@ -0,0 +1,160 @@
+"""
+Cache of vision-model answers, keyed by what the image looks like.
+
+Students of one class keep uploading the same textbook page or slide
+screenshot, each time re-encoded, cropped a little differently or sent from
+another phone, so the bytes rarely match.  :class:`VisionAnswerCache` keys an
+answer on
+
+- a perceptual difference hash (:func:`dhash`) of the image, compared by
+  Hamming distance so near-identical images also hit;
+- the normalized question text (full-width forms, case, whitespace and
+  punctuation folded, see :func:`~common_utils.kg_cache.normalize_topic`);
+- a hash of the system prompt, so different personas never share answers.
+
+The cache is bounded by entry count (LRU) and entries expire after ``ttl``.
+``max_distance=0`` restricts hits to images that are identical at hash level.
+"""
+import hashlib
+import threading
+import time
+from collections import OrderedDict
+from io import BytesIO
+from typing import Dict, Optional, Set, Tuple
+
+from PIL import Image, ImageOps
+
+from .cache_utils import LRUCache
+from .image_payload import ImagePayload
+from .kg_cache import normalize_topic
+
+
+def dhash(payload: ImagePayload, hash_size: int = 16) -> int:
+    """Difference hash: ``hash_size``² bits, one per horizontally adjacent pixel pair."""
+    with Image.open(BytesIO(payload.data)) as image:
+        # JPEGs are decoded directly at a reduced scale, which is much faster.
+        image.draft("L", (hash_size * 8, hash_size * 8))
+        small = (
+            ImageOps.exif_transpose(image)
+            .convert("L")
+            .resize((hash_size + 1, hash_size), Image.Resampling.BOX)
+        )
+    pixels = list(small.getdata())
+    value = 0
+    for row in range(hash_size):
+        offset = row * (hash_size + 1)
+        for col in range(hash_size):
+            value = (value << 1) | (pixels[offset + col] > pixels[offset + col + 1])
+    return value
+
+
+def _distance(a: int, b: int) -> int:
+    return bin(a ^ b).count("1")
+
+
+class VisionAnswerCache:
+    """Bounded LRU of vision answers with perceptual-hash lookup."""
+
+    def __init__(self, maxsize: int = 512, ttl: float = 24 * 3600, max_distance: int = 8, hash_size: int = 16):
+        """
+        Args:
+            maxsize: Maximum number of cached answers.
+            ttl: Seconds an answer stays valid.
+            max_distance: Largest Hamming distance between image hashes that
+                still counts as the same image (out of ``hash_size``² bits).
+            hash_size: Side of the :func:`dhash` grid.
+        """
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.max_distance = max_distance
+        self.hash_size = hash_size
+        self._entries: "OrderedDict[Tuple[str, int], Tuple[float, str]]" = OrderedDict()
+        self._by_context: Dict[str, Set[int]] = {}
+        self._hashes = LRUCache(1024)  # image digest -> dhash
+        self._lock = threading.Lock()
+        self.hits = 0
+        self.near_hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @staticmethod
+    def context_key(text: str, system_prompt: str) -> str:
+        """Key of the normalized question text and the system prompt."""
+        payload = normalize_topic(text or "") + "\0" + (system_prompt or "")
+        return hashlib.sha256(payload.encode("utf-8")).hexdigest()[:32]
+
+    def image_hash(self, image: ImagePayload) -> Optional[int]:
+        """Perceptual hash of ``image`` (memoized by content), ``None`` if it cannot be decoded."""
+        value = self._hashes.get(image.digest)
+        if value is None:
+            try:
+                value = dhash(image, self.hash_size)
+            except Exception as e:
+                print(f"[vision_cache] 无法计算图片哈希: {e}")
+                return None
+            self._hashes.set(image.digest, value)
+        return value
+
+    def get(self, image: ImagePayload, text: str, system_prompt: str) -> Optional[str]:
+        """Cached answer for this image (or a near-identical one) and question."""
+        image_hash = self.image_hash(image)
+        if image_hash is None:
+            return None
+        context = self.context_key(text, system_prompt)
+        now = time.time()
+        with self._lock:
+            best: Optional[Tuple[int, int]] = None  # (distance, hash)
+            for candidate in list(self._by_context.get(context, ())):
+                expires_at, _ = self._entries[(context, candidate)]
+                if expires_at <= now:
+                    self._remove((context, candidate))
+                    continue
+                distance = _distance(candidate, image_hash)
+                if distance <= self.max_distance and (best is None or distance < best[0]):
+                    best = (distance, candidate)
+            if best is None:
+                self.misses += 1
+                return None
+            key = (context, best[1])
+            self._entries.move_to_end(key)
+            if best[0]:
+                self.near_hits += 1
+            else:
+                self.hits += 1
+            return self._entries[key][1]
+
+    def put(self, image: ImagePayload, text: str, system_prompt: str, answer: str) -> None:
+        image_hash = self.image_hash(image)
+        if image_hash is None:
+            return
+        context = self.context_key(text, system_prompt)
+        key = (context, image_hash)
+        with self._lock:
+            self._entries[key] = (time.time() + self.ttl, answer)
+            self._entries.move_to_end(key)
+            self._by_context.setdefault(context, set()).add(image_hash)
+            while len(self._entries) > self.maxsize:
+                self._remove(next(iter(self._entries)))
+                self.evictions += 1
+
+    def _remove(self, key: Tuple[str, int]) -> None:
+        del self._entries[key]
+        hashes = self._by_context[key[0]]
+        hashes.discard(key[1])
+        if not hashes:
+            del self._by_context[key[0]]
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self._by_context.clear()
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "size": len(self._entries),
+            "maxsize": self.maxsize,
+            "hits": self.hits,
+            "near_hits": self.near_hits,
+            "misses": self.misses,
+            "evictions": self.evictions,
+        }
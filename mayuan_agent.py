@@ -2,10 +2,22 @@
 马克思主义基本原理智能出题 Agent
 """
 import os
-from typing import Optional
+from typing import Optional, Union
 from common_utils.base_agent import BaseAgent
+from common_utils.image_payload import ImagePayload
+from common_utils.question_cache import QuestionResultCache
 from common_utils.multimodal_agent import MayuanMultimodalAgent
 
+# 马原课程的常见主题，用于更精确地解析用户输入，也用于知识图谱缓存预热
+MAYUAN_COMMON_TOPICS = [
+    "唯物辩证法", "历史唯物主义", "马克思主义哲学", "认识论",
+    "实践观", "矛盾论", "否定之否定", "质量互变", "联系",
+    "发展", "本质与现象", "内容与形式", "原因与结果",
+    "必然与偶然", "可能与现实", "社会存在", "社会意识",
+    "辩证唯物主义"
+]
+
+
 class MayuanQuestionAgent(BaseAgent):
     """
     专门用于“马克思主义基本原理”课程的智能出题 Agent。
@@ -13,50 +25,44 @@ class MayuanQuestionAgent(BaseAgent):
     """
     def __init__(self):
         """初始化马原 Agent 的特定配置"""
-        
-        # 定义马原课程的常见主题，用于更精确地解析用户输入
-        common_topics = [
-            "唯物辩证法", "历史唯物主义", "马克思主义哲学", "认识论",
-            "实践观", "矛盾论", "否定之否定", "质量互变", "联系",
-            "发展", "本质与现象", "内容与形式", "原因与结果",
-            "必然与偶然", "可能与现实", "社会存在", "社会意识",
-            "辩证唯物主义"
-        ]
 
         # 调用父类的构造函数，传入马原课程的特定参数
         super().__init__(
             subject_name="马克思主义基本原理",
             default_topic="马克思主义基本原理",
-            common_topics=common_topics,
-            vectorstore_path="database_agent_mayuan"
+            common_topics=MAYUAN_COMMON_TOPICS,
+            vectorstore_path="database_agent_mayuan",
+            # 同一班级的同类请求轮换返回最多 3 份已生成的试题，1 小时后过期
+            result_cache=QuestionResultCache(ttl=3600, maxsize=256, variants=3),
         )
         
         # 初始化多模态Agent用于图片分析
         try:
-            self.multimodal_agent = MayuanMultimodalAgent()
+            # 与出题流程共用同一份知识库，图片问题也按课程资料作答
+            self.multimodal_agent = MayuanMultimodalAgent(vectorstore=self.vectorstore)
             print("[马原Agent] 多模态功能初始化成功")
         except Exception as e:
             print(f"[马原Agent] 多模态功能初始化失败: {e}")
             self.multimodal_agent = None
     
-    def process_multimodal_request(self, text_input: str, image_path: Optional[str] = None) -> str:
+    def process_multimodal_request(self, text_input: str, image: Union[ImagePayload, str, None] = None) -> str:
         """
         处理多模态请求（支持图片+文本输入）
         
         Args:
             text_input: 用户的文本输入
-            image_path: 图片文件路径（可选）
+            image: 图片（可选），ImagePayload 或文件路径
             
         Returns:
             AI的回复
         """
         # 如果没有图片或多模态Agent不可用，使用普通文本处理
-        if not image_path or not self.multimodal_agent:
+        if not image or not self.multimodal_agent:
             return self.process_request(text_input)
         
         try:
             # 使用多模态Agent处理图片+文本
-            return self.multimodal_agent.process_multimodal_request(text_input, image_path)
+            return self.multimodal_agent.process_multimodal_request(text_input, image)
         except Exception as e:
             print(f"[马原Agent] 多模态处理失败，回退到文本模式: {e}")
             return self.process_request(text_input)
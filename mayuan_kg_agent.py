@@ -1,7 +1,30 @@
 """
 马克思主义基本原理知识图谱 Agent
 """
+import sys
+
 from common_utils.base_kg_agent import BaseKnowledgeGraphAgent
+from common_utils.kg_cache import KnowledgeGraphCache, knowledge_base_version
+
+VECTORSTORE_PATH = "database_agent_mayuan"
+
+# 同义说法统一到 common_topics 中的标准名称，使其命中同一条缓存
+TOPIC_SYNONYMS = {
+    "矛盾规律": "矛盾论",
+    "对立统一规律": "矛盾论",
+    "对立统一": "矛盾论",
+    "质量互变规律": "质量互变",
+    "量变质变规律": "质量互变",
+    "量变与质变": "质量互变",
+    "否定之否定规律": "否定之否定",
+    "实践论": "实践观",
+    "唯物史观": "历史唯物主义",
+    "现象与本质": "本质与现象",
+    "形式与内容": "内容与形式",
+    "因果联系": "原因与结果",
+    "偶然与必然": "必然与偶然",
+    "现实与可能": "可能与现实",
+}
 
 
 class MayuanKnowledgeGraphAgent(BaseKnowledgeGraphAgent):
@@ -9,14 +32,37 @@ class MayuanKnowledgeGraphAgent(BaseKnowledgeGraphAgent):
     专门用于“马克思主义基本原理”课程的知识图谱 Agent。
     """
     def __init__(self):
+        # 知识图谱结果按规范化主题持久缓存 7 天，知识库重建后自动失效
+        cache = KnowledgeGraphCache(
+            f"{VECTORSTORE_PATH}.kg_cache.sqlite",
+            kb_version=knowledge_base_version(VECTORSTORE_PATH),
+            synonyms=TOPIC_SYNONYMS,
+        )
         # 调用父类构造函数，传入马原课程的特定参数
         super().__init__(
             subject_name="马克思主义基本原理",
-            vectorstore_path="database_agent_mayuan"
+            vectorstore_path=VECTORSTORE_PATH,
+            cache=cache,
         )
 
 
+def prewarm(force: bool = False) -> None:
+    """为全部常见主题预先生成知识图谱（建议在上课前运行）"""
+    from mayuan_agent import MAYUAN_COMMON_TOPICS
+
+    agent = MayuanKnowledgeGraphAgent()
+    status = agent.prewarm(MAYUAN_COMMON_TOPICS, force=force)
+    built = sum(1 for s in status.values() if s == "built")
+    cached = sum(1 for s in status.values() if s == "cached")
+    print(f"预热完成：新生成 {built} 个，已缓存 {cached} 个，失败 {len(status) - built - cached} 个")
+
+
 if __name__ == "__main__":
+    # python mayuan_kg_agent.py --prewarm [--force]
+    if "--prewarm" in sys.argv:
+        prewarm(force="--force" in sys.argv)
+        sys.exit(0)
+
     print("=" * 60)
     print("   马克思主义基本原理知识图谱 Agent")
     print("   基于 LangChain 构建")
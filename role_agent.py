@@ -1,11 +1,14 @@
 import os
-from typing import Optional
+from typing import Optional, Union
 from flask import Flask, request, jsonify, render_template
 import uuid
 
 # Import the new base class
 from common_utils.base_dialogue_agent import BaseDialogueAgent, DialogueGraphState
-from common_utils.multimodal_agent import SocratesMultimodalAgent
+from common_utils.image_payload import ImagePayload
+from common_utils.multimodal_agent import DialoguePersona, SocratesMultimodalAgent
+from mayuan_agent import MAYUAN_COMMON_TOPICS
+from mayuan_kg_agent import TOPIC_SYNONYMS
 
 #  API Key Setup (与之前相同) 
 # 重要：运行前必须设置环境变量
@@ -33,12 +36,16 @@ class SocratesAgent(BaseDialogueAgent):
             default_topic="马克思主义哲学",
             default_character="马克思",
             llm_model="qwen-max",
-            temperature=0.8
+            temperature=0.8,
+            # 常见“人物 + 主题”输入在本地直接解析，歧义时才调用 qwen-turbo
+            topics=MAYUAN_COMMON_TOPICS,
+            topic_synonyms=TOPIC_SYNONYMS,
         )
         
         # 初始化多模态Agent用于图片分析
         try:
-            self.multimodal_agent = SocratesMultimodalAgent()
+            # 与对话流程共用同一份知识库，图片问题也按课程资料作答
+            self.multimodal_agent = SocratesMultimodalAgent(vectorstore=self.vectorstore)
             print("[苏格拉底Agent] 多模态功能初始化成功")
         except Exception as e:
             print(f"[苏格拉底Agent] 多模态功能初始化失败: {e}")
@@ -48,7 +55,7 @@ class SocratesAgent(BaseDialogueAgent):
         self, 
         user_input: str, 
         current_state: Optional[dict] = None,
-        image_path: Optional[str] = None
+        image: Union[ImagePayload, str, None] = None
     ) -> dict:
         """
         处理多模态对话（支持图片+文本输入）
@@ -56,60 +63,46 @@ class SocratesAgent(BaseDialogueAgent):
         Args:
             user_input: 用户的文本输入
             current_state: 当前对话状态
-            image_path: 图片文件路径（可选）
+            image: 图片（可选），ImagePayload 或文件路径
             
         Returns:
             对话处理结果
         """
         # 如果没有图片或多模态Agent不可用，使用普通对话处理
-        if not image_path or not self.multimodal_agent:
+        if not image or not self.multimodal_agent:
             return self.process_dialogue(user_input, current_state)
         
         try:
-            # 更新多模态Agent的对话上下文
+            # 人物和主题随本次调用传入，不修改共享的多模态Agent，并发会话互不影响
             if current_state:
-                character = current_state.get("simulated_character", "马克思")
-                topic = current_state.get("current_topic", "马克思主义理论")
-                self.multimodal_agent.update_dialogue_context(character, topic)
+                persona = DialoguePersona.from_state(current_state, self.multimodal_agent.default_persona)
+            else:
+                # 新对话：先在本地从输入中识别人物和主题，识别不出时使用默认值
+                matched = self.match_intent(user_input)
+                persona = DialoguePersona(matched[1], matched[0]) if matched else self.multimodal_agent.default_persona
             
             # 使用多模态Agent处理图片+文本
-            response = self.multimodal_agent.process_multimodal_request(user_input, image_path)
+            response = self.multimodal_agent.process_dialogue_request(user_input, image, persona)
             
-            # 如果是新对话，需要初始化状态
-            if not current_state:
-                # 从响应中推断角色和主题（简化处理）
-                character = "马克思"  # 默认角色
-                topic = "马克思主义理论"  # 默认主题
-                
-                new_state = {
-                    "simulated_character": character,
-                    "current_topic": topic,
-                    "turn_count": 1,
-                    "conversation_history": [
-                        {"role": "user", "content": user_input},
-                        {"role": "assistant", "content": response}
-                    ]
-                }
-                
-                return {
-                    "status": "success",
-                    "response": response,
-                    "state": new_state
-                }
-            else:
-                # 更新现有状态
-                current_state["turn_count"] = current_state.get("turn_count", 0) + 1
-                current_state["conversation_history"] = current_state.get("conversation_history", [])
-                current_state["conversation_history"].extend([
+            # 在旧状态的基础上生成新状态，不修改传入的 current_state
+            base_state = self._initial_state(user_input, current_state)
+            new_state = {
+                **base_state,
+                "simulated_character": persona.character,
+                "current_topic": persona.topic,
+                "conversation_history": base_state["conversation_history"] + [
                     {"role": "user", "content": user_input},
-                    {"role": "assistant", "content": response}
-                ])
-                
-                return {
-                    "status": "success",
-                    "response": response,
-                    "state": current_state
-                }
+                    {"role": "assistant", "content": response},
+                ],
+                "socratic_response": response,
+                "turn_count": base_state["turn_count"] + 1,
+            }
+            
+            return {
+                "status": "success",
+                "response": response,
+                "state": new_state
+            }
                 
         except Exception as e:
             print(f"[苏格拉底Agent] 多模态处理失败，回退到文本模式: {e}")
@@ -51,6 +51,7 @@ document.addEventListener('DOMContentLoaded', () => {
     wrapper.appendChild(bubble);
     chatBox.appendChild(wrapper);
     chatBox.scrollTop = chatBox.scrollHeight;
+    return bubble;
   };
 
   const sendMessage = async () => {
@@ -61,29 +62,31 @@ document.addEventListener('DOMContentLoaded', () => {
     userInput.value = '';
     showLoading(true);
 
-    const url = sessionId ? '/continue_dialogue' : '/start_dialogue';
     const payload = sessionId ? { session_id: sessionId, message: text } : { message: text };
+    const bubble = appendMessage('', 'bot');
+    let streamedText = '';
 
     try {
-      const response = await fetch(url, {
-        method: 'POST',
-        headers: { 'Content-Type': 'application/json' },
-        body: JSON.stringify(payload),
+      await postEventStream('/dialogue_stream', payload, {
+        token: (data) => {
+          showLoading(false);
+          streamedText += data.delta;
+          bubble.textContent = streamedText;
+          chatBox.scrollTop = chatBox.scrollHeight;
+        },
+        done: (data) => {
+          if (data.session_id) {
+            sessionId = data.session_id;
+          }
+          bubble.textContent = data.response || streamedText || '（无回复）';
+        },
+        error: (data) => {
+          bubble.textContent = data.error || '发生错误，请稍后重试。';
+        },
       });
-
-      const data = await response.json();
-
-      if (response.ok) {
-        if (data.session_id) {
-          sessionId = data.session_id;
-        }
-        appendMessage(data.response || data.message || '（无回复）', 'bot');
-      } else {
-        appendMessage(data.error || '发生错误，请稍后重试。', 'bot');
-      }
     } catch (err) {
       console.error(err);
-      appendMessage('网络错误，请检查连接。', 'bot');
+      bubble.textContent = err.message || '网络错误，请检查连接。';
     } finally {
       showLoading(false);
     }
@@ -102,25 +102,41 @@ document.addEventListener("DOMContentLoaded", () => {
         clearSelectedImage(); // 清除图片预览
         showLoading(true);
 
+        // 先插入一个空的机器人气泡，收到 token 后逐步填充
+        const streamingMessage = appendMessage("", "bot");
+        let streamedText = "";
+        let finished = false;
+
         try {
-            const response = await fetch("/chat", {
-                method: "POST",
-                headers: {
-                    "Content-Type": "application/json",
+            await postEventStream("/chat_stream", requestData, {
+                token: (data) => {
+                    showLoading(false);
+                    streamedText += data.delta;
+                    streamingMessage.bubble.innerHTML = marked.parse(streamedText);
+                    chatBox.scrollTop = chatBox.scrollHeight;
+                },
+                done: () => {
+                    finished = true;
+                    // 完整内容到达后重新渲染一次（Mermaid 思维导图需要完整源码）
+                    streamingMessage.wrapper.remove();
+                    appendMessage(streamedText, "bot");
+                },
+                error: (data) => {
+                    finished = true;
+                    streamingMessage.wrapper.remove();
+                    appendMessage(data.error || "抱歉，处理您的请求时出错。", "bot");
                 },
-                body: JSON.stringify(requestData),
             });
-
-            if (!response.ok) {
-                throw new Error(`HTTP error! status: ${response.status}`);
+            if (!finished) {
+                throw new Error("stream closed before completion");
             }
 
-            const data = await response.json();
-            appendMessage(data.response, "bot");
-
         } catch (error) {
             console.error("Error:", error);
-            appendMessage("抱歉，处理您的请求时出错，请查看控制台了解详情。", "bot");
+            if (!finished) {
+                streamingMessage.wrapper.remove();
+                appendMessage(streamedText || "抱歉，处理您的请求时出错，请查看控制台了解详情。", "bot");
+            }
         } finally {
             showLoading(false);
         }
@@ -200,6 +216,7 @@ document.addEventListener("DOMContentLoaded", () => {
         messageWrapper.appendChild(messageBubble);
         chatBox.appendChild(messageWrapper);
         chatBox.scrollTop = chatBox.scrollHeight;
+        return { wrapper: messageWrapper, bubble: messageBubble };
     };
 
     sendBtn.addEventListener("click", sendMessage);
@@ -0,0 +1,53 @@
+// 以 POST 方式请求流式接口，并按 Server-Sent Events 格式逐条回调。
+// 浏览器自带的 EventSource 只支持 GET，这里用 fetch + ReadableStream 手动解析。
+// handlers: { token(data), done(data), error(data) }，data 为服务端 JSON。
+async function postEventStream(url, payload, handlers = {}) {
+    const response = await fetch(url, {
+        method: 'POST',
+        headers: { 'Content-Type': 'application/json' },
+        body: JSON.stringify(payload),
+    });
+
+    // 参数错误等情况服务端直接返回 JSON，而不是事件流
+    if (!response.ok) {
+        let message = `HTTP error! status: ${response.status}`;
+        try {
+            const data = await response.json();
+            message = data.error || message;
+        } catch (_) {}
+        throw new Error(message);
+    }
+
+    const reader = response.body.getReader();
+    const decoder = new TextDecoder('utf-8');
+    let buffer = '';
+
+    const dispatch = (rawEvent) => {
+        let event = 'message';
+        const dataLines = [];
+        rawEvent.split('\n').forEach((line) => {
+            if (line.startsWith('event:')) {
+                event = line.slice(6).trim();
+            } else if (line.startsWith('data:')) {
+                dataLines.push(line.slice(5).trim());
+            }
+        });
+        if (!dataLines.length) return;
+        const data = JSON.parse(dataLines.join('\n'));
+        if (handlers[event]) handlers[event](data);
+    };
+
+    while (true) {
+        const { value, done } = await reader.read();
+        if (done) break;
+        buffer += decoder.decode(value, { stream: true });
+        let boundary;
+        while ((boundary = buffer.indexOf('\n\n')) !== -1) {
+            dispatch(buffer.slice(0, boundary));
+            buffer = buffer.slice(boundary + 2);
+        }
+    }
+    if (buffer.trim()) dispatch(buffer);
+}
+
+window.postEventStream = postEventStream;
@@ -0,0 +1,261 @@
+"""
+Tests for the embedding cache and the DashScope transport (retries, circuit breaker).
+
+No network access: upstreams are replaced by a fake embedder and by
+``make_stub_transport`` / ``httpx.MockTransport``.
+
+    python -m pytest tests
+"""
+import asyncio
+import os
+import sys
+
+import httpx
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from common_utils.dashscope_client import (  # noqa: E402
+    AsyncDashScopeClient,
+    CircuitBreaker,
+    CircuitOpenError,
+    DashScopeAPIError,
+    DashScopeClient,
+    RetryPolicy,
+    make_stub_transport,
+)
+from common_utils.embedding_cache import CachedEmbeddings  # noqa: E402
+
+MODEL = "qwen-test"
+MESSAGES = [{"role": "user", "content": "什么是矛盾的普遍性？"}]
+# No waiting between attempts; one call that fails all its attempts opens the breaker.
+POLICY = RetryPolicy(deadline=10.0, max_attempts=3, backoff_base=0.0, backoff_max=0.0, failure_threshold=3)
+UNAVAILABLE = {"status": 503, "code": "Unavailable"}
+
+
+class FakeEmbeddings:
+    """Records every text it is asked to embed."""
+
+    def __init__(self):
+        self.calls = []
+
+    def embed_documents(self, texts):
+        self.calls.append(("documents", list(texts)))
+        return [[float(len(t)), 1.0] for t in texts]
+
+    def embed_query(self, text):
+        self.calls.append(("query", [text]))
+        return [float(len(text)), 0.0]
+
+
+class FakeClock:
+    def __init__(self):
+        self.now = 1000.0
+
+    def __call__(self):
+        return self.now
+
+
+@pytest.fixture(autouse=True)
+def api_key(monkeypatch):
+    monkeypatch.setenv("DASHSCOPE_API_KEY", "sk-test")
+
+
+def make_client(replies, clock=None, async_client=False):
+    transport = replies if isinstance(replies, httpx.MockTransport) else make_stub_transport(replies)
+    cls = AsyncDashScopeClient if async_client else DashScopeClient
+    client = cls(transport=transport, policies={MODEL: POLICY})
+    client.breakers[MODEL] = CircuitBreaker(POLICY.failure_threshold, POLICY.reset_timeout, clock=clock or FakeClock())
+    return client
+
+
+def run_async(client, method, *args):
+    async def call():
+        if method == "stream_generate":
+            return "".join([delta async for delta in client.stream_generate(MODEL, *args)])
+        return await getattr(client, method)(MODEL, *args)
+
+    return asyncio.run(call())
+
+
+def run_sync(client, method, *args):
+    if method == "stream_generate":
+        return "".join(client.stream_generate(MODEL, *args))
+    return getattr(client, method)(MODEL, *args)
+
+
+# --- CachedEmbeddings ---------------------------------------------------------
+
+
+def test_embeddings_query_hit_and_miss():
+    fake = FakeEmbeddings()
+    cached = CachedEmbeddings(fake, model="fake", maxsize=8)
+
+    first = cached.embed_query("矛盾论")
+    assert cached.embed_query("矛盾论") == first
+    cached.embed_query("实践观")
+
+    assert fake.calls == [("query", ["矛盾论"]), ("query", ["实践观"])]
+    assert cached.stats()["hits"] == 1
+    assert cached.stats()["misses"] == 2
+
+
+def test_embeddings_documents_only_send_misses_and_not_shared_with_queries():
+    fake = FakeEmbeddings()
+    cached = CachedEmbeddings(fake, model="fake", maxsize=8)
+
+    cached.embed_documents(["甲", "乙"])
+    vectors = cached.embed_documents(["乙", "丙", "丙"])
+    cached.embed_query("甲")
+
+    assert fake.calls == [("documents", ["甲", "乙"]), ("documents", ["丙"]), ("query", ["甲"])]
+    assert vectors[1] == vectors[2]
+
+
+def test_embeddings_persistent_tier(tmp_path):
+    path = str(tmp_path / "embeddings.sqlite")
+    CachedEmbeddings(FakeEmbeddings(), model="fake", persist_path=path).embed_query("认识论")
+
+    fake = FakeEmbeddings()
+    cached = CachedEmbeddings(fake, model="fake", persist_path=path)
+    assert cached.embed_query("认识论") == [3.0, 0.0]
+    assert fake.calls == []
+    assert cached.stats()["disk_hits"] == 1
+
+
+# --- Retries and circuit breaker ---------------------------------------------
+
+
+def test_retryable_errors_are_retried():
+    client = make_client([{"status": 503, "code": "Unavailable"}, httpx.ReadTimeout("slow"), "好的"])
+    assert client.generate(MODEL, MESSAGES) == "好的"
+    assert len(client.transport.requests) == 3
+    assert client.breaker(MODEL).state == "closed"
+
+
+def test_client_errors_are_not_retried():
+    client = make_client([{"status": 400, "code": "InvalidParameter"}, "unused"])
+    with pytest.raises(DashScopeAPIError) as info:
+        client.generate(MODEL, MESSAGES)
+    assert info.value.status_code == 400
+    assert len(client.transport.requests) == 1
+    assert client.breaker(MODEL).state == "closed"
+
+
+def test_breaker_opens_and_recovers_after_trial():
+    clock = FakeClock()
+    client = make_client([UNAVAILABLE] * 3 + ["恢复了"], clock=clock)
+
+    with pytest.raises(DashScopeAPIError):
+        client.generate(MODEL, MESSAGES)
+    assert client.breaker(MODEL).state == "open"
+    with pytest.raises(CircuitOpenError):
+        client.generate(MODEL, MESSAGES)
+    assert len(client.transport.requests) == 3  # failing fast, no request sent
+
+    clock.now += POLICY.reset_timeout
+    assert client.breaker(MODEL).state == "half-open"
+    assert client.generate(MODEL, MESSAGES) == "恢复了"
+    assert client.breaker(MODEL).state == "closed"
+
+
+def test_failed_trial_reopens_breaker():
+    clock = FakeClock()
+    client = make_client([UNAVAILABLE], clock=clock)
+    with pytest.raises(DashScopeAPIError):
+        client.generate(MODEL, MESSAGES)
+
+    clock.now += POLICY.reset_timeout
+    with pytest.raises(DashScopeAPIError):
+        client.generate(MODEL, MESSAGES)
+    assert client.breaker(MODEL).state == "open"
+    assert len(client.transport.requests) == 4  # one trial request only
+
+
+def test_malformed_stream_does_not_leave_breaker_stuck_open():
+    clock = FakeClock()
+    sse = {"Content-Type": "text/event-stream"}
+    replies = iter([httpx.Response(503, json={"code": "Unavailable", "message": "busy"})] * 3 + [
+        httpx.Response(200, content=b"data: not-json\n\n", headers=sse),
+        httpx.Response(200, content=b"data: 5\n\n", headers=sse),
+        httpx.Response(
+            200, content='data: {"output":{"choices":[{"message":{"content":"好了"}}]}}\n\n'.encode(), headers=sse
+        ),
+    ])
+    client = make_client(httpx.MockTransport(lambda request: next(replies)), clock=clock)
+    with pytest.raises(DashScopeAPIError):
+        client.generate(MODEL, MESSAGES)
+
+    # Half-open trials that get unparsable events count as failures ...
+    for _ in range(2):
+        clock.now += POLICY.reset_timeout
+        with pytest.raises(DashScopeAPIError):
+            "".join(client.stream_generate(MODEL, MESSAGES))
+        assert client.breaker(MODEL).state == "open"
+
+    # ... so a later trial is allowed instead of failing fast forever.
+    clock.now += POLICY.reset_timeout
+    assert "".join(client.stream_generate(MODEL, MESSAGES)) == "好了"
+    assert client.breaker(MODEL).state == "closed"
+
+
+def test_interrupted_trial_is_released():
+    clock = FakeClock()
+
+    def interrupted(payload):
+        raise KeyboardInterrupt
+
+    client = make_client([UNAVAILABLE] * 3 + [interrupted, "一二三"], clock=clock)
+    with pytest.raises(DashScopeAPIError):
+        client.generate(MODEL, MESSAGES)
+
+    clock.now += POLICY.reset_timeout
+    with pytest.raises(KeyboardInterrupt):
+        client.generate(MODEL, MESSAGES)
+    # The trial ended without a verdict: the next call may try again.
+    assert client.generate(MODEL, MESSAGES) == "一二三"
+
+
+def test_malformed_event_is_an_invalid_response():
+    sse = {"Content-Type": "text/event-stream"}
+    client = make_client(httpx.MockTransport(lambda request: httpx.Response(200, content=b"data: {\n\n", headers=sse)))
+    with pytest.raises(DashScopeAPIError) as info:
+        "".join(client.stream_generate(MODEL, MESSAGES))
+    assert info.value.code == "InvalidResponse"
+    assert info.value.retryable
+
+
+def test_non_dict_body_is_a_retryable_error():
+    client = make_client(httpx.MockTransport(lambda request: httpx.Response(200, json=[1, 2])))
+    with pytest.raises(DashScopeAPIError) as info:
+        client.generate(MODEL, MESSAGES)
+    assert info.value.code == "InvalidResponse"
+    assert info.value.retryable
+
+
+# --- Sync / async parity -----------------------------------------------------
+
+PARITY_CASES = [
+    ("generate", ["你好"]),
+    ("stream_generate", ["你好，世界"]),
+    ("generate", [{"status": 429, "code": "Throttling"}, "重试成功"]),
+    ("generate", [{"status": 400, "code": "InvalidParameter", "message": "bad"}]),
+    ("generate", [{"status": 500, "code": "InternalError"}]),
+    ("stream_generate", [httpx.ConnectError("refused"), "连上了"]),
+    ("stream_generate", [{"status": 401, "code": "InvalidApiKey"}]),
+]
+
+
+def outcome(runner, client, method):
+    try:
+        return "ok", runner(client, method, MESSAGES)
+    except DashScopeAPIError as exc:
+        return type(exc).__name__, (exc.code, exc.status_code, exc.retryable)
+
+
+@pytest.mark.parametrize("method,replies", PARITY_CASES)
+def test_sync_and_async_clients_agree(method, replies):
+    sync_client, async_client = make_client(replies), make_client(replies, async_client=True)
+    assert outcome(run_sync, sync_client, method) == outcome(run_async, async_client, method)
+    assert len(sync_client.transport.requests) == len(async_client.transport.requests)
+    assert sync_client.breaker(MODEL).state == async_client.breaker(MODEL).state